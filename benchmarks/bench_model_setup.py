@@ -0,0 +1,57 @@
+"""
+Micro-benchmark: per-call Gemini client/model setup cost (no network).
+
+    python benchmarks/bench_model_setup.py [iterations]
+
+"per-call" reproduces the old behaviour of generate_ris_data: genai.configure() + a new
+GenerativeModel + a new service client for every file. "pooled" is the ModelPool lookup
+used now. Only setup is timed; no request is sent.
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+
+from src.clients import ModelPool
+from src.processor import OUTPUT_SCHEMA, _generation_config, _shared_generation_config
+
+MODEL_NAME = "gemini-3-flash-preview"
+API_KEY = "benchmark-key"
+
+
+def per_call_setup():
+    genai.configure(api_key=API_KEY)
+    model = genai.GenerativeModel(MODEL_NAME, generation_config=_generation_config(OUTPUT_SCHEMA))
+    # generate_content() would create the client lazily on first use
+    model._client = genai_client.get_default_generative_client()
+    return model
+
+
+def pooled_setup(pool):
+    return pool.get_model(API_KEY, MODEL_NAME, _shared_generation_config(OUTPUT_SCHEMA))
+
+
+def bench(label, fn, iterations):
+    fn() # warm-up (imports, first channel)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    per_call_us = (time.perf_counter() - start) / iterations * 1e6
+    print(f"{label:<10} {per_call_us:10.1f} us/call")
+    return per_call_us
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    pool = ModelPool()
+    old = bench("per-call", per_call_setup, iterations)
+    new = bench("pooled", lambda: pooled_setup(pool), iterations)
+    print(f"speedup    {old / new:10.1f} x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+End-to-end benchmark: synthetic PDFs -> the real ProcessingWorker pipeline -> a local fake Gemini server.
+
+    python benchmarks/bench_pipeline.py --files 200 --workers 1,4,16,64 --latency lognormal:1.5,0.5 --err429 0.02
+    python benchmarks/bench_pipeline.py --workers 16 --context-cache on,off --prefill-ms 150 --cache-min-tokens 100
+    python benchmarks/bench_pipeline.py --workers 16 --schema full,compact --decode-ms 8000
+
+For every max_workers setting the pipeline runs in a fresh child process (so peak RSS is per run)
+with the result cache, manifests and skipping disabled. Reports files/sec, per-file latency
+percentiles (API stage start to result, retries and rate-limit waits included), peak RSS of the
+main and extraction processes, the calls the fake server saw and their average input tokens
+(uncached, read from a cached prompt prefix, and both together: what a call costs in input)
+and the run summary's output tokens per document.
+The same arguments and --seed give the same corpus and the same injected errors.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from synthetic_corpus import make_corpus, parse_range
+from fake_gemini import FakeGeminiServer
+
+MODEL_NAME = "gemini-3-flash-preview"
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def peak_rss_mb():
+    """
+    (this process, largest child process) peak RSS in MB; (None, None) where unsupported (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024 # ru_maxrss: bytes on macOS, KB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def run_child(args):
+    """
+    One pipeline run (inside the child process); prints a JSON result line.
+    """
+    from PySide6.QtCore import Qt
+    from src.clients import model_pool
+    from src.processor import context_cache
+    from src.worker import ProcessingWorker
+
+    model_pool.set_endpoint(args.endpoint)
+    context_cache.enabled = args.context_cache == "on"
+    files = sorted(os.path.join(args.corpus, name) for name in os.listdir(args.corpus) if name.endswith(".pdf"))
+
+    worker = ProcessingWorker(
+        files,
+        "benchmark-key",
+        MODEL_NAME,
+        max_workers=args.workers,
+        use_cache=False,
+        extract_workers=args.extract_workers,
+        rate_limits={"rpm": args.rpm, "tpm": args.tpm},
+        schema_mode=args.schema,
+    )
+    worker.set_skip_existing(False)
+    worker.engine.use_manifest = False
+
+    started = {}
+    latencies = []
+
+    def on_progress(current, total, filename):
+        started.setdefault(filename, time.perf_counter())
+
+    def on_result(res):
+        if res['filename'] in started:
+            latencies.append(time.perf_counter() - started[res['filename']])
+
+    worker.engine.on_progress = on_progress
+    worker.engine.on_result = on_result
+
+    summaries = []
+    # Emitted from the worker thread and there is no Qt event loop here: deliver it directly
+    worker.finished_processing.connect(summaries.append, Qt.DirectConnection)
+    t0 = time.perf_counter()
+    worker.start()
+    worker.wait()
+    elapsed = time.perf_counter() - t0
+
+    summary = summaries[0] if summaries else {}
+    # Extraction processes only count towards RUSAGE_CHILDREN once they have exited and been reaped
+    deadline = time.monotonic() + 10
+    while multiprocessing.active_children() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    rss_main, rss_children = peak_rss_mb()
+    print(json.dumps({
+        "workers": args.workers,
+        "context_cache": args.context_cache,
+        "schema": args.schema,
+        "files": len(files),
+        "seconds": elapsed,
+        "files_per_sec": len(files) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "rss_mb": rss_main,
+        "extract_rss_mb": rss_children,
+        "success": summary.get("success", 0) + summary.get("filename_only_success", 0),
+        "failed": summary.get("failed", 0),
+        "rate_limited": summary.get("rate_limited", 0),
+        "avg_output_tokens": summary.get("avg_output_tokens", 0.0),
+        "stage_seconds": summary.get("stage_seconds", {}),
+    }))
+
+
+def format_mb(value):
+    return "n/a" if value is None else f"{value:.0f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark against a fake Gemini server")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--pages", default="1-20", help="Page count range per PDF")
+    parser.add_argument("--image-only", type=float, default=0.1, help="Fraction of PDFs without a text layer")
+    parser.add_argument("--size-kb", default="0", help="File size range in KB (0 = text only)")
+    parser.add_argument("--corpus", help="Corpus folder (created if missing; default: a temporary folder)")
+    parser.add_argument("--workers", default="1,4,16,64", help="Comma-separated max_workers settings")
+    parser.add_argument("--extract-workers", type=int, default=None, help="Extraction processes (default: CPU count)")
+    parser.add_argument("--latency", default="lognormal:1.5,0.5", help="Fake API latency: const:S | uniform:A,B | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--err429", type=float, default=0.0, help="Fraction of calls answered with 429")
+    parser.add_argument("--err503", type=float, default=0.0, help="Fraction of calls answered with 503")
+    parser.add_argument("--prefill-ms", type=float, default=0.0, help="Fake API time-to-first-token per 1000 uncached input tokens")
+    parser.add_argument("--decode-ms", type=float, default=0.0, help="Fake API generation time per 1000 output tokens")
+    parser.add_argument("--context-cache", default="off", help="Comma-separated server-side prompt caching settings to run (on, off)")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024, help="Smallest prompt prefix the fake server caches (real models: 1024 or more)")
+    parser.add_argument("--schema", default="full", help="Comma-separated answer schemas to run (full, compact)")
+    parser.add_argument("--rpm", type=float, default=1e6, help="Client-side requests/min budget")
+    parser.add_argument("--tpm", type=float, default=1e9, help="Client-side tokens/min budget")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    # Internal: one run in a child process
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--endpoint", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.workers = int(args.workers)
+        run_child(args)
+        return
+
+    tmp = None
+    corpus = args.corpus
+    if corpus is None:
+        tmp = tempfile.TemporaryDirectory(prefix="ris-bench-")
+        corpus = tmp.name
+    if not (os.path.isdir(corpus) and any(name.endswith(".pdf") for name in os.listdir(corpus))):
+        make_corpus(corpus, args.files, parse_range(args.pages), args.image_only, parse_range(args.size_kb), args.seed)
+
+    server = FakeGeminiServer(latency=args.latency, err429=args.err429, err503=args.err503, seed=args.seed, prefill_ms=args.prefill_ms,
+                              decode_ms=args.decode_ms, cache_min_tokens=args.cache_min_tokens).start()
+    results = []
+    runs = [(workers, cache.strip(), schema.strip()) for schema in args.schema.split(",") if schema.strip()
+            for cache in args.context_cache.split(",") if cache.strip()
+            for workers in [int(w) for w in args.workers.split(",") if w.strip()]]
+    try:
+        print(f"{'workers':>7} {'cache':>5} {'schema':>7} {'files/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'RSS MB':>7} {'extr MB':>7} "
+              f"{'calls':>6} {'429':>5} {'503':>5} {'ok':>5} {'failed':>6} {'in tok':>7} {'cached':>7} {'in+cac':>7} {'out tok':>7}")
+        for workers, cache, schema in runs:
+            server.reset_stats()
+            server.expire_caches() # every run starts cold
+            cmd = [sys.executable, os.path.abspath(__file__), "--child", "--endpoint", server.endpoint, "--context-cache", cache, "--schema", schema,
+                   "--corpus", corpus, "--workers", str(workers), "--rpm", str(args.rpm), "--tpm", str(args.tpm)]
+            if args.extract_workers:
+                cmd += ["--extract-workers", str(args.extract_workers)]
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+            if proc.returncode != 0 or not lines:
+                print(f"run with {workers} workers failed:\n{proc.stderr[-2000:]}", file=sys.stderr)
+                continue
+            result = json.loads(lines[-1])
+            result["api"] = server.stats()
+            results.append(result)
+            api = result["api"]
+            calls = api['calls'] or 1
+            print(f"{workers:>7} {cache:>5} {schema:>7} {result['files_per_sec']:>8.2f} {result['p50']:>7.2f} {result['p95']:>7.2f} {result['p99']:>7.2f} "
+                  f"{format_mb(result['rss_mb']):>7} {format_mb(result['extract_rss_mb']):>7} "
+                  f"{api['calls']:>6} {api['429']:>5} {api['503']:>5} {api['ok']:>5} {result['failed']:>6} "
+                  f"{api['prompt_tokens'] / calls:>7.0f} {api['cached_tokens'] / calls:>7.0f} {(api['prompt_tokens'] + api['cached_tokens']) / calls:>7.0f} "
+                  f"{result['avg_output_tokens']:>7.0f}")
+    finally:
+        server.stop()
+        if tmp is not None:
+            tmp.cleanup()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k not in ("child", "endpoint")}, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
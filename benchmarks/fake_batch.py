@@ -0,0 +1,210 @@
+"""
+Local stand-in for the Gemini Batch API (Files API upload, batchGenerateContent, batch status,
+results download) over plain HTTP, for tests and dry runs of --batch.
+
+Jobs report BATCH_STATE_RUNNING for the first `polls` status checks, then succeed with a results
+file answered like fake_gemini.py does. error_rate turns that fraction of lines into error lines.
+
+    python benchmarks/fake_batch.py --port 8765 --polls 2
+    python -m src.cli --batch --batch-url http://127.0.0.1:8765 --batch-poll 1 folder/
+"""
+import argparse
+import http.server
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+from fake_gemini import fake_response
+
+BATCH_RE = re.compile(r'^/v1beta/models/([^/:]+):batchGenerateContent$')
+
+
+class FakeBatchServer:
+    """
+    Runs on its own thread; counters are read with stats().
+    """
+
+    def __init__(self, port: int = 0, polls: int = 1, error_rate: float = 0.0, seed: int = None):
+        self.port = port
+        self.polls = polls
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock() # _run_batch runs under it from the status handler
+        self._uploads = {} # upload id -> display name
+        self._files = {} # file name -> bytes
+        self._batches = {} # batch name -> {"model", "file", "polls", "state", "output"}
+        self._counts = {"uploads": 0, "batches": 0, "polls": 0, "downloads": 0, "requests": 0}
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", self.port), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="fake-batch", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+    def _run_batch(self, batch: dict) -> str:
+        """
+        Answers every request of the batch's input file; returns the results file name.
+        """
+        lines = []
+        for line in self._files[batch["file"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            prompt = "".join(part.get("text", "") for content in item["request"]["contents"] for part in content["parts"])
+            with self._lock:
+                self._counts["requests"] += 1
+                failed = self._rng.random() < self.error_rate
+            if failed:
+                lines.append({"key": item["key"], "error": {"code": 500, "message": "Internal error encountered."}})
+            else:
+                lines.append({"key": item["key"], "response": {
+                    "candidates": [{"content": {"parts": [{"text": fake_response(prompt)}], "role": "model"}, "finishReason": "STOP"}],
+                    "usageMetadata": {"promptTokenCount": len(prompt) // 4},
+                }})
+        name = f"{batch['file']}-results"
+        self._files[name] = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+        return name
+
+    def _status(self, name: str) -> dict:
+        batch = self._batches[name]
+        body = {"name": name, "metadata": {"@type": "type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatch",
+                                           "name": name, "model": f"models/{batch['model']}", "state": batch["state"]}}
+        if batch["state"] == "BATCH_STATE_SUCCEEDED":
+            body["done"] = True
+            body["response"] = {"@type": "type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatchOutput",
+                                "responsesFile": batch["output"]}
+        return body
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def _reply(self, status, body=None, headers=None, raw=None):
+                data = raw if raw is not None else json.dumps(body or {}).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json" if raw is None else "application/octet-stream")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def _authorized(self):
+                if self.headers.get("x-goog-api-key"):
+                    return True
+                self._reply(403, {"error": {"code": 403, "message": "Method doesn't allow unregistered callers."}})
+                return False
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                url = urllib.parse.urlsplit(self.path)
+                query = urllib.parse.parse_qs(url.query)
+                body = self._body()
+                if url.path == "/upload/v1beta/files" and "upload_id" not in query:
+                    with server._lock:
+                        upload_id = str(len(server._uploads) + 1)
+                        server._uploads[upload_id] = json.loads(body or b"{}").get("file", {}).get("display_name")
+                    self._reply(200, {}, {"X-Goog-Upload-URL": f"{server.base_url}/upload/v1beta/files?upload_id={upload_id}"})
+                elif url.path == "/upload/v1beta/files":
+                    with server._lock:
+                        name = f"files/upload-{query['upload_id'][0]}"
+                        server._files[name] = body
+                        server._counts["uploads"] += 1
+                    self._reply(200, {"file": {"name": name, "mimeType": "application/jsonl", "sizeBytes": str(len(body)), "state": "ACTIVE"}})
+                elif BATCH_RE.match(url.path):
+                    request = json.loads(body)["batch"]
+                    file_name = request["input_config"]["file_name"]
+                    if file_name not in server._files:
+                        self._reply(400, {"error": {"code": 400, "message": f"File {file_name} not found."}})
+                        return
+                    with server._lock:
+                        server._counts["batches"] += 1
+                        name = f"batches/fake-{server._counts['batches']}"
+                        server._batches[name] = {"model": BATCH_RE.match(url.path).group(1), "file": file_name,
+                                                 "polls": 0, "state": "BATCH_STATE_PENDING", "output": None}
+                    self._reply(200, server._status(name))
+                else:
+                    self._reply(404, {"error": {"code": 404, "message": "Not found"}})
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                url = urllib.parse.urlsplit(self.path)
+                if url.path.startswith("/v1beta/batches/"):
+                    name = url.path[len("/v1beta/"):]
+                    if name not in server._batches:
+                        self._reply(404, {"error": {"code": 404, "message": "Batch not found"}})
+                        return
+                    with server._lock:
+                        server._counts["polls"] += 1
+                        batch = server._batches[name]
+                        batch["polls"] += 1
+                        if batch["state"] != "BATCH_STATE_SUCCEEDED":
+                            if batch["polls"] > server.polls:
+                                batch["output"] = server._run_batch(batch)
+                                batch["state"] = "BATCH_STATE_SUCCEEDED"
+                            else:
+                                batch["state"] = "BATCH_STATE_RUNNING"
+                        body = server._status(name)
+                    self._reply(200, body)
+                elif url.path.startswith("/download/v1beta/") and url.path.endswith(":download"):
+                    name = url.path[len("/download/v1beta/"):-len(":download")]
+                    if name not in server._files:
+                        self._reply(404, {"error": {"code": 404, "message": "File not found"}})
+                        return
+                    with server._lock:
+                        server._counts["downloads"] += 1
+                    self._reply(200, raw=server._files[name])
+                else:
+                    self._reply(404, {"error": {"code": 404, "message": "Not found"}})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini Batch API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--polls", type=int, default=1, help="Status checks a job stays running for")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an error line")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    server = FakeBatchServer(args.port, args.polls, args.error_rate, args.seed).start()
+    print(f"Fake Batch API listening on {server.base_url} (Ctrl-C to stop)", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(5)
+            print(json.dumps(server.stats()), file=sys.stderr)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
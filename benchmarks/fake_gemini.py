@@ -0,0 +1,301 @@
+"""
+Local stand-in for the Gemini GenerateContent API (plaintext gRPC), for benchmarks.
+
+Answers every request with a plausible JSON record after a sampled latency, and injects
+429 (RESOURCE_EXHAUSTED) / 503 (UNAVAILABLE) errors at configurable rates. Point the app at it
+with model_pool.set_endpoint(server.endpoint).
+
+Also serves the CacheService (cached prompt prefixes). Input tokens are counted per call (prompt,
+system instruction and response schema; tokens read from a cached prefix separately), and
+--prefill-ms adds time-to-first-token per 1000 uncached input tokens, so context caching shows
+up in both the token stats and the latency. --decode-ms does the same per 1000 output tokens, for
+comparing answer schemas (prompts asking for the compact schema get compact answers).
+
+    python benchmarks/fake_gemini.py --port 50051 --latency lognormal:1.5,0.5 --err429 0.02 --prefill-ms 150
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+import grpc
+import google.ai.generativelanguage as glm
+from google.protobuf import empty_pb2
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.backends import fake_record
+
+SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+CACHE_SERVICE = "google.ai.generativelanguage.v1beta.CacheService"
+CHARS_PER_TOKEN = 4
+
+FILENAME_RE = re.compile(r'^\s*Filename: (.+)$', re.MULTILINE)
+DOCUMENT_RE = re.compile(r'<<<DOCUMENT ID=(\w+)>>>\nFilename: (.+)')
+
+
+def parse_latency(spec: str):
+    """
+    'const:S', 'uniform:A,B' or 'lognormal:MEDIAN,SIGMA' (seconds) -> function(rng) -> seconds.
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v.strip()]
+    if kind == "const" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"bad latency spec: {spec!r} (const:S, uniform:A,B or lognormal:MEDIAN,SIGMA)")
+
+
+def fake_response(prompt: str, compact: bool = None) -> str:
+    documents = DOCUMENT_RE.findall(prompt)
+    if documents:
+        return json.dumps([{"ID": doc_id, **fake_record(name, prompt, compact)} for doc_id, name in documents])
+    m = FILENAME_RE.search(prompt)
+    return json.dumps(fake_record(m.group(1) if m else "document.pdf", prompt, compact))
+
+
+def _text(content) -> str:
+    return "".join(part.text for part in content.parts) if content else ""
+
+
+def _tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+class FakeGeminiServer:
+    """
+    Runs on its own thread and event loop; counters are read with stats().
+    """
+
+    def __init__(self, port: int = 0, latency: str = "const:0.5", err429: float = 0.0, err503: float = 0.0, seed: int = None,
+                 prefill_ms: float = 0.0, cache_min_tokens: int = 1024, decode_ms: float = 0.0):
+        self.port = port
+        self.latency = parse_latency(latency)
+        self.err429 = err429
+        self.err503 = err503
+        # Time-to-first-token per 1000 uncached input tokens; smaller cached prefixes are rejected
+        self.prefill_ms = prefill_ms
+        self.cache_min_tokens = cache_min_tokens
+        # Generation time per 1000 output tokens
+        self.decode_ms = decode_ms
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._caches = {} # name -> {"tokens": int, "expires": monotonic}
+        self._counts = {"calls": 0, "ok": 0, "429": 0, "503": 0, "prompt_tokens": 0, "cached_tokens": 0, "cached_calls": 0, "cache_creates": 0, "output_tokens": 0, "schema_calls": 0}
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def endpoint(self) -> str:
+        return f"127.0.0.1:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="fake-gemini", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._server.stop(None), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counts, "peak_in_flight": self._peak_in_flight}
+
+    def reset_stats(self):
+        with self._lock:
+            self._counts = dict.fromkeys(self._counts, 0)
+            self._peak_in_flight = 0
+
+    def expire_caches(self):
+        """
+        Drops every cached prefix, as if their TTL had run out.
+        """
+        with self._lock:
+            self._caches.clear()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._serve())
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _serve(self):
+        handler = grpc.method_handlers_generic_handler(SERVICE, {
+            "GenerateContent": grpc.unary_unary_rpc_method_handler(
+                self._generate_content,
+                request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize,
+            ),
+        })
+        cache_handler = grpc.method_handlers_generic_handler(CACHE_SERVICE, {
+            "CreateCachedContent": grpc.unary_unary_rpc_method_handler(
+                self._create_cached_content,
+                request_deserializer=glm.CreateCachedContentRequest.deserialize,
+                response_serializer=glm.CachedContent.serialize,
+            ),
+            "GetCachedContent": grpc.unary_unary_rpc_method_handler(
+                self._get_cached_content,
+                request_deserializer=glm.GetCachedContentRequest.deserialize,
+                response_serializer=glm.CachedContent.serialize,
+            ),
+            "UpdateCachedContent": grpc.unary_unary_rpc_method_handler(
+                self._update_cached_content,
+                request_deserializer=glm.UpdateCachedContentRequest.deserialize,
+                response_serializer=glm.CachedContent.serialize,
+            ),
+            "DeleteCachedContent": grpc.unary_unary_rpc_method_handler(
+                self._delete_cached_content,
+                request_deserializer=glm.DeleteCachedContentRequest.deserialize,
+                response_serializer=empty_pb2.Empty.SerializeToString,
+            ),
+        })
+        self._server = grpc.aio.server()
+        self._server.add_generic_rpc_handlers((handler, cache_handler))
+        self.port = self._server.add_insecure_port(self.endpoint)
+        await self._server.start()
+
+    # --- CacheService ---
+
+    def _cache_entry(self, name, now=None):
+        entry = self._caches.get(name)
+        if entry is None or entry["expires"] <= (now or time.monotonic()):
+            return None
+        return entry
+
+    def _cached_content(self, name, entry):
+        return glm.CachedContent(name=name, model=entry["model"], usage_metadata=glm.CachedContent.UsageMetadata(total_token_count=entry["tokens"]))
+
+    async def _create_cached_content(self, request, context):
+        cached = request.cached_content
+        instruction = _text(cached.system_instruction)
+        tokens = _tokens(instruction + "".join(_text(c) for c in cached.contents))
+        if tokens < self.cache_min_tokens:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                                f"Cached content is too small. total_token_count={tokens}, min_total_token_count={self.cache_min_tokens}")
+        ttl = cached.ttl.total_seconds() if "ttl" in cached else 3600
+        with self._lock:
+            self._counts["cache_creates"] += 1
+            name = f"cachedContents/fake-{self._counts['cache_creates']}"
+            self._caches[name] = {"tokens": tokens, "model": cached.model, "expires": time.monotonic() + ttl,
+                                  "compact": "COMPACT OUTPUT:" in instruction}
+            return self._cached_content(name, self._caches[name])
+
+    async def _get_cached_content(self, request, context):
+        with self._lock:
+            entry = self._cache_entry(request.name)
+        if entry is None:
+            await context.abort(grpc.StatusCode.NOT_FOUND, "CachedContent not found (or permission denied)")
+        return self._cached_content(request.name, entry)
+
+    async def _update_cached_content(self, request, context):
+        name = request.cached_content.name
+        with self._lock:
+            entry = self._cache_entry(name)
+            if entry is not None:
+                entry["expires"] = time.monotonic() + request.cached_content.ttl.total_seconds()
+        if entry is None:
+            await context.abort(grpc.StatusCode.NOT_FOUND, "CachedContent not found (or permission denied)")
+        return self._cached_content(name, entry)
+
+    async def _delete_cached_content(self, request, context):
+        with self._lock:
+            self._caches.pop(request.name, None)
+        return empty_pb2.Empty()
+
+    # --- GenerativeService ---
+
+    async def _generate_content(self, request, context):
+        prompt = "".join(_text(content) for content in request.contents)
+        tokens = _tokens(prompt + _text(request.system_instruction))
+        has_schema = "response_schema" in request.generation_config
+        if has_schema:
+            tokens += _tokens(glm.Schema.to_json(request.generation_config.response_schema, indent=None, always_print_fields_with_no_presence=False))
+        cached_tokens = 0
+        compact = "COMPACT OUTPUT:" in prompt + _text(request.system_instruction)
+        if request.cached_content:
+            with self._lock:
+                entry = self._cache_entry(request.cached_content)
+            if entry is None:
+                await context.abort(grpc.StatusCode.NOT_FOUND, "CachedContent not found (or permission denied)")
+            cached_tokens = entry["tokens"]
+            compact = compact or entry["compact"]
+        answer = fake_response(prompt, compact)
+        output_tokens = _tokens(answer)
+        with self._lock:
+            self._counts["calls"] += 1
+            self._counts["prompt_tokens"] += tokens
+            self._counts["cached_tokens"] += cached_tokens
+            self._counts["cached_calls"] += bool(cached_tokens)
+            self._counts["output_tokens"] += output_tokens
+            self._counts["schema_calls"] += has_schema
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+            delay = self.latency(self._rng) + self.prefill_ms * tokens / 1e6 + self.decode_ms * output_tokens / 1e6
+            roll = self._rng.random()
+        try:
+            await asyncio.sleep(max(0.0, delay))
+            if roll < self.err429:
+                with self._lock:
+                    self._counts["429"] += 1
+                await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Resource has been exhausted (e.g. check quota).")
+            if roll < self.err429 + self.err503:
+                with self._lock:
+                    self._counts["503"] += 1
+                await context.abort(grpc.StatusCode.UNAVAILABLE, "The model is overloaded. Please try again later.")
+
+            with self._lock:
+                self._counts["ok"] += 1
+            return glm.GenerateContentResponse(candidates=[glm.Candidate(
+                content=glm.Content(parts=[glm.Part(text=answer)], role="model"),
+                finish_reason=glm.Candidate.FinishReason.STOP,
+            )], usage_metadata=glm.GenerateContentResponse.UsageMetadata(
+                prompt_token_count=tokens + cached_tokens, cached_content_token_count=cached_tokens,
+                candidates_token_count=output_tokens))
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini API")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--latency", default="lognormal:1.5,0.5", help="const:S | uniform:A,B | lognormal:MEDIAN,SIGMA (seconds)")
+    parser.add_argument("--err429", type=float, default=0.0, help="Fraction of calls answered with 429")
+    parser.add_argument("--err503", type=float, default=0.0, help="Fraction of calls answered with 503")
+    parser.add_argument("--prefill-ms", type=float, default=0.0, help="Extra latency per 1000 uncached input tokens (time to first token)")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024, help="Smallest prefix the CacheService accepts")
+    parser.add_argument("--decode-ms", type=float, default=0.0, help="Extra latency per 1000 output tokens")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(args.port, args.latency, args.err429, args.err503, args.seed, args.prefill_ms, args.cache_min_tokens, args.decode_ms).start()
+    print(f"Fake Gemini listening on {server.endpoint} (Ctrl-C to stop)", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(5)
+            print(json.dumps(server.stats()), file=sys.stderr)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Deterministic synthetic PDF corpus for benchmarks (no dependencies; PDFs are written by hand).
+
+    python benchmarks/synthetic_corpus.py OUT_DIR --files 500 --pages 1-40 --image-only 0.1 --size-kb 20-800
+
+Text documents get a title page (title, authors, journal, DOI, abstract) followed by body pages;
+image-only documents have no text layer, like unOCRed scans. File sizes are reached by an
+uncompressed image drawn on every page.
+"""
+import argparse
+import os
+import random
+
+WORDS = ("analysis model data method result study system effect process design network structure "
+         "learning theory control sample measure signal energy protein cell market policy").split()
+
+
+def parse_range(spec: str):
+    low, _, high = spec.partition("-")
+    return int(low), int(high or low)
+
+
+def _escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _text_ops(lines) -> str:
+    return "BT /F1 10 Tf 50 750 Td 12 TL " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+
+
+def _sentence(rng, words=12) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def document_pages(rng, index: int, pages: int, image_only: bool):
+    """
+    Returns the text lines of each page (empty lists for an image-only document).
+    """
+    if image_only:
+        return [[] for _ in range(pages)]
+    title = " ".join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(4, 9)))
+    first = [
+        title,
+        "Jane Doe, Ken Sato and Maria Rossi",
+        f"Journal of Synthetic Studies, Vol. {rng.randint(1, 60)}, {rng.randint(1990, 2025)}",
+        f"doi:10.5555/synthetic.{index:06d}",
+        "Abstract",
+    ] + [_sentence(rng) for _ in range(20)]
+    body = [[f"{n + 2}"] + [_sentence(rng) for _ in range(45)] for n in range(pages - 1)]
+    return [first] + body
+
+
+def write_pdf(path: str, page_lines, image_bytes: int, rng):
+    objects = []
+
+    def add(data):
+        objects.append(data)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    image = None
+    if image_bytes > 0:
+        side = max(1, int(image_bytes ** 0.5))
+        pixels = rng.randbytes(side * side) # incompressible, so the file really has this size
+        image = add(b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray /BitsPerComponent 8 /Length %d >>\nstream\n"
+                    % (side, side, len(pixels)) + pixels + b"\nendstream")
+
+    pages_id = len(objects) + 2 * len(page_lines) + 1
+    kids = []
+    for lines in page_lines:
+        ops = ("q 512 0 0 692 50 50 cm /Im1 Do Q " if image else "") + (_text_ops(lines) if lines else "")
+        data = ops.encode("latin-1")
+        content = add(b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream")
+        resources = b"/Font << /F1 %d 0 R >>" % font + (b" /XObject << /Im1 %d 0 R >>" % image if image else b"")
+        kids.append(add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R /Resources << %s >> >>"
+                        % (pages_id, content, resources)))
+    add(b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % k for k in kids) + b"] /Count %d >>" % len(kids))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for n, data in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % n + data + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def make_corpus(out_dir: str, files: int = 100, pages=(1, 20), image_only: float = 0.1, size_kb=(0, 0), seed: int = 0):
+    """
+    Writes `files` PDFs into out_dir and returns their paths (same arguments -> same corpus).
+    size_kb: target file size range; 0 = text only (a few KB per page).
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i in range(files):
+        is_image_only = rng.random() < image_only
+        lines = document_pages(rng, i, rng.randint(*pages), is_image_only)
+        target = rng.randint(*size_kb) * 1024 if size_kb[1] else 0
+        path = os.path.join(out_dir, f"synthetic_{i:05d}.pdf")
+        write_pdf(path, lines, target, rng)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic PDF corpus")
+    parser.add_argument("out_dir")
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--pages", default="1-20", help="Page count range, e.g. 1-40")
+    parser.add_argument("--image-only", type=float, default=0.1, help="Fraction of documents without a text layer")
+    parser.add_argument("--size-kb", default="0", help="File size range in KB, e.g. 20-800 (0 = text only)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = make_corpus(args.out_dir, args.files, parse_range(args.pages), args.image_only, parse_range(args.size_kb), args.seed)
+    print(f"{len(paths)} PDFs written to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import sys
+import multiprocessing
 from PySide6.QtWidgets import QApplication
 from src.gui import MainWindow
 
@@ -9,4 +10,6 @@ def main():
     sys.exit(app.exec())
 
 if __name__ == "__main__":
+    # Required for the extraction process pool in frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
     main()
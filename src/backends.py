@@ -0,0 +1,307 @@
+"""
+LLM backends behind generate_ris_data*: Gemini (default), any OpenAI-compatible HTTP server
+(llama.cpp, vLLM, Ollama, ...) and a deterministic fake for tests.
+
+Selected per run from config.json, e.g.
+
+    "backend": {"type": "openai", "base_url": "http://localhost:8000/v1", "model": "qwen2.5-7b-instruct",
+                "max_concurrency": 8, "timeout": 120}
+
+A backend receives the finished prompt and JSON schema and returns the parsed JSON (or None),
+raising errors whose text carries the HTTP status ("429 ...", "503 ...") so the engine's retry
+and error-code logic treats every backend alike.
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import http.client
+import json
+import os
+import queue
+import re
+import socket
+import threading
+import time
+import typing
+import urllib.parse
+import zlib
+
+from .processor import _call_gemini, _call_gemini_async
+
+BACKEND_TYPES = ("gemini", "openai", "fake")
+
+# Local servers have no quota; the engine's scheduler still needs numbers
+UNLIMITED_RATE_LIMITS = {"rpm": 1000000, "tpm": 1000000000}
+
+
+class LLMBackend:
+    """
+    Interface: generate() / generate_async() take (prompt, schema, model_name) and return parsed JSON or None.
+    """
+    name = "base"
+    # Per-model limits for the request scheduler (None = the Gemini table in config.py)
+    rate_limits = None
+    # Requests in flight at once (None = only the engine's max_workers applies)
+    max_concurrency = None
+    # Keys results apart in the result cache; None = plain model name (Gemini, backwards compatible)
+    cache_prefix = None
+
+    def model_for(self, model_name: str) -> str:
+        return model_name
+
+    def cache_name(self, model_name: str) -> str:
+        model = self.model_for(model_name)
+        return f"{self.cache_prefix}:{model}" if self.cache_prefix else model
+
+    def generate(self, prompt: str, schema: dict, model_name: str):
+        raise NotImplementedError
+
+    async def generate_async(self, prompt: str, schema: dict, model_name: str):
+        return await asyncio.to_thread(self.generate, prompt, schema, model_name)
+
+    def close(self):
+        pass
+
+
+class GeminiBackend(LLMBackend):
+    """
+    google.generativeai through the shared ModelPool (pooled clients per API key).
+    """
+    name = "gemini"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    def generate(self, prompt, schema, model_name):
+        return _call_gemini(prompt, self.api_key, model_name, schema)
+
+    async def generate_async(self, prompt, schema, model_name):
+        return await _call_gemini_async(prompt, self.api_key, model_name, schema)
+
+
+class _ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections to one server, reused LIFO; at most `size` exist at once.
+    """
+
+    def __init__(self, base_url: str, size: int, timeout: float):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.https = parsed.scheme == "https"
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method: str, path: str, body: bytes, headers: dict):
+        """
+        Returns (status, body bytes). Retries once on a stale keep-alive connection.
+        """
+        with self._slots:
+            for attempt in range(2):
+                try:
+                    conn = self._idle.get_nowait()
+                    reused = True
+                except queue.Empty:
+                    conn = self._connect()
+                    reused = False
+                try:
+                    conn.request(method, self.path + path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    data = response.read()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    conn.close()
+                    if reused and attempt == 0:
+                        continue # server closed an idle connection
+                    raise
+                except BaseException:
+                    conn.close()
+                    raise
+                if response.will_close:
+                    conn.close()
+                else:
+                    self._idle.put(conn)
+                return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+FENCE_RE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$')
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    POST {base_url}/chat/completions with a JSON-schema response format (llama.cpp server, vLLM, Ollama, ...).
+    Requests run on the backend's own thread pool over its own keep-alive connections;
+    both are sized by max_concurrency.
+    """
+    name = "openai"
+
+    def __init__(self, base_url: str, model: str = None, api_key: str = None, max_concurrency: int = 8,
+                 timeout: float = 120.0, rate_limits: dict = None, response_format: str = "json_schema"):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY", "")
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.timeout = timeout
+        self.rate_limits = rate_limits or UNLIMITED_RATE_LIMITS
+        self.response_format = response_format
+        self.cache_prefix = "openai:" + self.base_url
+        self._pool = _ConnectionPool(self.base_url, self.max_concurrency, timeout)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="llm-http")
+
+    def model_for(self, model_name):
+        return self.model or model_name
+
+    def build_request(self, prompt: str, schema: dict, model_name: str) -> dict:
+        body = {
+            "model": self.model_for(model_name),
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.1,
+        }
+        if self.response_format == "json_schema":
+            body["response_format"] = {"type": "json_schema", "json_schema": {"name": "ris_record", "schema": schema}}
+        elif self.response_format == "json_object":
+            body["response_format"] = {"type": "json_object"}
+        return body
+
+    def generate(self, prompt, schema, model_name):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        body = json.dumps(self.build_request(prompt, schema, model_name)).encode("utf-8")
+        try:
+            status, data = self._pool.request("POST", "/chat/completions", body, headers)
+        except (socket.timeout, TimeoutError) as e:
+            raise Exception(f"DeadlineExceeded: {e}")
+
+        if status != 200:
+            # Keep the status code in the text: the engine maps 429 / 5xx to RATE_LIMIT / TIMEOUT
+            raise Exception(f"{status} {data[:300].decode('utf-8', 'replace')}")
+        try:
+            choices = json.loads(data)["choices"]
+            content = choices[0]["message"]["content"] if choices else None
+        except (ValueError, KeyError, IndexError, TypeError):
+            raise Exception("AI_EMPTY_RESPONSE")
+        if not content or not content.strip():
+            print("Backend returned empty content.")
+            raise Exception("AI_EMPTY_RESPONSE")
+        try:
+            return json.loads(FENCE_RE.sub("", content))
+        except json.JSONDecodeError:
+            print("Failed to parse JSON response")
+            return None
+
+    async def generate_async(self, prompt, schema, model_name):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.generate, prompt, schema, model_name)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._pool.close()
+
+
+def fake_record(filename: str, prompt: str = "", compact: bool = None) -> dict:
+    """
+    Plausible record derived from the filename; the year is a checksum of the prompt, so equal prompts give equal answers.
+    compact: answer in the compact shape (default: when the prompt asks for it).
+    """
+    if compact is None:
+        compact = "COMPACT OUTPUT:" in prompt
+    stem = os.path.splitext(filename.strip())[0]
+    high = (lambda value: {"v": value, "c": "h"}) if compact else (lambda value: {"value": value, "confidence": "high"})
+    authors = ["Doe, Jane", "Sato, Ken"]
+    return {
+        "TY": high("JOUR"),
+        "TI": high(f"Synthetic Study of {stem}"),
+        "AU": high(authors) if compact else [high(name) for name in authors],
+        "PY": high(str(1990 + zlib.crc32(prompt.encode("utf-8")) % 35)),
+        "JO": high("Journal of Synthetic Studies"),
+    }
+
+
+class FakeBackend(LLMBackend):
+    """
+    Deterministic offline backend for tests and dry runs: the answer depends only on the prompt.
+    Records every prompt in .calls.
+    """
+    name = "fake"
+    rate_limits = UNLIMITED_RATE_LIMITS
+    cache_prefix = "fake"
+
+    def __init__(self, latency: float = 0.0, fail_every: int = 0):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _answer(self, prompt, schema):
+        with self._lock:
+            self.calls.append(prompt)
+            count = len(self.calls)
+        if self.fail_every and count % self.fail_every == 0:
+            raise Exception("503 fake backend: injected failure")
+        documents = re.findall(r'<<<DOCUMENT ID=(\w+)>>>\nFilename: (.+)', prompt)
+        if documents:
+            return [{"ID": doc_id, **fake_record(name, prompt)} for doc_id, name in documents]
+        m = re.search(r'^\s*Filename: (.+)$', prompt, re.MULTILINE)
+        record = fake_record(m.group(1) if m else "document.pdf", prompt)
+        if schema.get("type") == "object":
+            record = {k: v for k, v in record.items() if k in schema.get("properties", {})}
+        return record
+
+    def generate(self, prompt, schema, model_name):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._answer(prompt, schema)
+
+    async def generate_async(self, prompt, schema, model_name):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._answer(prompt, schema)
+
+
+# --- Selection ---
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def create_backend(spec: dict = None, api_key: str = "") -> LLMBackend:
+    """
+    Builds a backend from a config "backend" dict ({"type": "gemini" | "openai" | "fake", ...}).
+    Backends are cached per spec, so their connection pools outlive a single run.
+    """
+    spec = dict(spec or {})
+    kind = spec.pop("type", "gemini")
+    if kind not in BACKEND_TYPES:
+        raise ValueError(f"unknown backend type {kind!r} (expected one of {', '.join(BACKEND_TYPES)})")
+    key = hashlib.sha1(json.dumps([kind, spec, api_key if kind == "gemini" else ""], sort_keys=True).encode("utf-8")).hexdigest()
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            if kind == "gemini":
+                backend = GeminiBackend(api_key)
+            elif kind == "openai":
+                if not spec.get("base_url"):
+                    raise ValueError("openai backend needs a base_url (e.g. http://localhost:8000/v1)")
+                backend = OpenAICompatibleBackend(**{k: v for k, v in spec.items() if k in (
+                    "base_url", "model", "api_key", "max_concurrency", "timeout", "rate_limits", "response_format")})
+            else:
+                backend = FakeBackend(**{k: v for k, v in spec.items() if k in ("latency", "fail_every")})
+            _backends[key] = backend
+        return backend
+
+
+def backend_type(spec: dict = None) -> str:
+    return (spec or {}).get("type", "gemini")
@@ -0,0 +1,425 @@
+"""
+Gemini Batch API mode for large offline jobs.
+
+Instead of one generate_content call per PDF, every prompt generate_ris_data would send is written
+into one JSONL file, uploaded and submitted as a batch job. Batch jobs run on Google's side within
+about a day at a lower price and with their own quota, so there is no client-side rate limiting.
+
+The job moves through these phases, each saved to a JSON state file before the next starts, so an
+interrupted run (Ctrl-C, reboot, --batch-no-wait) picks up where it stopped:
+
+    prepared  - requests.jsonl written (extraction + build_prompt for every PDF that needs the API)
+    uploaded  - the JSONL file is on the Files API
+    submitted - the batch job exists; polled until it reaches a terminal state
+    done      - the results file is downloaded
+    collected - the .ris files are written (by a normal engine run fed with the batch results)
+    failed    - the job failed, was cancelled or expired
+
+Only the Gemini REST endpoints are used (the installed google.generativeai SDK has no batch
+support); base_url can point at a local stand-in (see benchmarks/fake_batch.py).
+"""
+import collections
+import concurrent.futures
+import json
+import os
+import shutil
+import socket
+import time
+import typing
+import urllib.error
+import urllib.request
+
+from .cache import ResultCache, make_cache_key
+from .config import get_config_path
+from .metadata_index import MetadataIndex
+from .processor import build_prompt, estimate_tokens, expand_record, output_schema, _generation_config, OUTPUT_SCHEMA
+
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com"
+API_VERSION = "v1beta"
+STATE_FILENAME = "batch_job.json"
+# Seconds between status checks; jobs take minutes to hours
+DEFAULT_POLL_SECONDS = 60.0
+
+PREPARED, UPLOADED, SUBMITTED, DONE, COLLECTED, FAILED = "prepared", "uploaded", "submitted", "done", "collected", "failed"
+FINISHED = (COLLECTED, FAILED)
+
+# Terminal job states (the REST API reports BATCH_STATE_*, the newer SDK JOB_STATE_*)
+SUCCEEDED_STATES = ("BATCH_STATE_SUCCEEDED", "JOB_STATE_SUCCEEDED")
+FAILED_STATES = ("BATCH_STATE_FAILED", "BATCH_STATE_CANCELLED", "BATCH_STATE_EXPIRED",
+                 "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED")
+
+
+def get_default_state_path():
+    # Lives next to config.json (AppData / ~/.risgenerator)
+    return os.path.join(os.path.dirname(get_config_path()), STATE_FILENAME)
+
+
+class BatchError(Exception):
+    pass
+
+
+def rest_schema(schema: dict) -> dict:
+    """
+    OUTPUT_SCHEMA in the REST API's form (type names are enum values: OBJECT, STRING, ...).
+    """
+    if isinstance(schema, list):
+        return [rest_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    converted = {}
+    for key, value in schema.items():
+        if key == "type" and isinstance(value, str):
+            converted[key] = value.upper()
+        elif key == "properties":
+            converted[key] = {name: rest_schema(prop) for name, prop in value.items()}
+        else:
+            converted[key] = rest_schema(value)
+    return converted
+
+
+def request_line(key: str, prompt: str, schema: dict = OUTPUT_SCHEMA) -> dict:
+    """
+    One line of the batch input file: a GenerateContentRequest with the engine's generation config.
+    """
+    config = _generation_config(rest_schema(schema))
+    return {
+        "key": key,
+        "request": {
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generationConfig": {
+                "temperature": config["temperature"],
+                "responseMimeType": config["response_mime_type"],
+                "responseSchema": config["response_schema"],
+            },
+        },
+    }
+
+
+def parse_response(response: dict):
+    """
+    Parsed JSON of a GenerateContentResponse (REST form), like processor._parse_response.
+    """
+    candidates = (response or {}).get("candidates") or []
+    parts = ((candidates[0].get("content") or {}).get("parts") or []) if candidates else []
+    if not parts:
+        raise Exception("AI_EMPTY_RESPONSE")
+    text = "".join(part.get("text", "") for part in parts)
+    if not text.strip():
+        raise Exception("AI_EMPTY_RESPONSE")
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        raise Exception("AI_NULL")
+
+
+class BatchClient:
+    """
+    Files API upload, batchGenerateContent, batch status and results download over plain HTTPS.
+    """
+
+    def __init__(self, api_key: str, base_url: str = None, timeout: float = 300.0):
+        self.api_key = api_key
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self.timeout = timeout
+
+    def _open(self, method: str, url: str, body=None, headers: dict = None):
+        if not url.startswith(("http://", "https://")):
+            url = self.base_url + url
+        request = urllib.request.Request(url, data=body, method=method, headers={"x-goog-api-key": self.api_key, **(headers or {})})
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            # Keep the status in the text, like the other backends
+            raise BatchError(f"{e.code} {e.read()[:300].decode('utf-8', 'replace')}")
+        except (urllib.error.URLError, socket.timeout, TimeoutError) as e:
+            raise BatchError(f"{url}: {e}")
+
+    def _json(self, method: str, url: str, payload: dict = None) -> dict:
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        with self._open(method, url, body, {"Content-Type": "application/json"} if body else None) as response:
+            return json.loads(response.read() or b"{}")
+
+    def upload(self, path: str, display_name: str) -> str:
+        """
+        Uploads a JSONL file (resumable protocol, one chunk). Returns its name, e.g. 'files/abc123'.
+        """
+        size = os.path.getsize(path)
+        start = self._open("POST", f"/upload/{API_VERSION}/files", json.dumps({"file": {"display_name": display_name}}).encode("utf-8"), {
+            "Content-Type": "application/json",
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Header-Content-Length": str(size),
+            "X-Goog-Upload-Header-Content-Type": "application/jsonl",
+        })
+        with start:
+            upload_url = start.headers.get("X-Goog-Upload-URL")
+        if not upload_url:
+            raise BatchError("upload was not accepted (no upload URL)")
+        with open(path, "rb") as f:
+            with self._open("POST", upload_url, f, {
+                "Content-Length": str(size),
+                "X-Goog-Upload-Offset": "0",
+                "X-Goog-Upload-Command": "upload, finalize",
+            }) as response:
+                info = json.loads(response.read())
+        return info["file"]["name"]
+
+    def create(self, model_name: str, file_name: str, display_name: str) -> dict:
+        model = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        return self._json("POST", f"/{API_VERSION}/{model}:batchGenerateContent", {
+            "batch": {"display_name": display_name, "input_config": {"file_name": file_name}}
+        })
+
+    def get(self, batch_name: str) -> dict:
+        return self._json("GET", f"/{API_VERSION}/{batch_name}")
+
+    def download(self, file_name: str, path: str):
+        tmp = path + ".tmp"
+        with self._open("GET", f"/download/{API_VERSION}/{file_name}:download?alt=media") as response, open(tmp, "wb") as f:
+            shutil.copyfileobj(response, f, 1 << 20)
+        os.replace(tmp, path)
+
+
+def batch_state(batch: dict) -> str:
+    return (batch.get("metadata") or {}).get("state") or batch.get("state") or ""
+
+
+def _extract_documents(engine, files, with_hash):
+    """
+    Runs the engine's extraction stage; yields (path, doc) in order with only a few documents per
+    worker held at once (the prompts go straight to disk).
+    """
+    try:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=engine.extract_workers)
+    except (NotImplementedError, OSError):
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=engine.extract_workers)
+    window = collections.deque()
+
+    def result(path, future):
+        try:
+            return path, future.result()
+        except Exception as e:
+            print(f"Extraction Error ({os.path.basename(path)}): {e}")
+            return path, {"text": "", "content_hash": None, "identifiers": {}}
+
+    with pool:
+        for path in files:
+            window.append((path, pool.submit(engine.extraction_job(path, with_hash))))
+            if len(window) >= 4 * engine.extract_workers:
+                yield result(*window.popleft())
+        while window:
+            yield result(*window.popleft())
+
+
+class BatchJob:
+    """
+    One batch job and its state file. Every step is safe to call again: steps already done are skipped.
+    """
+
+    def __init__(self, state_path: str = None):
+        self.state_path = state_path or get_default_state_path()
+        self.state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    @property
+    def phase(self) -> typing.Optional[str]:
+        return self.state.get("phase")
+
+    @property
+    def model_name(self) -> typing.Optional[str]:
+        return self.state.get("model")
+
+    @property
+    def paths(self) -> typing.List[str]:
+        """
+        Every PDF of the job in input order (also those that needed no request).
+        """
+        return list(self.state.get("files", []))
+
+    @property
+    def requests_path(self) -> str:
+        return os.path.splitext(self.state_path)[0] + ".requests.jsonl"
+
+    @property
+    def results_path(self) -> str:
+        return os.path.splitext(self.state_path)[0] + ".results.jsonl"
+
+    def _save(self):
+        self.state["updated"] = time.time()
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.state_path)
+
+    def prepare(self, engine, files) -> int:
+        """
+        Writes the batch input for engine's settings (extraction, model, cache, indexes).
+        PDFs the run would skip (skip_existing with the folder manifests), a cached result, complete embedded metadata
+        or an offline index record get no request; the collecting run resolves them locally.
+        Returns the number of requests.
+        """
+        files = [os.path.abspath(path) for path in files]
+        cache = None
+        index = None
+        requests = {}
+        prompt_tokens = 0
+        tmp = self.requests_path + ".tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(tmp)), exist_ok=True)
+        try:
+            if engine.use_cache:
+                try:
+                    cache = ResultCache()
+                except Exception as e:
+                    print(f"Result cache unavailable: {e}")
+            if engine.metadata_index_path and os.path.exists(engine.metadata_index_path):
+                index = MetadataIndex(engine.metadata_index_path)
+
+            # Same skip decision (folder manifests) as the collecting run
+            todo = [path for path, _ in engine.pending_files(files)]
+            with open(tmp, "w", encoding="utf-8") as f:
+                for path, doc in _extract_documents(engine, todo, cache is not None):
+                    basename = os.path.basename(path)
+                    use_filename_mode = not doc["text"].strip()
+                    if not use_filename_mode and (engine._complete_pdf_fields(doc) or
+                                                  (index and doc.get("identifiers") and index.resolve(doc["text"], doc["identifiers"]))):
+                        continue
+                    if cache is not None and doc.get("content_hash"):
+                        key = make_cache_key(doc["content_hash"], engine.model_key(), use_filename_mode, engine.prompt_version, basename)
+                        if cache.get(key) is not None:
+                            continue
+                    key = str(len(requests))
+                    prompt = build_prompt(doc["text"], basename, use_filename_mode, schema_mode=engine.schema_mode)
+                    prompt_tokens += estimate_tokens(prompt)
+                    f.write(json.dumps(request_line(key, prompt, output_schema(engine.schema_mode)), ensure_ascii=False) + "\n")
+                    requests[key] = path
+            os.replace(tmp, self.requests_path)
+        finally:
+            if cache is not None:
+                cache.close()
+            if index is not None:
+                index.close()
+
+        self.state = {
+            "phase": PREPARED,
+            "created": time.time(),
+            "model": engine.model_name,
+            "files": files,
+            "requests": requests,
+            "prompt_tokens": prompt_tokens,
+        }
+        self._save()
+        print(f"Batch prepared: {len(requests)} requests (~{prompt_tokens} prompt tokens) for {len(files)} PDFs")
+        return len(requests)
+
+    def submit(self, client: BatchClient):
+        """
+        Uploads the input file and creates the batch job (each step only once).
+        """
+        if self.phase == PREPARED:
+            display_name = f"risgenerator-{int(self.state['created'])}"
+            self.state["file"] = client.upload(self.requests_path, display_name)
+            self.state["phase"] = UPLOADED
+            self._save()
+        if self.phase == UPLOADED:
+            batch = client.create(self.model_name, self.state["file"], f"risgenerator-{int(self.state['created'])}")
+            self.state["batch"] = batch["name"]
+            self.state["batch_state"] = batch_state(batch)
+            self.state["phase"] = SUBMITTED
+            self._save()
+            print(f"Batch submitted: {self.state['batch']}")
+
+    def poll(self, client: BatchClient) -> bool:
+        """
+        Checks the job once; downloads the results when it has succeeded. True once the job is finished.
+        """
+        if self.phase != SUBMITTED:
+            return self.phase in (DONE,) + FINISHED
+        batch = client.get(self.state["batch"])
+        state = batch_state(batch)
+        if state != self.state.get("batch_state"):
+            print(f"Batch {self.state['batch']}: {state}")
+        self.state["batch_state"] = state
+        if state in SUCCEEDED_STATES:
+            self._fetch(client, batch)
+            self.state["phase"] = DONE
+        elif state in FAILED_STATES:
+            self.state["phase"] = FAILED
+            self.state["error"] = (batch.get("error") or {}).get("message") or state
+        self._save()
+        return self.phase != SUBMITTED
+
+    def wait(self, client: BatchClient, poll_seconds: float = DEFAULT_POLL_SECONDS, stop=None) -> bool:
+        """
+        Polls until the job is finished. stop: optional threading.Event; returns False if it was set first.
+        Status check errors (network, 5xx) are retried on the next poll.
+        """
+        while True:
+            try:
+                if self.poll(client):
+                    return True
+            except BatchError as e:
+                print(f"Batch status check failed, retrying: {e}")
+            if stop is not None:
+                if stop.wait(poll_seconds):
+                    return False
+            else:
+                time.sleep(poll_seconds)
+
+    def _fetch(self, client: BatchClient, batch: dict):
+        output = batch.get("response") or (batch.get("metadata") or {}).get("output") or {}
+        if output.get("responsesFile"):
+            client.download(output["responsesFile"], self.results_path)
+            return
+        # Small jobs may answer inline: stored in the same per-line form as a results file
+        inlined = (output.get("inlinedResponses") or {}).get("inlinedResponses") or []
+        tmp = self.results_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for item in inlined:
+                line = {k: v for k, v in item.items() if k in ("response", "error")}
+                line["key"] = (item.get("metadata") or {}).get("key")
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.results_path)
+
+    def results(self) -> typing.Tuple[typing.Dict[str, dict], typing.Dict[str, str]]:
+        """
+        Returns ({pdf path: record}, {pdf path: error}) from the downloaded results.
+        Requests without a result line count as errors.
+        """
+        requests = self.state.get("requests", {})
+        records = {}
+        errors = {}
+        if os.path.exists(self.results_path):
+            with open(self.results_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    path = requests.get(str(item.get("key")))
+                    if path is None:
+                        continue
+                    if item.get("error"):
+                        errors[path] = f"API_ERROR: {item['error'].get('message') or item['error']}"
+                        continue
+                    try:
+                        data = parse_response(item.get("response"))
+                    except Exception as e:
+                        errors[path] = str(e)
+                        continue
+                    if isinstance(data, dict):
+                        records[path] = expand_record(data)
+                    else:
+                        errors[path] = "AI_NULL"
+        for path in requests.values():
+            if path not in records and path not in errors:
+                errors[path] = "AI_EMPTY_RESPONSE"
+        return records, errors
+
+    def mark_collected(self):
+        self.state["phase"] = COLLECTED
+        self._save()
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+from .config import get_config_path
+
+CACHE_FILENAME = "result_cache.sqlite3"
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_MAX_AGE_DAYS = 180
+
+
+def get_cache_path():
+    # Lives next to config.json (AppData / ~/.risgenerator)
+    return os.path.join(os.path.dirname(get_config_path()), CACHE_FILENAME)
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Returns the SHA-256 hex digest of the file contents.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_cache_key(content_hash: str, model_name: str, filename_mode: bool, prompt_version: str, filename: str = "") -> str:
+    """
+    Builds the cache key for one Gemini result.
+    In filename_mode the filename is the only input to the prompt, so it is part of the key.
+    """
+    parts = [content_hash, model_name, "filename" if filename_mode else "text", prompt_version]
+    if filename_mode:
+        parts.append(filename)
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent (SQLite) cache of raw Gemini JSON results keyed by PDF content.
+    Thread-safe. The async methods run the SQLite work on a worker thread, so a slow disk never
+    blocks the event loop; identical keys requested concurrently are computed only once (single-flight).
+    """
+
+    def __init__(self, path: str = None, max_entries: int = DEFAULT_MAX_ENTRIES, max_age_days: float = DEFAULT_MAX_AGE_DAYS):
+        self.path = path or get_cache_path()
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> asyncio.Event (single event loop)
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results(accessed)")
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key: str) -> typing.Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        try:
+            return json.loads(row[0])
+        except json.JSONDecodeError:
+            return None
+
+    def put(self, key: str, data: dict):
+        payload = json.dumps(data, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, payload, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, payload, now, now)
+            )
+            self._conn.commit()
+
+    async def get_async(self, key: str) -> typing.Optional[dict]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def put_async(self, key: str, data: dict):
+        await asyncio.to_thread(self.put, key, data)
+
+    async def get_or_compute_async(self, key: str, compute: typing.Callable[[], typing.Awaitable[typing.Optional[dict]]]) -> typing.Tuple[typing.Optional[dict], bool]:
+        """
+        Returns (data, cache_hit). Only truthy results are stored.
+        If another task is already computing the same key, waits for it instead of calling compute().
+        """
+        while True:
+            data = await self.get_async(key)
+            if data is not None:
+                return data, True
+
+            event = self._inflight.get(key)
+            if event is None:
+                event = asyncio.Event()
+                self._inflight[key] = event
+                break
+            await event.wait()
+            # Leader finished: loop to read its result, or take over if it failed.
+
+        try:
+            data = await compute()
+            if data:
+                await self.put_async(key, data)
+            return data, False
+        finally:
+            self._inflight.pop(key, None)
+            event.set()
+
+    def evict(self):
+        """
+        Drops entries older than max_age_days, then the least recently used beyond max_entries.
+        """
+        with self._lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                self._conn.execute("DELETE FROM results WHERE accessed < ?", (cutoff,))
+            if self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM results WHERE key IN ("
+                    " SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
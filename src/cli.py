@@ -0,0 +1,367 @@
+"""
+Headless batch runner (no Qt / no display required).
+
+    python -m src.cli FOLDER_OR_PDF [...] [--file-list FILE] [--model NAME] [--workers N]
+    python -m src.cli FOLDER_OR_PDF [...] --plan [--plan-models a,b] [--plan-sample N]   (dry run, no API calls)
+    python -m src.cli --resume [RUN_ID] [--retry-codes RATE_LIMIT,TIMEOUT]   (continue an interrupted run)
+
+Progress and the final summary are written to stdout as JSON lines; all log output goes to stderr.
+Exit codes: 0 = no failures, 1 = some files failed, 2 = usage error, 130 = cancelled.
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+
+from .config import load_config, DEFAULT_PACK_TOKEN_BUDGET, DEFAULT_COMPACT_TOKENS
+from .engine import ProcessingEngine
+from .scanner import iter_pdf_files
+from .journal import RunJournal, get_journal_path, DEFAULT_RETRY_CODES
+from .metadata_index import get_default_index_path
+from .similarity import get_default_index_path as get_default_similarity_path, DEFAULT_THRESHOLD as DEFAULT_DUPLICATE_THRESHOLD
+from .processor import MAX_TEXT_CHARS, SCHEMA_MODES, context_cache
+from .planner import plan_run, DEFAULT_SAMPLE_SIZE
+from .backends import create_backend, backend_type, BACKEND_TYPES
+from .batch import BatchJob, BatchClient, BatchError, get_default_state_path as get_default_batch_path, DEFAULT_POLL_SECONDS, FINISHED as BATCH_FINISHED, FAILED as BATCH_FAILED
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_CANCELLED = 130
+
+DEFAULT_MODEL = "gemini-3-flash-preview"
+
+
+def build_parser(config):
+    parser = argparse.ArgumentParser(prog="python -m src.cli", description="Generate .ris files from PDFs without the GUI.")
+    parser.add_argument("inputs", nargs="*", help="PDF files or folders (subfolders only with --recursive)")
+    parser.add_argument("-r", "--recursive", action="store_true", default=config.get("recursive", False), help="Scan folders recursively (streamed: processing starts before the scan finishes)")
+    parser.add_argument("--include", action="append", help="Only PDFs matching this glob (name or path relative to the folder; repeatable; default: include_globs in config)")
+    parser.add_argument("--exclude", action="append", help="Skip files/folders matching this glob (repeatable; default: exclude_globs in config)")
+    parser.add_argument("--file-list", help="Text file with one PDF path per line ('-' for stdin)")
+    parser.add_argument("--api-key", help="Gemini API key (default: $GEMINI_API_KEY, $GOOGLE_API_KEY, then saved config)")
+    parser.add_argument("--model", default=config.get("model_name", DEFAULT_MODEL), help="Gemini model name")
+    parser.add_argument("--cascade-model", default=config.get("cascade_model"), help="Re-ask this stronger model for fields --model left uncertain or invalid (e.g. gemini-3-pro-preview)")
+    parser.add_argument("--backend", choices=BACKEND_TYPES, help="LLM backend (default: \"backend\" in config, else gemini)")
+    parser.add_argument("--backend-url", help="Base URL of an OpenAI-compatible server, e.g. http://localhost:8000/v1")
+    parser.add_argument("--backend-model", help="Model name sent to the OpenAI-compatible server (default: --model)")
+    parser.add_argument("--workers", type=int, default=config.get("max_workers", 3), help="Parallel API calls")
+    parser.add_argument("--max-attempts", type=int, default=config.get("max_attempts", 3), help="API attempts per PDF for rate-limit/server errors; retries wait in a delay queue without holding a worker")
+    parser.add_argument("--extract-workers", type=int, default=None, help="Extraction processes (default: CPU count)")
+    parser.add_argument("--extract-max-chars", type=int, default=MAX_TEXT_CHARS, help="Stop reading pages once this many characters are collected (0 = no limit)")
+    parser.add_argument("--no-early-stop", dest="early_stop", action="store_false", default=True, help="Always read every head/tail page, even after a DOI or abstract is found")
+    parser.add_argument("--compact-tokens", type=int, default=config.get("compact_tokens", DEFAULT_COMPACT_TOKENS), help="Compact the extracted text (headers, references, whitespace) to about this many tokens (0 = send raw text)")
+    parser.add_argument("--skip-existing", dest="skip_existing", action="store_true", default=True, help="Skip PDFs that already have a .ris and are unchanged (default)")
+    parser.add_argument("--no-skip-existing", dest="skip_existing", action="store_false", help="Regenerate existing .ris files")
+    parser.add_argument("--no-manifest", dest="use_manifest", action="store_false", default=True, help="Skip by .ris existence only (no per-folder manifest, changed PDFs are not detected)")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false", default=config.get("use_cache", True), help="Do not reuse or store cached results")
+    default_pack = config.get("pack_token_budget", DEFAULT_PACK_TOKEN_BUDGET) if config.get("pack_requests") else 0
+    parser.add_argument("--pack-tokens", type=int, default=default_pack, help="Pack several PDFs per request up to this estimated prompt size (0 = one PDF per request)")
+    parser.add_argument("--pack-max-docs", type=int, default=8, help="Maximum PDFs per packed request")
+    parser.add_argument("--metadata-index", default=config.get("metadata_index_path", get_default_index_path()), help="Offline DOI/ISBN index used before calling the API (build with: python -m src.metadata_index build)")
+    parser.add_argument("--no-metadata-index", dest="metadata_index", action="store_const", const=None, help="Do not use the offline metadata index")
+    parser.add_argument("--similarity-index", default=config.get("similarity_index_path", get_default_similarity_path()), help="Near-duplicate index kept across runs: copies and versions of processed PDFs reuse their record")
+    parser.add_argument("--no-dedup", dest="similarity_index", action="store_const", const=None, help="Do not detect near-duplicate PDFs")
+    parser.add_argument("--duplicate-threshold", type=float, default=config.get("duplicate_threshold", DEFAULT_DUPLICATE_THRESHOLD), help="Estimated text similarity (0-1) at which a PDF counts as a copy")
+    parser.add_argument("--context-cache", dest="context_cache", action="store_true", default=config.get("context_cache", False), help="Cache the constant instruction (~200 tokens per prompt mode) on Gemini's side (\"context_cache\" in config.json). Only pays off on models that accept a prefix this small: each request then saves the instruction at the cached-token discount, while the storage is billed per hour and kept for 1 hour after the last use. Other models reject it and the requests go out in full")
+    parser.add_argument("--no-context-cache", dest="context_cache", action="store_false", help="Send the instruction with every request (default; no server-side storage)")
+    parser.add_argument("--schema", dest="schema_mode", choices=SCHEMA_MODES, default=config.get("schema_mode", "full"), help="Answer shape asked of the model: 'compact' drops evidence, uses short confidence codes and one confidence for the author list (fewer output tokens, faster answers)")
+    parser.add_argument("--no-pdf-metadata", dest="use_pdf_metadata", action="store_false", default=config.get("use_pdf_metadata", True), help="Ignore the PDFs' embedded /Info and XMP metadata (always ask the API for every field)")
+    parser.add_argument("--library", metavar="PATH", help="Also write every record of the run into one combined .ris file")
+    parser.add_argument("--trace", default=config.get("trace_path"), metavar="PATH", help="Write per-file stage spans (scan, extract, queue, api, postprocess, write) as JSON lines")
+    parser.add_argument("--metrics", default=config.get("metrics_path"), metavar="PATH", help="Write Prometheus-style metrics to this file during the run")
+    parser.add_argument("--metrics-port", type=int, default=config.get("metrics_port"), help="Serve Prometheus-style metrics on http://127.0.0.1:PORT/metrics during the run")
+    parser.add_argument("--journal", default=get_journal_path(), help="Run journal file (per-file states, used by --resume)")
+    parser.add_argument("--no-journal", dest="journal", action="store_const", const=None, help="Do not write a run journal")
+    parser.add_argument("--resume", nargs="?", const="last", help="Continue a previous run (default: the latest one for the same inputs): finished files are skipped")
+    parser.add_argument("--retry-codes", default=",".join(DEFAULT_RETRY_CODES), help="With --resume: failure codes to retry (comma-separated, e.g. RATE_LIMIT,TIMEOUT,AI_NULL)")
+    parser.add_argument("--batch", nargs="?", const=get_default_batch_path(), metavar="STATE", help="Use the Gemini Batch API: submit one job for all PDFs, wait for it, then write the .ris files. STATE is the job file (default: next to config.json); run again to resume an unfinished job")
+    parser.add_argument("--batch-no-wait", action="store_true", help="With --batch: submit (or check) the job and exit instead of waiting for it")
+    parser.add_argument("--batch-poll", type=float, default=config.get("batch_poll_seconds", DEFAULT_POLL_SECONDS), metavar="SECONDS", help="With --batch: seconds between job status checks")
+    parser.add_argument("--batch-url", default=config.get("batch_url"), help="With --batch: base URL of the Batch API (e.g. a local stand-in)")
+    parser.add_argument("--plan", action="store_true", help="Dry run: estimate requests, tokens and time per model, then exit (no generation calls)")
+    parser.add_argument("--plan-models", help="Comma-separated models to plan for (default: --model)")
+    parser.add_argument("--plan-sample", type=int, default=DEFAULT_SAMPLE_SIZE, help="Files to extract when planning large folders")
+    parser.add_argument("--prevent-sleep", action="store_true", default=False, help="Prevent system sleep while running (Windows only)")
+    return parser
+
+
+def collect_inputs(paths, file_list=None, recursive=False, include=None, exclude=None):
+    """
+    Expands folders and reads the optional file list. Returns (pdf_files, errors).
+    Without recursion pdf_files is a list (each folder sorted); with recursion it is a lazy iterator
+    that walks the folders while the engine is already processing.
+    """
+    candidates = list(paths)
+    if file_list:
+        stream = sys.stdin if file_list == "-" else open(file_list, 'r', encoding='utf-8')
+        try:
+            candidates.extend(line.strip() for line in stream if line.strip())
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+    errors = [path for path in candidates if not os.path.exists(path)]
+    candidates = [path for path in candidates if os.path.exists(path)]
+
+    def expand():
+        # Deduplication only matters when inputs can overlap; a single folder needs no path set
+        seen = set() if len(candidates) > 1 else None
+        for path in candidates:
+            if os.path.isdir(path):
+                found = iter_pdf_files(path, recursive=recursive, include=include, exclude=exclude)
+            else:
+                found = [path]
+            for f in found:
+                if seen is not None:
+                    key = os.path.abspath(f)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                yield f
+
+    return (expand() if recursive else list(expand())), errors
+
+
+class JsonLinesWriter:
+    """
+    Thread-safe JSON-lines emitter (engine hooks are called from worker threads).
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        line = json.dumps({"event": event, **fields}, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def _detach_stdout():
+    """
+    Keeps the real stdout for JSON lines and points fd 1 / sys.stdout at stderr,
+    so print() logs from the engine (and its extraction processes) cannot corrupt the stream.
+    """
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8', buffering=1)
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    return out
+
+
+def describe_inputs(args):
+    """
+    The batch definition stored in the journal, so --resume can run it again without arguments.
+    """
+    return {
+        "inputs": [os.path.abspath(p) for p in args.inputs],
+        "file_list": os.path.abspath(args.file_list) if args.file_list and args.file_list != "-" else args.file_list,
+        "recursive": args.recursive,
+        "include": args.include,
+        "exclude": args.exclude,
+    }
+
+
+def main(argv=None):
+    config = load_config()
+    parser = build_parser(config)
+    args = parser.parse_args(argv)
+
+    journal = None
+    resume_states = None
+    if args.journal and not args.plan:
+        try:
+            journal = RunJournal(args.journal)
+        except Exception as e:
+            print(f"warning: run journal unavailable: {e}", file=sys.stderr)
+
+    if args.resume:
+        if journal is None:
+            print("error: --resume needs the run journal", file=sys.stderr)
+            return EXIT_USAGE
+        has_inputs = bool(args.inputs or args.file_list)
+        if args.resume == "last":
+            label = json.dumps(describe_inputs(args), sort_keys=True) if has_inputs else None
+            previous = journal.latest_run(label)
+        else:
+            previous = journal.get_run(int(args.resume)) if args.resume.isdigit() else None
+        if previous is None:
+            print(f"error: no previous run to resume ({args.resume})", file=sys.stderr)
+            return EXIT_USAGE
+        if not has_inputs and previous["inputs"]:
+            saved = previous["inputs"]
+            args.inputs, args.file_list = saved["inputs"], saved["file_list"]
+            args.recursive, args.include, args.exclude = saved["recursive"], saved["include"], saved["exclude"]
+        resume_states = journal.last_states(previous["run_id"])
+        print(f"Resuming run {previous['run_id']}: {len(resume_states)} files recorded", file=sys.stderr)
+
+    batch_job = None
+    if args.batch and not args.plan:
+        try:
+            batch_job = BatchJob(args.batch)
+        except (OSError, ValueError) as e:
+            print(f"error: cannot read batch job {args.batch}: {e}", file=sys.stderr)
+            return EXIT_USAGE
+    # An unfinished job continues with its own files and model, whatever the arguments say
+    batch_resuming = batch_job is not None and batch_job.phase is not None and batch_job.phase not in BATCH_FINISHED
+    if batch_resuming:
+        args.model = batch_job.model_name
+        print(f"Resuming batch job {batch_job.state.get('batch') or args.batch} ({batch_job.phase}): {len(batch_job.paths)} files", file=sys.stderr)
+
+    if not args.inputs and not args.file_list and not batch_resuming:
+        parser.print_usage(sys.stderr)
+        print("error: no input folders or files given", file=sys.stderr)
+        return EXIT_USAGE
+
+    backend_spec = dict(config.get("backend") or {})
+    for key, value in (("type", args.backend), ("base_url", args.backend_url), ("model", args.backend_model)):
+        if value:
+            backend_spec[key] = value
+
+    api_key = args.api_key or os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY") or config.get("api_key", "")
+    backend = None # Gemini with api_key
+    if backend_type(backend_spec) != "gemini":
+        try:
+            backend = create_backend(backend_spec)
+        except (TypeError, ValueError) as e:
+            print(f"error: {e}", file=sys.stderr)
+            return EXIT_USAGE
+    elif not api_key and not args.plan:
+        print("error: no API key (use --api-key or set GEMINI_API_KEY)", file=sys.stderr)
+        return EXIT_USAGE
+    if batch_job is not None and backend is not None:
+        print("error: --batch needs the gemini backend", file=sys.stderr)
+        return EXIT_USAGE
+
+    if batch_resuming:
+        files = batch_job.paths
+    else:
+        try:
+            files, missing = collect_inputs(
+                args.inputs, args.file_list, args.recursive,
+                args.include or config.get("include_globs"),
+                args.exclude or config.get("exclude_globs")
+            )
+        except OSError as e:
+            print(f"error: failed to read inputs: {e}", file=sys.stderr)
+            return EXIT_USAGE
+        for path in missing:
+            print(f"warning: not found: {path}", file=sys.stderr)
+
+    context_cache.enabled = args.context_cache
+
+    out = JsonLinesWriter(_detach_stdout())
+    engine_options = dict(
+        prevent_sleep=args.prevent_sleep,
+        max_workers=max(1, args.workers),
+        use_cache=args.use_cache,
+        extract_workers=args.extract_workers,
+        skip_existing=args.skip_existing,
+        pack_token_budget=max(0, args.pack_tokens),
+        pack_max_docs=args.pack_max_docs,
+        metadata_index_path=args.metadata_index,
+        extract_max_chars=args.extract_max_chars or None,
+        early_stop=args.early_stop,
+        compact_tokens=max(0, args.compact_tokens),
+        journal=journal,
+        resume_states=resume_states,
+        retry_codes=[c.strip() for c in args.retry_codes.split(",") if c.strip()],
+        use_manifest=args.use_manifest,
+        use_pdf_metadata=args.use_pdf_metadata,
+        backend=backend,
+        cascade_model=args.cascade_model,
+        similarity_index_path=args.similarity_index,
+        duplicate_threshold=args.duplicate_threshold,
+        trace_path=args.trace,
+        metrics_path=args.metrics,
+        metrics_port=args.metrics_port,
+        max_attempts=args.max_attempts,
+        schema_mode=args.schema_mode,
+        library_path=args.library
+    )
+    engine = ProcessingEngine(files, api_key, args.model, **engine_options)
+
+    if args.plan:
+        models = [m.strip() for m in args.plan_models.split(",") if m.strip()] if args.plan_models else [args.model]
+        out.emit("plan", **plan_run(engine, models, sample_size=max(1, args.plan_sample)))
+        return EXIT_OK
+
+    # Ctrl-C / SIGTERM stop the run gracefully so the summary is still emitted
+    stopping = threading.Event()
+    def handle_stop(signum, frame):
+        print("Stopping (waiting for current files)...", file=sys.stderr)
+        stopping.set()
+        engine.request_stop()
+    signal.signal(signal.SIGINT, handle_stop)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, handle_stop)
+
+    if batch_job is not None:
+        code = run_batch_job(batch_job, engine, BatchClient(api_key, args.batch_url), out, args.batch_poll,
+                             wait=not args.batch_no_wait, stop=stopping)
+        if code is not None:
+            return code
+        # Collect: a normal run over the job's files, fed with the batch results (failed lines use the API)
+        records, errors = batch_job.results()
+        out.emit("batch", phase=batch_job.phase, batch=batch_job.state.get("batch"), results=len(records), errors=len(errors))
+        engine = ProcessingEngine(batch_job.paths, api_key, batch_job.model_name,
+                                  **{**engine_options, "pack_token_budget": 0, "batch_results": records})
+
+    engine.on_progress = lambda current, total, filename: out.emit("progress", current=current, total=total, file=filename)
+    engine.on_result = lambda res: out.emit("result", **res)
+
+    run_id = None
+    if journal is not None:
+        batch = describe_inputs(args)
+        run_id = journal.start_run(json.dumps(batch, sort_keys=True), batch, previous["run_id"] if args.resume else None)
+
+    # total is null for a streamed (recursive) scan; progress events carry the running count
+    out.emit("start", total=len(files) if isinstance(files, list) else None, model=args.model, workers=engine.max_workers, run_id=run_id)
+    try:
+        summary = engine.run()
+    finally:
+        if journal is not None:
+            journal.finish_run(engine.stop_requested())
+            journal.close()
+    out.emit("summary", run_id=run_id, **summary)
+
+    if summary["cancelled"]:
+        return EXIT_CANCELLED
+    if batch_job is not None:
+        batch_job.mark_collected()
+    return EXIT_FAILED if summary["failed"] else EXIT_OK
+
+
+def run_batch_job(job, engine, client, out, poll_seconds=DEFAULT_POLL_SECONDS, wait=True, stop=None):
+    """
+    Prepares (if new), submits and waits for a batch job. Returns None once its results are ready
+    to collect, else the exit code (the job file keeps the state for the next run).
+    """
+    if job.phase is None or job.phase in BATCH_FINISHED:
+        files = list(engine.pdf_files)
+        out.emit("batch", phase="preparing", files=len(files), state=job.state_path)
+        job.prepare(engine, files)
+    try:
+        job.submit(client)
+        out.emit("batch", phase=job.phase, batch=job.state.get("batch"), requests=len(job.state.get("requests", {})), state=job.state_path)
+        finished = job.poll(client) if not wait else job.wait(client, poll_seconds, stop)
+    except BatchError as e:
+        print(f"error: batch job failed: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    if job.phase == BATCH_FAILED:
+        print(f"error: batch job {job.state.get('batch')} ended: {job.state.get('error')}", file=sys.stderr)
+        out.emit("batch", phase=job.phase, batch=job.state.get("batch"), error=job.state.get("error"))
+        return EXIT_FAILED
+    if not finished:
+        # --batch-no-wait or Ctrl-C: the job keeps running on the server
+        out.emit("batch", phase=job.phase, batch=job.state.get("batch"), batch_state=job.state.get("batch_state"), state=job.state_path)
+        return EXIT_CANCELLED if stop is not None and stop.is_set() else EXIT_OK
+    return None
+
+
+if __name__ == "__main__":
+    sys.exit(main())
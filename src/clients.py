@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import json
+import threading
+import weakref
+
+import grpc
+import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.api_core import gapic_v1
+from google.ai.generativelanguage_v1beta.services.generative_service.transports import grpc as grpc_transport
+from google.ai.generativelanguage_v1beta.services.generative_service.transports import grpc_asyncio as grpc_asyncio_transport
+from google.ai.generativelanguage_v1beta.services.cache_service.transports import grpc as cache_grpc_transport
+
+
+class ModelPool:
+    """
+    Reuses Gemini clients and GenerativeModel objects instead of rebuilding them per call.
+
+    genai.configure() is process-global and drops its cached clients every time it is called,
+    so calling it per file (from many workers) both races on the API key and opens a new
+    connection per request. Here every API key gets its own long-lived service client
+    (the gRPC channel keeps its HTTP/2 connection alive), and models are cached by
+    (api_key, model_name, generation config).
+
+    Async clients are bound to the event loop that created them, so they are cached per loop
+    and released with it.
+
+    Models bound to a server-side cached prompt prefix (cached_content, see processor.ContextCache)
+    are pooled like any other; the cache service client used to create those prefixes is pooled per key.
+
+    endpoint: optional plaintext gRPC "host:port" used instead of the Google API, e.g. a local
+    stand-in server for benchmarks (see benchmarks/fake_gemini.py).
+    """
+
+    def __init__(self, endpoint: str = None):
+        self.endpoint = endpoint
+        self._lock = threading.Lock()
+        self._sync_clients = {}  # api_key -> GenerativeServiceClient
+        self._sync_models = {}  # (api_key, model_name, config_key, cached_content) -> GenerativeModel
+        self._cache_clients = {}  # api_key -> CacheServiceClient
+        self._async = weakref.WeakKeyDictionary()  # loop -> {"clients": {...}, "models": {...}}
+        self._config_keys = {}  # id(config) -> (config, key); avoids re-hashing a shared config dict
+
+    def _config_key(self, generation_config: dict) -> str:
+        entry = self._config_keys.get(id(generation_config))
+        if entry is not None and entry[0] is generation_config:
+            return entry[1]
+        key = hashlib.sha1(json.dumps(generation_config, sort_keys=True).encode("utf-8")).hexdigest()
+        if len(self._config_keys) < 64: # only long-lived module-level configs are worth remembering
+            self._config_keys[id(generation_config)] = (generation_config, key)
+        return key
+
+    def set_endpoint(self, endpoint: str = None):
+        """
+        Points new clients at a plaintext gRPC endpoint (None = the Google API) and drops the cached ones.
+        """
+        with self._lock:
+            self.endpoint = endpoint
+        self.clear()
+
+    def _client_kwargs(self, api_key: str, use_async: bool = False, cache_service: bool = False) -> dict:
+        kwargs = {"client_info": gapic_v1.client_info.ClientInfo(user_agent=f"genai-py/{genai.__version__}")}
+        if self.endpoint:
+            if cache_service:
+                kwargs["transport"] = cache_grpc_transport.CacheServiceGrpcTransport(channel=grpc.insecure_channel(self.endpoint))
+            elif use_async:
+                kwargs["transport"] = grpc_asyncio_transport.GenerativeServiceGrpcAsyncIOTransport(channel=grpc.aio.insecure_channel(self.endpoint))
+            else:
+                kwargs["transport"] = grpc_transport.GenerativeServiceGrpcTransport(channel=grpc.insecure_channel(self.endpoint))
+        else:
+            kwargs["client_options"] = {"api_key": api_key}
+        return kwargs
+
+    def _build_model(self, model_name, generation_config, client=None, async_client=None, cached_content=None):
+        model = genai.GenerativeModel(model_name, generation_config=generation_config)
+        if cached_content:
+            # Same as GenerativeModel.from_cached_content(), without its lookup through the global client
+            model._cached_content = cached_content
+        # GenerativeModel creates clients lazily from the global configuration;
+        # pre-seeding them keeps each model on its own API key's connection.
+        if client is not None:
+            model._client = client
+        if async_client is not None:
+            model._async_client = async_client
+        return model
+
+    def get_model(self, api_key: str, model_name: str, generation_config: dict, cached_content: str = None):
+        """
+        cached_content: name of a server-side cached prefix ('cachedContents/...') the requests build on.
+        """
+        key = (api_key, model_name, self._config_key(generation_config), cached_content)
+        with self._lock:
+            model = self._sync_models.get(key)
+            if model is None:
+                client = self._sync_clients.get(api_key)
+                if client is None:
+                    client = glm.GenerativeServiceClient(**self._client_kwargs(api_key))
+                    self._sync_clients[api_key] = client
+                model = self._build_model(model_name, generation_config, client=client, cached_content=cached_content)
+                self._sync_models[key] = model
+            return model
+
+    def get_async_model(self, api_key: str, model_name: str, generation_config: dict, cached_content: str = None):
+        """
+        Must be called from inside the running event loop that will await the model.
+        """
+        loop = asyncio.get_running_loop()
+        key = (api_key, model_name, self._config_key(generation_config), cached_content)
+        with self._lock:
+            state = self._async.get(loop)
+            if state is None:
+                state = {"clients": {}, "models": {}}
+                self._async[loop] = state
+            model = state["models"].get(key)
+            if model is None:
+                client = state["clients"].get(api_key)
+                if client is None:
+                    client = glm.GenerativeServiceAsyncClient(**self._client_kwargs(api_key, use_async=True))
+                    state["clients"][api_key] = client
+                model = self._build_model(model_name, generation_config, async_client=client, cached_content=cached_content)
+                state["models"][key] = model
+            return model
+
+    def get_cache_client(self, api_key: str):
+        """
+        CacheServiceClient for creating and refreshing cached prompt prefixes (blocking; async callers use a thread).
+        """
+        with self._lock:
+            client = self._cache_clients.get(api_key)
+            if client is None:
+                client = glm.CacheServiceClient(**self._client_kwargs(api_key, cache_service=True))
+                self._cache_clients[api_key] = client
+            return client
+
+    def clear(self):
+        with self._lock:
+            self._sync_clients.clear()
+            self._sync_models.clear()
+            self._cache_clients.clear()
+            self._async.clear()
+
+
+# Shared by every caller in the process
+model_pool = ModelPool()
@@ -0,0 +1,145 @@
+"""
+Prompt text compaction: shrinks extracted page text before it is sent to Gemini.
+
+Removes running headers/footers and line-number gutters, rejoins hyphenated words,
+collapses whitespace, cuts reference lists down to a few lines and finally fits the
+text into a size budget (page 1 first).
+"""
+import re
+
+PAGE_MARKER_RE = re.compile(r'^(--- Page \d+[^\n]*---)$', re.MULTILINE)
+REFERENCES_HEADING_RE = re.compile(
+    r'^\s*(\d+\.?\s*)?(references|bibliography|works cited|literature cited|reference list|参考文献|引用文献)\s*:?\s*$',
+    re.IGNORECASE
+)
+# "[12] ...", "12. Author", "Author, A. (2019)", "... 2019. Title"
+REFERENCE_LINE_RE = re.compile(r'^\s*(\[\d+\]|\d{1,3}\.\s+\S)|\(\s*(19|20)\d\d[a-z]?\s*\)|\b(19|20)\d\d[a-z]?[.;,]')
+# Page numbers and line-number gutters (1-3 digits, so a year on its own line survives)
+GUTTER_RE = re.compile(r'^\s*(\d{1,3}|page \d+( of \d+)?|\d+ / \d+|- \d+ -)\s*$', re.IGNORECASE)
+HYPHEN_BREAK_RE = re.compile(r'([a-z])-\n\s*([a-z])')
+
+REFERENCE_LINES_KEPT = 3
+
+
+def _split_pages(text):
+    """
+    Returns [(marker, body), ...]; text without markers is treated as one page.
+    """
+    parts = PAGE_MARKER_RE.split(text)
+    if len(parts) == 1:
+        return [("", text)]
+    pages = []
+    if parts[0].strip():
+        pages.append(("", parts[0]))
+    for i in range(1, len(parts), 2):
+        pages.append((parts[i], parts[i + 1]))
+    return pages
+
+
+def _line_key(line):
+    # Running headers differ only by page number
+    return re.sub(r'\d+', '#', " ".join(line.split()).lower())
+
+
+def _drop_boilerplate(pages):
+    """
+    Drops lines repeated on several pages (keeping their first occurrence, which may be the real title)
+    and page-number / line-number gutter lines.
+    """
+    seen_on = {}
+    for n, (_, body) in enumerate(pages):
+        for key in {_line_key(l) for l in body.splitlines() if l.strip()}:
+            seen_on.setdefault(key, []).append(n)
+    repeated = {k for k, ns in seen_on.items() if len(ns) >= 2 and len(pages) >= 3}
+
+    cleaned = []
+    for n, (marker, body) in enumerate(pages):
+        lines = []
+        for line in body.splitlines():
+            if GUTTER_RE.match(line):
+                continue
+            key = _line_key(line)
+            if key in repeated and seen_on[key][0] != n:
+                continue
+            lines.append(line)
+        cleaned.append((marker, "\n".join(lines)))
+    return cleaned
+
+
+def _cut_references(pages):
+    """
+    Keeps the first few lines of a reference list. A list starts at a References heading or on a page
+    that consists mostly of reference entries, and continues on following reference-like pages.
+    """
+    cleaned = []
+    in_refs = False
+    kept_refs = 0
+    for marker, body in pages:
+        lines = body.splitlines()
+        ref_like = sum(1 for l in lines if REFERENCE_LINE_RE.search(l))
+        if len(lines) >= 5 and ref_like >= 0.6 * len(lines):
+            if not in_refs:
+                in_refs, kept_refs = True, 0
+        else:
+            in_refs = False
+
+        kept = []
+        omitted = 0
+        for line in lines:
+            if REFERENCES_HEADING_RE.match(line):
+                in_refs, kept_refs = True, 0
+            elif in_refs:
+                if kept_refs >= REFERENCE_LINES_KEPT:
+                    omitted += 1
+                    continue
+                kept_refs += 1
+            kept.append(line)
+        if omitted:
+            kept.append(f"[... {omitted} reference lines omitted ...]")
+        cleaned.append((marker, "\n".join(kept)))
+    return cleaned
+
+
+def _normalize(body):
+    body = HYPHEN_BREAK_RE.sub(r'\1\2', body)
+    lines = (" ".join(line.split()) for line in body.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def _fit_budget(pages, max_chars):
+    """
+    Truncates page bodies so the whole text fits max_chars: page 1 may use up to half,
+    the rest is shared evenly (short pages give their unused share to longer ones).
+    """
+    overhead = sum(len(marker) + 2 for marker, _ in pages)
+    budget = max(0, max_chars - overhead)
+    if sum(len(body) for _, body in pages) <= budget:
+        return pages
+
+    allowed = {}
+    first_share = min(len(pages[0][1]), budget // 2 if len(pages) > 1 else budget)
+    allowed[0] = first_share
+    remaining = budget - first_share
+    rest = sorted(range(1, len(pages)), key=lambda n: len(pages[n][1]))
+    for k, n in enumerate(rest):
+        share = remaining // (len(rest) - k)
+        allowed[n] = min(len(pages[n][1]), share)
+        remaining -= allowed[n]
+    return [(marker, body[:allowed[n]]) for n, (marker, body) in enumerate(pages)]
+
+
+def compact_text(text: str, max_chars: int = None) -> str:
+    """
+    Returns the compacted text (page markers kept). max_chars=None only cleans, never truncates.
+    Budgets are in characters so this module stays importable in extraction processes
+    without the Gemini SDK (see processor.CHARS_PER_TOKEN for the conversion).
+    """
+    if not text.strip():
+        return text
+    pages = _split_pages(text)
+    pages = _drop_boilerplate(pages)
+    pages = _cut_references(pages)
+    pages = [(marker, _normalize(body)) for marker, body in pages]
+    if max_chars:
+        pages = _fit_budget(pages, max_chars)
+    return "\n".join(f"{marker}\n{body}" if marker else body for marker, body in pages if marker or body)
@@ -4,6 +4,24 @@ import platform
 
 APP_NAME = "RisGenerator"
 
+# Per-model request budgets (requests/min, input tokens/min), roughly Gemini API paid tier 1.
+# Free-tier users should lower these via "rate_limits" in config.json, e.g.
+#   "rate_limits": {"gemini-2.5-flash": {"rpm": 10, "tpm": 250000}}
+# The scheduler also adapts downward automatically when it sees 429 errors.
+MODEL_RATE_LIMITS = {
+    "gemini-3-flash-preview": {"rpm": 1000, "tpm": 1000000},
+    "gemini-3-pro-preview": {"rpm": 50, "tpm": 1000000},
+    "gemini-2.5-flash": {"rpm": 1000, "tpm": 1000000},
+    "gemini-2.5-pro": {"rpm": 150, "tpm": 2000000},
+}
+DEFAULT_RATE_LIMITS = {"rpm": 60, "tpm": 250000}
+
+# Packed requests: estimated prompt tokens per request (override with "pack_token_budget" in config.json)
+DEFAULT_PACK_TOKEN_BUDGET = 32000
+
+# Prompt compaction: extracted text is cleaned and cut to this many estimated tokens (override with "compact_tokens"; 0 = off)
+DEFAULT_COMPACT_TOKENS = 4000
+
 def get_config_path():
     if platform.system() == "Windows":
         app_data = os.getenv("APPDATA")
@@ -22,15 +40,38 @@ def load_config() -> dict:
             return {}
     return {}
 
-def save_config(api_key: str, save_enabled: bool, model_name: str = "gemini-1.5-flash", prevent_sleep: bool = False, max_workers: int = 3):
+def get_rate_limits(model_name: str, config: dict = None) -> dict:
+    """
+    Returns {'rpm': ..., 'tpm': ...} for a model: built-in table, overridden by config.json "rate_limits".
+    """
+    limits = dict(MODEL_RATE_LIMITS.get(model_name, DEFAULT_RATE_LIMITS))
+    if config is None:
+        config = load_config()
+    override = config.get("rate_limits", {}).get(model_name)
+    if isinstance(override, dict):
+        limits.update({k: v for k, v in override.items() if k in ("rpm", "tpm") and v})
+    return limits
+
+def save_config(api_key: str, save_enabled: bool, model_name: str = "gemini-1.5-flash", prevent_sleep: bool = False, max_workers: int = 3, use_cache: bool = True, pack_requests: bool = False, recursive: bool = False, write_library: bool = False, cascade_model: str = None, context_cache: bool = False):
     path = get_config_path()
     os.makedirs(os.path.dirname(path), exist_ok=True)
     
     data = {
         "model_name": model_name,
         "prevent_sleep": prevent_sleep,
-        "max_workers": max_workers
+        "max_workers": max_workers,
+        "use_cache": use_cache,
+        "pack_requests": pack_requests,
+        "recursive": recursive,
+        "write_library": write_library,
+        "cascade_model": cascade_model,
+        "context_cache": context_cache
     }
+    # Keep hand-tuned settings that have no UI
+    previous = load_config()
+    for key in ("pack_token_budget", "rate_limits", "metadata_index_path", "compact_tokens", "include_globs", "exclude_globs", "resume_retry_codes", "use_pdf_metadata", "backend", "similarity_index_path", "duplicate_threshold", "trace_path", "metrics_path", "metrics_port", "max_attempts", "batch_url", "batch_poll_seconds", "schema_mode"):
+        if key in previous:
+            data[key] = previous[key]
     if save_enabled:
         data["api_key"] = api_key
         data["save_key"] = True
@@ -0,0 +1,1094 @@
+import os
+import json
+import random
+import time
+import asyncio
+import concurrent.futures
+import contextvars
+import ctypes
+import functools
+import itertools
+from .extraction import prepare_document
+from .processor import generate_ris_data_async, generate_ris_data_packed_async, dict_to_ris, estimate_tokens, plan_packs, build_prompt, build_packed_prompt, missing_fields, merge_fields, escalation_fields, apply_escalation, expand_record, prompt_version, OUTPUT_SCHEMA, MAX_TEXT_CHARS, CHARS_PER_TOKEN, context_cache
+from .cache import ResultCache, make_cache_key
+from .metadata_index import MetadataIndex
+from .similarity import SimilarityIndex, duplicate_record, DEFAULT_THRESHOLD as DEFAULT_DUPLICATE_THRESHOLD
+from .config import get_rate_limits, DEFAULT_COMPACT_TOKENS
+from .scheduler import get_scheduler
+from .manifest import FolderManifest, UNCHANGED, UNTRACKED, CHANGED
+from .writer import RisWriter
+from .telemetry import Telemetry
+from .retry_queue import RetryQueue, RetryLater
+from .journal import QUEUED, STARTED, SUCCEEDED, FAILED, SKIPPED, DEFAULT_RETRY_CODES, base_code
+
+# Paths pulled from a streaming scan per thread hop
+SCAN_BATCH = 256
+
+# Attempt index of the API call running in the current task; None = retries back off in place
+# (packed requests, escalations), otherwise a retryable failure releases the slot and is deferred
+_retry_attempt = contextvars.ContextVar("retry_attempt", default=None)
+
+# Seconds between background manifest saves during a run (always saved at the end)
+MANIFEST_SAVE_INTERVAL = 30.0
+
+# Windows Sleep Constants
+ES_CONTINUOUS = 0x80000000
+ES_SYSTEM_REQUIRED = 0x00000001
+
+
+def backoff_delay(attempt, jitter=1.5):
+    """
+    Seconds to wait before retrying after the given (0-based) failed attempt: exponential plus jitter.
+    """
+    return 2 ** attempt + random.random() * jitter
+
+
+class ProcessingEngine:
+    """
+    Qt-free asyncio batch pipeline shared by the GUI worker and the headless CLI.
+    pdf_files may be a list or any iterable (e.g. a streaming folder scan); an iterable without
+    len() is consumed lazily off the event loop and the summary total grows as files are found.
+    run() blocks the calling thread while the event loop runs; request_stop() and
+    toggle_pause() may be called from any thread.
+    Hooks (all optional, called from the thread running run()):
+      on_progress(current, total, filename)
+      on_result(result_dict)
+    """
+
+    def __init__(self, pdf_files, api_key, model_name, prevent_sleep=False, max_workers=3, use_cache=True, extract_workers=None, skip_existing=False, pack_token_budget=0, pack_max_docs=8, rate_limits=None, metadata_index_path=None, extract_max_chars=MAX_TEXT_CHARS, early_stop=True, compact_tokens=DEFAULT_COMPACT_TOKENS, journal=None, resume_states=None, retry_codes=DEFAULT_RETRY_CODES, use_manifest=True, library_path=None, use_pdf_metadata=True, backend=None, cascade_model=None, similarity_index_path=None, duplicate_threshold=DEFAULT_DUPLICATE_THRESHOLD, trace_path=None, metrics_path=None, metrics_port=None, max_attempts=3, batch_results=None, schema_mode="full"):
+        self.pdf_files = pdf_files
+        self.api_key = api_key
+        self.model_name = model_name
+        self.prevent_sleep = prevent_sleep
+        # Concurrent API requests (coroutines, not threads, so hundreds are fine)
+        self.max_workers = max_workers
+        self.use_cache = use_cache
+        # Extraction runs ahead of the API stage; the queue bound keeps memory flat on huge folders
+        self.extract_workers = extract_workers or os.cpu_count() or 1
+        self.queue_size = max(2 * max_workers, self.extract_workers) + self.extract_workers
+        # Pages are read in priority order until this much text is collected (None = no limit),
+        # or, with early_stop, until a title page (DOI / abstract) is found
+        self.extract_max_chars = extract_max_chars
+        self.early_stop = early_stop
+        # Prompt compaction target in estimated tokens (0 = send the raw page text)
+        self.compact_tokens = compact_tokens
+        # Packing: several documents per request, sized by an estimated prompt token budget (0 = off)
+        self.pack_token_budget = pack_token_budget
+        self.pack_max_docs = max(1, pack_max_docs)
+        if self.pack_token_budget:
+            self.queue_size = max(self.queue_size, 2 * self.pack_max_docs)
+        self.skip_existing = skip_existing
+        # Per-folder manifests (manifest.py): skip only unchanged PDFs, without a stat per file
+        self.use_manifest = use_manifest
+        # Optional combined .ris library (every generated or skipped record of the run)
+        self.library_path = library_path
+        self._writer = None
+        self._manifests = {} # folder -> FolderManifest
+        self._manifest_save = None # running background save task
+        self._manifest_saved_at = 0.0
+        # Offline DOI/ISBN index (see metadata_index.py); documents it resolves skip the API entirely
+        self.metadata_index_path = metadata_index_path
+        self._metadata_index = None
+        # Near-duplicate index (see similarity.py): copies and versions of processed documents reuse their record
+        self.similarity_index_path = similarity_index_path
+        self.duplicate_threshold = duplicate_threshold
+        self._similarity_index = None
+        self._changed_paths = set() # PDFs the manifest reports as replaced since their .ris was written
+        # Embedded /Info and XMP metadata (pdf_metadata.py): complete records skip the API,
+        # partial ones ask Gemini only for the missing fields
+        self.use_pdf_metadata = use_pdf_metadata
+        # LLM backend (backends.py); None = Gemini with api_key
+        self.backend = backend
+        # Answer shape asked for: 'full' or 'compact' (processor.COMPACT_OUTPUT_SCHEMA, fewer output tokens).
+        # Answers are expanded to the full shape before they are cached or written.
+        self.schema_mode = schema_mode
+        self.prompt_version = prompt_version(schema_mode)
+        # One RPM/TPM budget per model, shared by every in-flight request
+        limits = rate_limits or self.rate_limits_for(model_name)
+        self._scheduler = get_scheduler(self.model_key(model_name), limits["rpm"], limits["tpm"])
+        # Cascade: documents whose answer has uncertain required fields or fails the RIS validators
+        # are re-asked for just those fields by this (stronger) model, on its own budget
+        self.cascade_model = cascade_model if cascade_model and cascade_model != model_name else None
+        self._cascade_scheduler = None
+        if self.cascade_model:
+            cascade_limits = rate_limits or self.rate_limits_for(self.cascade_model)
+            self._cascade_scheduler = get_scheduler(self.model_key(self.cascade_model), cascade_limits["rpm"], cascade_limits["tpm"])
+        # Per-stage spans and metrics (telemetry.py): JSONL trace, Prometheus text file and/or endpoint
+        self.trace_path = trace_path
+        self.metrics_path = metrics_path
+        self.metrics_port = metrics_port
+        self.telemetry = Telemetry() # replaced by the configured one when a run starts
+        self._metrics_write = None # running background metrics file write
+        # Run journal (journal.RunJournal with an open run; owned and closed by the caller)
+        self.journal = journal
+        self._journal_flush = None # running background journal write
+        # Resume: {abs path: (state, code)} from a previous run. Finished files are skipped, failures are
+        # retried only if their code is in retry_codes, unseen/in-flight files are processed again.
+        self.resume_states = resume_states
+        self.retry_codes = set(retry_codes or ())
+        # API attempts per document (first try included) for 429 / 5xx / empty responses
+        self.max_attempts = max(1, max_attempts)
+        # Records from a finished Gemini batch job (batch.py), {abs pdf path: record}: used instead of
+        # calling the API; PDFs without one (failed batch lines) go through the normal API path
+        self.batch_results = batch_results or {}
+        self.on_progress = None
+        self.on_result = None
+        self._cache = None
+        self._paused = False
+        self._stop_flag = False
+        self._loop = None
+        self._stop_event = None # asyncio.Event, created inside the loop
+        self._resume_event = None # set while not paused
+
+    # --- Thread-safe controls ---
+
+    def request_stop(self):
+        self._stop_flag = True
+        self._call_in_loop(lambda: self._stop_event.set())
+
+    def stop_requested(self):
+        return self._stop_flag
+
+    def toggle_pause(self):
+        self._paused = not self._paused
+        paused = self._paused
+        self._call_in_loop(lambda: self._resume_event.clear() if paused else self._resume_event.set())
+        return paused
+
+    def set_skip_existing(self, enabled):
+        self.skip_existing = enabled
+
+    def _call_in_loop(self, fn):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(fn)
+            except RuntimeError:
+                pass # loop already shut down
+
+    def model_key(self, model_name=None):
+        """
+        Name a model's results and rate budget are kept under (backend-qualified for non-Gemini backends).
+        """
+        model_name = model_name or self.model_name
+        return self.backend.cache_name(model_name) if self.backend is not None else model_name
+
+    def rate_limits_for(self, model_name):
+        if self.backend is not None and self.backend.rate_limits:
+            return dict(self.backend.rate_limits)
+        return get_rate_limits(model_name)
+
+    def _backend_kwargs(self):
+        # Only passed when set, so the default Gemini path keeps its plain signature
+        kwargs = {"backend": self.backend} if self.backend is not None else {}
+        if self.schema_mode != "full":
+            kwargs["schema_mode"] = self.schema_mode
+        return kwargs
+
+    def extraction_job(self, pdf_path, with_hash):
+        """
+        Returns the picklable prepare_document() call for one file, with this run's extraction settings.
+        """
+        return functools.partial(
+            prepare_document, pdf_path,
+            with_hash=with_hash,
+            max_chars=self.extract_max_chars,
+            stop_on_signal=self.early_stop,
+            compact_chars=self.compact_tokens * CHARS_PER_TOKEN if self.compact_tokens else None,
+            read_metadata=self.use_pdf_metadata,
+            signature=bool(self.similarity_index_path and self.duplicate_threshold)
+        )
+
+    def _emit_progress(self, current, total, filename):
+        if self.on_progress:
+            self.on_progress(current, total, filename)
+
+    # --- Run ---
+
+    def run(self):
+        """
+        Runs the whole batch on a private event loop and returns the summary dict.
+        """
+        return asyncio.run(self.run_async())
+
+    async def run_async(self):
+        summary = {
+            "total": len(self.pdf_files) if hasattr(self.pdf_files, "__len__") else 0,
+            "processed": 0,
+            "success": 0,
+            "filename_only_success": 0,
+            "skipped": 0,
+            "failed": 0,
+            "cached": 0,
+            "local_index": 0,
+            "pdf_metadata": 0,
+            "gap_requests": 0,
+            "escalated": 0,
+            "near_duplicates": 0,
+            "batch": 0,
+            "chars_raw": 0,
+            "chars_compact": 0,
+            "rate_limited": 0,
+            "context_cached": 0,
+            "output_tokens": 0,
+            "avg_output_tokens": 0.0,
+            "failed_files": [], 
+            "stage_seconds": {},
+            "cancelled": False
+        }
+
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._resume_event = asyncio.Event()
+        if self._stop_flag:
+            self._stop_event.set()
+        if not self._paused:
+            self._resume_event.set()
+
+        # Sleep Prevention Start
+        if self.prevent_sleep:
+            try:
+                ctypes.windll.kernel32.SetThreadExecutionState(ES_CONTINUOUS | ES_SYSTEM_REQUIRED)
+                print("Sleep prevention enabled.")
+            except Exception as e:
+                print(f"Failed to set execution state: {e}")
+
+        # Result Cache
+        if self.use_cache:
+            try:
+                self._cache = ResultCache()
+            except Exception as e:
+                print(f"Result cache unavailable: {e}")
+                self._cache = None
+
+        # Offline Metadata Index
+        if self.metadata_index_path and os.path.exists(self.metadata_index_path):
+            try:
+                self._metadata_index = MetadataIndex(self.metadata_index_path)
+            except Exception as e:
+                print(f"Metadata index unavailable: {e}")
+                self._metadata_index = None
+
+        # Near-Duplicate Index
+        if self.similarity_index_path and self.duplicate_threshold:
+            try:
+                self._similarity_index = SimilarityIndex(self.similarity_index_path, self.duplicate_threshold)
+            except Exception as e:
+                print(f"Near-duplicate index unavailable: {e}")
+                self._similarity_index = None
+
+        # Tracing & Metrics
+        self.telemetry = Telemetry(self.trace_path, self.metrics_path, self.metrics_port)
+        try:
+            self.telemetry.start()
+        except OSError as e:
+            print(f"Tracing unavailable: {e}")
+            self.telemetry = Telemetry()
+
+        # Output stage: atomic .ris writes on a dedicated thread
+        self._writer = RisWriter(library_path=self.library_path)
+        self._writer.start()
+
+        # Stage 1: CPU-bound extraction in worker processes (sidesteps the GIL)
+        try:
+            extract_pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.extract_workers)
+        except (NotImplementedError, OSError) as e:
+            print(f"Process pool unavailable, extracting in threads: {e}")
+            extract_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.extract_workers)
+
+        schedulers = [self._scheduler] + ([self._cascade_scheduler] if self._cascade_scheduler else [])
+        rate_limited_before = sum(s.rate_limited_count for s in schedulers)
+        context_cached_before = context_cache.stats["requests"]
+        pipeline = asyncio.create_task(self._pipeline(extract_pool, summary))
+        stopper = asyncio.create_task(self._stop_event.wait())
+        
+        try:
+            await asyncio.wait({pipeline, stopper}, return_when=asyncio.FIRST_COMPLETED)
+            if not pipeline.done():
+                # Stop: cancel everything in flight (queued retries and API waits included)
+                summary["cancelled"] = True
+                pipeline.cancel()
+            try:
+                await pipeline
+            except asyncio.CancelledError:
+                pass
+
+            summary["rate_limited"] = sum(s.rate_limited_count for s in schedulers) - rate_limited_before
+            # Requests sent against a server-side cached prompt prefix (processor.ContextCache)
+            summary["context_cached"] = context_cache.stats["requests"] - context_cached_before
+            # Estimated answer size per document answered by the API (packs are split over their documents)
+            summary["output_tokens"] = int(self.telemetry.counter("response_tokens_total"))
+            answered = self.telemetry.counter("response_documents_total")
+            summary["avg_output_tokens"] = round(summary["output_tokens"] / answered, 1) if answered else 0.0
+            print(f"Scheduler: effective rate {self._scheduler.effective_rpm:.0f} RPM / {self._scheduler.effective_tpm:.0f} TPM")
+
+        finally:
+            stopper.cancel()
+            extract_pool.shutdown(wait=False, cancel_futures=True)
+
+            if self._cache is not None:
+                self._cache.close()
+                self._cache = None
+            if self._metadata_index is not None:
+                self._metadata_index.close()
+                self._metadata_index = None
+            if self._similarity_index is not None:
+                self._similarity_index.close()
+                self._similarity_index = None
+            
+            # Sleep Prevention Release
+            if self.prevent_sleep:
+                try:
+                    ctypes.windll.kernel32.SetThreadExecutionState(ES_CONTINUOUS)
+                    print("Sleep prevention released.")
+                except Exception as e:
+                    print(f"Failed to release execution state: {e}")
+
+            if self.journal is not None:
+                if self._journal_flush is not None:
+                    await asyncio.gather(self._journal_flush, return_exceptions=True)
+                    self._journal_flush = None
+                await self._flush_journal()
+
+            await asyncio.to_thread(self._writer.close)
+            self._writer = None
+
+            if self._manifest_save is not None:
+                await asyncio.gather(self._manifest_save, return_exceptions=True)
+            await self._save_manifests()
+            self._manifests = {}
+
+            if self._metrics_write is not None:
+                await asyncio.gather(self._metrics_write, return_exceptions=True)
+                self._metrics_write = None
+            summary["stage_seconds"] = {stage: round(seconds, 3) for stage, seconds in self.telemetry.stage_seconds.items()}
+            await asyncio.to_thread(self.telemetry.close)
+
+            self._loop = None
+
+        return summary
+
+    async def _pipeline(self, extract_pool, summary):
+        """
+        Producer (skip check + extraction, bounded) -> ready queue -> dispatcher (API concurrency).
+        """
+        loop = asyncio.get_running_loop()
+        streaming = not hasattr(self.pdf_files, "__len__")
+        ready = asyncio.Queue(maxsize=self.queue_size)
+        extract_slots = asyncio.Semaphore(self.extract_workers)
+        api_slots = asyncio.Semaphore(self.max_workers)
+        tasks = set()
+        done_marker = object()
+        # Retryable failures wait here for their backoff without holding an API slot
+        retries = RetryQueue()
+
+        async def extract_one(i, pdf_path):
+            try:
+                started = time.monotonic()
+                error = None
+                try:
+                    doc = await loop.run_in_executor(extract_pool, self.extraction_job(pdf_path, self._hash_files()))
+                except Exception as e:
+                    # e.g. a crashed worker process; fall back to filename mode like an unreadable PDF
+                    print(f"Extraction Error ({os.path.basename(pdf_path)}): {e}")
+                    doc = {"text": "", "content_hash": None}
+                    error = str(e)
+                # Wall time includes waiting for a pool process; cpu_seconds is the time inside it
+                self.telemetry.record_span("extract", os.path.basename(pdf_path), time.monotonic() - started, error=error,
+                                           cpu_seconds=doc.get("extract_seconds"), chars=len(doc["text"]))
+                doc["queued_at"] = time.monotonic()
+                await ready.put((i, pdf_path, doc)) # blocks while the API stage is saturated
+            finally:
+                extract_slots.release()
+
+        async def iter_files():
+            if not streaming:
+                for pdf_path in self.pdf_files:
+                    yield pdf_path
+                return
+            # Scanning (e.g. a network share) blocks, so pull paths in batches from a thread;
+            # the scan only advances as fast as extraction consumes it.
+            files = iter(self.pdf_files)
+            while True:
+                started = time.monotonic()
+                batch = await asyncio.to_thread(lambda: list(itertools.islice(files, SCAN_BATCH)))
+                self.telemetry.record_span("scan", None, time.monotonic() - started, files=len(batch))
+                if not batch:
+                    return
+                for pdf_path in batch:
+                    yield pdf_path
+
+        async def produce():
+            extractions = set()
+            i = -1
+            async for pdf_path in iter_files():
+                i += 1
+                if streaming:
+                    summary["total"] = i + 1
+                await self._resume_event.wait()
+
+                folder = os.path.dirname(pdf_path)
+                if self.use_manifest and folder not in self._manifests:
+                    # One manifest read + one folder listing covers every PDF in the folder
+                    with self.telemetry.span("scan", folder, manifest=True):
+                        self._manifests[folder] = await asyncio.to_thread(FolderManifest.load, folder)
+
+                skipped = self._check_skip(pdf_path, i, summary["total"])
+                if skipped:
+                    self._record_result(skipped, summary)
+                    continue
+                self._journal(pdf_path, QUEUED)
+
+                await extract_slots.acquire()
+                task = asyncio.create_task(extract_one(i, pdf_path))
+                extractions.add(task)
+                task.add_done_callback(extractions.discard)
+
+            if extractions:
+                await asyncio.gather(*extractions)
+            await ready.put(done_marker)
+
+        async def run_api(coro_factory, paths, attempt):
+            for pdf_path in paths:
+                self._journal(pdf_path, STARTED)
+            _retry_attempt.set(attempt)
+            try:
+                res = await coro_factory()
+                # Packed requests return one result per document
+                for r in (res if isinstance(res, list) else [res]):
+                    self._record_result(r, summary)
+            except RetryLater as e:
+                retries.push((coro_factory, paths, e.attempt + 1), e.delay)
+            except Exception as e:
+                print(f"Task Error: {e}")
+                summary['failed'] += 1
+                summary['processed'] += 1
+            finally:
+                api_slots.release()
+
+        async def dispatch(coro_factory, paths, attempt=None):
+            """
+            attempt: first attempt index for a single document (its retries are deferred); None for packs.
+            """
+            await self._resume_event.wait()
+            await api_slots.acquire()
+            task = asyncio.create_task(run_api(coro_factory, paths, attempt))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        async def feed_retries():
+            # Due retries compete for slots like fresh work
+            while True:
+                coro_factory, paths, attempt = await retries.get()
+                try:
+                    await dispatch(coro_factory, paths, attempt)
+                finally:
+                    retries.done()
+
+        producer = asyncio.create_task(produce())
+        retry_feeder = asyncio.create_task(feed_retries())
+        pending = []
+        try:
+            while True:
+                item = await ready.get()
+                finished = item is done_marker
+
+                if not self.pack_token_budget:
+                    if finished:
+                        break
+                    i, pdf_path, doc = item
+                    await dispatch(lambda i=i, pdf_path=pdf_path, doc=doc: self._process_single_file(pdf_path, doc, i, summary["total"]), [pdf_path], 0)
+                    continue
+
+                # Packing: collect until a pack is full (or nothing more will arrive)
+                if not finished:
+                    pending.append(item)
+                while pending and (finished or self._pack_is_full(pending)):
+                    batch = self._take_pack(pending)
+                    await dispatch(lambda batch=batch: self._process_pack(batch, summary["total"]), [item[1] for item in batch],
+                                   0 if len(batch) == 1 else None)
+                if finished:
+                    break
+
+            await producer
+            # Drain: running tasks may defer more retries until every document is finished
+            while tasks or retries.pending:
+                if tasks:
+                    await asyncio.wait(set(tasks), return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await retries.wait_changed()
+        finally:
+            producer.cancel()
+            retry_feeder.cancel() # queued retries are dropped at once on Stop
+            for task in list(tasks):
+                task.cancel()
+
+    # --- Result bookkeeping ---
+
+    def _record_result(self, res, summary):
+        # res is dict: {status: 'success'|'skipped'|'failed', filename: str, path: str, reason: str, type: str}
+        # Always called on the event loop thread, so no locking is needed.
+        if res['status'] == 'skipped':
+            summary['skipped'] += 1
+        elif res['status'] == 'success':
+            if res.get('type') == 'filename_only':
+                summary['filename_only_success'] += 1
+            else:
+                summary['success'] += 1
+            if res.get('cached'):
+                summary['cached'] += 1
+            if res.get('source') == 'local_index':
+                summary['local_index'] += 1
+            elif res.get('source') == 'pdf_metadata':
+                summary['pdf_metadata'] += 1
+            elif res.get('source') == 'near_duplicate':
+                summary['near_duplicates'] += 1
+            elif res.get('source') == 'batch':
+                summary['batch'] += 1
+            if res.get('gap_fields'):
+                summary['gap_requests'] += 1
+            if res.get('escalated'):
+                summary['escalated'] += 1
+        else: # failed
+            summary['failed'] += 1
+            summary['failed_files'].append((res['filename'], res.get('reason', 'UNKNOWN')))
+        
+        summary['processed'] += 1
+        self.telemetry.inc("files_total", status=res['status'])
+        if res['status'] == 'failed':
+            self.telemetry.inc("failures_total", code=base_code(res.get('reason', 'UNKNOWN')))
+        if self.telemetry.metrics_due() and (self._metrics_write is None or self._metrics_write.done()):
+            self._metrics_write = asyncio.get_running_loop().create_task(asyncio.to_thread(self.telemetry.write_metrics))
+        summary['chars_raw'] += res.get('chars_raw', 0)
+        summary['chars_compact'] += res.get('chars_compact', 0)
+
+        if res['status'] == 'skipped' and res.get('path') and self._writer is not None:
+            self._writer.add_to_library(os.path.splitext(res['path'])[0] + ".ris")
+
+        if res.get('path'):
+            state = {'skipped': SKIPPED, 'success': SUCCEEDED}.get(res['status'], FAILED)
+            self._journal(res['path'], state, res.get('reason'))
+
+        if self.on_result:
+            self.on_result(res)
+
+    def _check_skip(self, pdf_path, idx, total_count):
+        """
+        Returns a 'skipped' result if the file needs no processing, else None.
+        Runs before extraction so skipped files never reach the process pool.
+        """
+        basename = os.path.basename(pdf_path)
+        if self.resume_states is not None:
+            state, code = self.resume_states.get(os.path.abspath(pdf_path), (None, None))
+            if state in (SUCCEEDED, SKIPPED):
+                self._emit_progress(idx + 1, total_count, f"{basename} (Done in previous run)")
+                return {'status': 'skipped', 'filename': basename, 'path': pdf_path, 'reason': 'RESUMED'}
+            if state == FAILED and base_code(code) not in self.retry_codes:
+                # Keep the earlier failure without retrying it
+                self._emit_progress(idx + 1, total_count, f"{basename} (Failed in previous run)")
+                return {'status': 'failed', 'filename': basename, 'path': pdf_path, 'reason': code or 'UNKNOWN', 'resumed': True}
+
+        manifest = self._manifests.get(os.path.dirname(pdf_path))
+        state = manifest.check(basename) if manifest is not None else None
+        if state == CHANGED:
+            # Replaced since its .ris was generated: no near-duplicate reuse of the old version
+            self._changed_paths.add(os.path.abspath(pdf_path))
+        if self.needs_processing(pdf_path, state):
+            return None
+        if state == UNTRACKED:
+            manifest.record(basename) # adopt a .ris generated before manifests existed
+        self._emit_progress(idx + 1, total_count, f"{basename} (Skipped)")
+        return {'status': 'skipped', 'filename': basename, 'path': pdf_path}
+
+    def needs_processing(self, pdf_path, state) -> bool:
+        """
+        The skip_existing decision for a PDF with the given manifest state (None when its folder has
+        no manifest or listing). Shared by the run, the planner and batch preparation.
+        """
+        if not self.skip_existing:
+            return True
+        if state is None:
+            # Not covered by a folder listing (e.g. manifests off): plain existence check
+            return not os.path.exists(os.path.splitext(pdf_path)[0] + ".ris")
+        return state not in (UNCHANGED, UNTRACKED)
+
+    def pending_files(self, files):
+        """
+        Returns [(path, manifest state)] for the files a run would not skip, with each folder's
+        manifest loaded once like the scan does. For the planner and batch preparation (the
+        manifests are not kept: the run loads its own).
+        """
+        manifests = {}
+        pending = []
+        for path in files:
+            folder = os.path.dirname(path)
+            if self.use_manifest and folder not in manifests:
+                manifests[folder] = FolderManifest.load(folder)
+            manifest = manifests.get(folder)
+            state = manifest.check(os.path.basename(path)) if manifest is not None else None
+            if self.needs_processing(path, state):
+                pending.append((path, state))
+        return pending
+
+    def _hash_files(self):
+        # The content hash keys the result cache, lets the manifest recognise touched but identical PDFs
+        # and keeps a moved or renamed PDF from matching its own near-duplicate entry
+        return self.use_cache or self.use_manifest or bool(self.similarity_index_path and self.duplicate_threshold)
+
+    def _update_manifest(self, pdf_path, content_hash):
+        manifest = self._manifests.get(os.path.dirname(pdf_path))
+        if manifest is None:
+            return
+        manifest.record(os.path.basename(pdf_path), content_hash)
+        now = time.monotonic()
+        if now - self._manifest_saved_at >= MANIFEST_SAVE_INTERVAL and (self._manifest_save is None or self._manifest_save.done()):
+            self._manifest_saved_at = now
+            self._manifest_save = asyncio.get_running_loop().create_task(self._save_manifests())
+
+    async def _save_manifests(self):
+        for manifest in list(self._manifests.values()):
+            if manifest.dirty:
+                snapshot = manifest.snapshot()
+                await asyncio.to_thread(manifest.save, snapshot)
+
+    def _journal(self, pdf_path, state, code=None):
+        if self.journal is None:
+            return
+        try:
+            due = self.journal.record(pdf_path, state, code, autoflush=False)
+        except Exception as e:
+            print(f"Journal write failed: {e}")
+            return
+        # The SQLite commit runs on a worker thread
+        if due and (self._journal_flush is None or self._journal_flush.done()):
+            self._journal_flush = asyncio.get_running_loop().create_task(self._flush_journal())
+
+    async def _flush_journal(self):
+        try:
+            await asyncio.to_thread(self.journal.flush)
+        except Exception as e:
+            print(f"Journal write failed: {e}")
+
+    # --- Packing ---
+
+    def _pack_is_full(self, ready):
+        tokens = 0
+        count = 0
+        for _, pdf_path, doc in ready:
+            if not doc["text"].strip():
+                return True # filename-mode documents are sent alone right away
+            count += 1
+            tokens += estimate_tokens(doc["text"])
+            if count >= self.pack_max_docs or tokens >= self.pack_token_budget:
+                return True
+        return False
+
+    def _take_pack(self, ready):
+        """
+        Pops the next pack from the front of `ready` (a list): consecutive text-mode documents within the token budget.
+        """
+        candidates = []
+        while ready and len(candidates) < self.pack_max_docs:
+            item = ready[0]
+            if not item[2]["text"].strip():
+                if not candidates:
+                    return [ready.pop(0)]
+                break
+            candidates.append({"filename": os.path.basename(item[1]), "text": item[2]["text"], "item": ready.pop(0)})
+
+        packs = plan_packs(candidates, self.pack_token_budget, self.pack_max_docs)
+        ready[0:0] = [c["item"] for pack in packs[1:] for c in pack]
+        return [c["item"] for c in packs[0]]
+
+    async def _process_pack(self, items, total_count):
+        """
+        items: [(idx, pdf_path, doc), ...]. Returns a list of result dicts.
+        Sends one packed request for all uncached text-mode documents; any document missing
+        from the response (or a failed pack) falls back to a normal single-document call.
+        """
+        prefetched = {}
+        to_send = []
+        for _, pdf_path, doc in items:
+            self._record_queue_wait(pdf_path, doc)
+        for n, (idx, pdf_path, doc) in enumerate(items):
+            basename = os.path.basename(pdf_path)
+            await self._lookup_indexes(doc, pdf_path)
+            if not doc["text"].strip() or os.path.abspath(pdf_path) in self.batch_results or self._resolve_locally(doc) or self._complete_pdf_fields(doc) or self._find_duplicate(doc, pdf_path):
+                continue
+            key = self._cache_key(doc.get("content_hash"), False, basename)
+            hit = await self._cache.get_async(key) if key else None
+            if hit is not None:
+                prefetched[n] = (hit, True)
+            else:
+                to_send.append({"id": f"D{n + 1}", "n": n, "key": key, "filename": basename, "text": doc["text"]})
+
+        if len(to_send) > 1:
+            label = f"pack of {len(to_send)}"
+            try:
+                documents = [{"id": d["id"], "filename": d["filename"], "text": d["text"]} for d in to_send]
+                packed = await self._call_with_retry(
+                    lambda: generate_ris_data_packed_async(
+                        documents,
+                        api_key=self.api_key,
+                        model_name=self.model_name,
+                        **self._backend_kwargs()
+                    ),
+                    label,
+                    estimate_tokens(build_packed_prompt(documents, self.schema_mode)),
+                    documents=len(documents)
+                )
+            except Exception as e:
+                print(f"Packed request failed ({label}), falling back to single requests: {e}")
+                packed = {}
+
+            for d in to_send:
+                data = expand_record(packed.get(d["id"]))
+                if data:
+                    if d["key"]:
+                        await self._cache.put_async(d["key"], data)
+                    prefetched[d["n"]] = (data, False)
+            print(f"Packed request: {len(prefetched)}/{len(items)} resolved, {len(items) - len(prefetched)} single fallback(s)")
+
+        return list(await asyncio.gather(*[
+            self._process_single_file(pdf_path, doc, idx, total_count, prefetched.get(n))
+            for n, (idx, pdf_path, doc) in enumerate(items)
+        ]))
+
+    # --- Per-file processing ---
+
+    async def _process_single_file(self, pdf_path, doc, idx, total_count, prefetched=None):
+        """
+        prefetched: optional (data, cache_hit) already obtained (e.g. from a packed request); skips the API call.
+        """
+        basename = os.path.basename(pdf_path)
+        sizes = {}
+        self._record_queue_wait(pdf_path, doc)
+        self._emit_progress(idx + 1, total_count, basename) # idx here is start index, might be out of order in UI updates but OK
+
+        try:
+            # 1. Extraction (already done by the process pool)
+            text = doc["text"]
+            
+            use_filename_mode = False
+            if not text.strip():
+                use_filename_mode = True
+                text = ""
+            else:
+                # Prompt size before/after compaction, reported per file
+                sizes = {'chars_raw': doc.get('chars_raw', len(text)), 'chars_compact': len(text)}
+
+            # 2. Offline index, then the PDF's own metadata, then an already processed copy,
+            #    else Gemini API with Retry (through the result cache when enabled; only for the fields still missing)
+            await self._lookup_indexes(doc, pdf_path)
+            local = None if use_filename_mode else self._resolve_locally(doc)
+            pdf_fields = {} if use_filename_mode else self._pdf_fields(doc)
+            source = None
+            gaps = None
+            escalated = None
+            batch_record = self.batch_results.get(os.path.abspath(pdf_path)) if not prefetched else None
+            if local:
+                data, cached, source = local, False, 'local_index'
+            elif self._complete_pdf_fields(doc) and not use_filename_mode:
+                data, cached, source = pdf_fields, False, 'pdf_metadata'
+            elif not prefetched and batch_record is None and not use_filename_mode and self._find_duplicate(doc, pdf_path):
+                record, similarity, original = self._find_duplicate(doc, pdf_path)
+                data, cached, source = duplicate_record(record, original, similarity), False, 'near_duplicate'
+            else:
+                if prefetched:
+                    data, cached = prefetched
+                elif batch_record is not None:
+                    data, cached, source = batch_record, False, 'batch'
+                    key = self._cache_key(doc.get("content_hash"), use_filename_mode, basename)
+                    if key:
+                        await self._cache.put_async(key, data)
+                else:
+                    gaps = missing_fields(pdf_fields, list(OUTPUT_SCHEMA["properties"])) if pdf_fields else None
+                    data, cached = await self._generate_cached(doc.get("content_hash"), text, basename, use_filename_mode, gaps)
+                if data and pdf_fields:
+                    data = merge_fields(pdf_fields, data)
+                if data and self.cascade_model and not use_filename_mode:
+                    data, escalated = await self._escalate(doc, text, basename, data)
+
+            # 3. Post-Processing & Save
+            if data:
+                has_ti = data.get("TI", {}).get("value")
+                has_au = data.get("AU") 
+                
+                if not has_ti and not has_au:
+                        raise Exception("AI_NULL" if not use_filename_mode else "OCR_REQUIRED")
+
+                success_type = "normal"
+                if use_filename_mode:
+                    note_val = "OCR_REQUIRED"
+                    missing = []
+                    if not has_au: missing.append("AU")
+                    if not data.get("PY", {}).get("value"): missing.append("PY")
+                    
+                    if missing: note_val += f" (CHECK: {','.join(missing)} missing)"
+                    
+                    if "N1" not in data: data["N1"] = {}
+                    data["N1"]["value"] = note_val
+                    
+                    success_type = "filename_only"
+                    if not has_ti: raise Exception("OCR_REQUIRED") 
+
+                with self.telemetry.span("postprocess", basename):
+                    ris_content = dict_to_ris(data)
+                ris_path = os.path.splitext(pdf_path)[0] + ".ris"
+                
+                # Written by the output stage (atomic, batched); waits until it is on disk
+                with self.telemetry.span("write", basename):
+                    await self._writer.write(ris_path, ris_content)
+                self._update_manifest(pdf_path, doc.get("content_hash"))
+                if source != 'near_duplicate' and not use_filename_mode:
+                    await asyncio.to_thread(self._index_signature, doc, data, pdf_path)
+                
+                res = {'status': 'success', 'filename': basename, 'path': pdf_path, 'type': success_type, 'cached': cached, **sizes}
+                if source:
+                    res['source'] = source
+                if gaps:
+                    res['gap_fields'] = gaps
+                if escalated:
+                    res['escalated'] = escalated
+                if source == 'near_duplicate':
+                    res['duplicate_of'] = doc["near_duplicate"][2]
+                return res
+                    
+            else:
+                raise Exception("AI_NULL")
+
+        except RetryLater:
+            raise
+        except Exception as e:
+            msg = str(e)
+            if "OCR_REQUIRED" in msg: code = "OCR_REQUIRED"
+            elif "RATE_LIMIT" in msg: code = "RATE_LIMIT"
+            elif "TIMEOUT" in msg: code = "TIMEOUT"
+            elif "AI_NULL" in msg: code = "AI_NULL"
+            elif "AI_EMPTY_RESPONSE" in msg: code = "AI_EMPTY_RESPONSE"
+            elif "Permission" in msg: code = "WRITE_FAILED"
+            else: code = f"API_ERROR: {msg}"
+            
+            return {'status': 'failed', 'filename': basename, 'path': pdf_path, 'reason': code, **sizes}
+
+    async def _lookup_indexes(self, doc, pdf_path):
+        """
+        Runs the offline index and near-duplicate lookups for a document on a worker thread (both
+        are SQLite queries); _resolve_locally() and _find_duplicate() then return the remembered results.
+        """
+        pending = (self._metadata_index is not None and doc.get("identifiers") and "local_metadata" not in doc) or \
+                  (self._similarity_index is not None and doc.get("signature") and "near_duplicate" not in doc)
+        if pending:
+            await asyncio.to_thread(lambda: (self._resolve_locally(doc), self._find_duplicate(doc, pdf_path)))
+
+    def _resolve_locally(self, doc):
+        """
+        Returns the offline index record for a document (or None). The lookup is remembered on doc,
+        so packing and the single-file path query the index only once.
+        """
+        if self._metadata_index is None or not doc.get("identifiers"):
+            return None
+        if "local_metadata" not in doc:
+            try:
+                doc["local_metadata"] = self._metadata_index.resolve(doc["text"], doc["identifiers"])
+            except Exception as e:
+                print(f"Metadata index lookup failed: {e}")
+                doc["local_metadata"] = None
+        return doc["local_metadata"]
+
+    def _record_queue_wait(self, pdf_path, doc):
+        # Extraction finished -> API stage started (ready queue, API slots, pack collection)
+        queued_at = doc.pop("queued_at", None)
+        if queued_at is not None:
+            self.telemetry.record_span("queue", os.path.basename(pdf_path), time.monotonic() - queued_at)
+
+    def _find_duplicate(self, doc, pdf_path):
+        """
+        Returns (record, similarity, filename) of an already processed near-identical document, or None.
+        Never the file's own earlier entry (same path or content), and never for a PDF the manifest
+        reports as changed: that one gets a fresh extraction. Remembered on doc like _resolve_locally().
+        """
+        if self._similarity_index is None or not doc.get("signature"):
+            return None
+        if os.path.abspath(pdf_path) in self._changed_paths:
+            return None
+        if "near_duplicate" not in doc:
+            try:
+                doc["near_duplicate"] = self._similarity_index.lookup(doc["signature"], pdf_path, doc.get("content_hash"))
+            except Exception as e:
+                print(f"Near-duplicate lookup failed: {e}")
+                doc["near_duplicate"] = None
+        return doc["near_duplicate"]
+
+    def _index_signature(self, doc, data, pdf_path):
+        if self._similarity_index is None or not doc.get("signature"):
+            return
+        try:
+            self._similarity_index.add(doc["signature"], data, os.path.basename(pdf_path), pdf_path, doc.get("content_hash"))
+        except Exception as e:
+            print(f"Near-duplicate index update failed: {e}")
+
+    def _pdf_fields(self, doc):
+        return (doc.get("pdf_fields") or {}) if self.use_pdf_metadata else {}
+
+    def _complete_pdf_fields(self, doc):
+        """
+        True if the embedded metadata alone covers every required field with good confidence.
+        """
+        fields = self._pdf_fields(doc)
+        return bool(fields) and not missing_fields(fields)
+
+    async def _escalate(self, doc, text, basename, data):
+        """
+        Returns (data, escalated fields). Re-asks the cascade model for the fields the fast model was
+        unsure of or got invalid; if that request fails, the fast model's answer is kept.
+        """
+        fields = escalation_fields(data)
+        if not fields:
+            return data, None
+        try:
+            strong, _ = await self._generate_cached(doc.get("content_hash"), text, basename, False, fields, model_name=self.cascade_model)
+        except Exception as e:
+            print(f"Escalation to {self.cascade_model} failed for {basename}, keeping the first answer: {e}")
+            return data, None
+        print(f"Escalated {basename} to {self.cascade_model}: {', '.join(fields)}")
+        return apply_escalation(data, strong, fields), fields
+
+    async def _generate_cached(self, content_hash, text, basename, use_filename_mode, fields=None, model_name=None):
+        """
+        Returns (data, cache_hit). Falls through to the API when the cache is disabled or the hash is unknown.
+        fields: gap request for only these schema fields (None = full extraction).
+        model_name: the cascade model instead of the run's model.
+        """
+        generate = lambda: self._generate_with_retry(text, basename, use_filename_mode, fields, model_name)
+        key = self._cache_key(content_hash, use_filename_mode, basename, fields, model_name)
+        if key is None:
+            return await generate(), False
+        return await self._cache.get_or_compute_async(key, generate)
+
+    def _cache_key(self, content_hash, use_filename_mode, basename, fields=None, model_name=None):
+        if self._cache is None or not content_hash:
+            return None
+        # A gap request's answer only covers its fields, so the field set is part of the key
+        prompt_version = self.prompt_version + ("|" + ",".join(fields) if fields else "")
+        return make_cache_key(content_hash, self.model_key(model_name), use_filename_mode, prompt_version, basename)
+
+    async def _generate_with_retry(self, text, basename, use_filename_mode, fields=None, model_name=None):
+        extra = {"fields": fields} if fields else {}
+        extra.update(self._backend_kwargs())
+        data = await self._call_with_retry(
+            lambda: generate_ris_data_async(
+                text_context=text, 
+                filename=basename, 
+                api_key=self.api_key, 
+                model_name=model_name or self.model_name,
+                filename_mode=use_filename_mode,
+                **extra
+            ),
+            basename,
+            estimate_tokens(build_prompt(text, basename, use_filename_mode, fields, self.schema_mode)),
+            self._cascade_scheduler if model_name else None,
+            defer=model_name is None
+        )
+        return expand_record(data)
+
+    async def _call_with_retry(self, call, basename, prompt_tokens=0, scheduler=None, defer=False, documents=1):
+        """
+        call: zero-argument function returning a fresh coroutine per attempt.
+        Backoff uses asyncio.sleep, so waiting retries hold no thread.
+        scheduler: the rate budget to wait on (default: the run model's).
+        defer: in a task dispatched for a single document, a retryable failure raises RetryLater
+        (the pipeline re-queues the document and frees the API slot) instead of sleeping in place.
+        Recorded as one 'api' span (the attempts made in it, rate-limit waits and backoff included).
+        documents: how many documents the answer covers (a pack's size), for the per-document token average.
+        """
+        scheduler = scheduler or self._scheduler
+        telemetry = self.telemetry
+        telemetry.inc("api_calls_total")
+        with telemetry.span("api", basename, prompt_tokens=prompt_tokens) as span:
+            try:
+                data = await self._attempt_with_retry(call, basename, prompt_tokens, scheduler, span, defer)
+            except RetryLater as e:
+                span["deferred_seconds"] = e.delay
+                span["error"] = e.reason
+                raise
+            except Exception as e:
+                span["code"] = str(e) if str(e) in ("RATE_LIMIT", "TIMEOUT", "AI_EMPTY_RESPONSE") else "API_ERROR"
+                raise
+            if data:
+                span["response_tokens"] = estimate_tokens(json.dumps(data, ensure_ascii=False))
+                telemetry.inc("response_tokens_total", span["response_tokens"])
+                telemetry.inc("response_documents_total", documents)
+            return data
+
+    async def _attempt_with_retry(self, call, basename, prompt_tokens, scheduler, span, defer):
+        data = None
+        max_retries = self.max_attempts - 1
+        telemetry = self.telemetry
+        # Deferred documents come back here with the index of their next attempt
+        deferred = _retry_attempt.get() if defer else None
+        span["attempts"] = 0
+        span["rate_wait_seconds"] = 0.0
+
+        for attempt in range(deferred or 0, max_retries + 1):
+            try:
+                # Wait for the shared RPM/TPM budget before every attempt
+                waited = time.monotonic()
+                await scheduler.acquire_async(prompt_tokens)
+                span["rate_wait_seconds"] += time.monotonic() - waited
+
+                span["attempts"] = attempt + 1
+                telemetry.inc("api_attempts_total")
+                telemetry.inc("prompt_tokens_total", prompt_tokens)
+                if attempt:
+                    telemetry.inc("api_retries_total")
+                started = time.monotonic()
+                telemetry.add_gauge("api_in_flight", 1)
+                try:
+                    data = await call()
+                finally:
+                    telemetry.add_gauge("api_in_flight", -1)
+                scheduler.on_success()
+                scheduler.record_latency(time.monotonic() - started)
+
+                if data: break 
+                else:
+                    if attempt < max_retries:
+                        delay = backoff_delay(attempt, jitter=1.0)
+                        if deferred is not None:
+                            raise RetryLater(delay, attempt, "AI_NULL")
+                        await asyncio.sleep(delay)
+                        continue
+                    else:
+                        raise Exception("AI_NULL")
+
+            except RetryLater:
+                raise
+            except Exception as e:
+                err_str = str(e)
+                if "429" in err_str or "ResourceExhausted" in err_str:
+                    scheduler.on_rate_limited()
+                    telemetry.inc("api_rate_limited_total")
+                is_retryable = (
+                    "429" in err_str or 
+                    "500" in err_str or "503" in err_str or "504" in err_str or 
+                    "ResourceExhausted" in err_str or 
+                    "DeadlineExceeded" in err_str or 
+                    "AI_EMPTY_RESPONSE" in err_str or
+                    "AI_NULL" in err_str 
+                )
+
+                if is_retryable and attempt < max_retries:
+                    sleep_time = backoff_delay(attempt)
+                    print(f"Retry {attempt+1}/{max_retries} for {basename}: {err_str}")
+                    if deferred is not None:
+                        raise RetryLater(sleep_time, attempt, err_str)
+                    await asyncio.sleep(sleep_time)
+                    continue
+                else:
+                    if "429" in err_str or "ResourceExhausted" in err_str: raise Exception("RATE_LIMIT")
+                    elif "500" in err_str or "503" in err_str or "504" in err_str or "DeadlineExceeded" in err_str: raise Exception("TIMEOUT")
+                    elif "AI_EMPTY_RESPONSE" in err_str or "AI_NULL" in err_str: raise Exception("AI_EMPTY_RESPONSE")
+                    else: raise e
+
+        return data
@@ -1,47 +1,126 @@
 import pypdf
 import os
+import re
+import time
+from .cache import hash_file
+from .metadata_index import find_identifiers, head_text, DOI_RE
+from .compaction import compact_text
+from .pdf_metadata import read_pdf_metadata, metadata_to_fields
+from .similarity import minhash_signature
 
-def extract_text_from_pdf(pdf_path: str, head_pages: int = 2, tail_pages: int = 4) -> str:
+# Front-matter markers: when the first pages already show one, the metadata is almost certainly there
+ABSTRACT_RE = re.compile(r'^\s*(abstract|keywords|key words|要旨|概要|キーワード)\b', re.IGNORECASE | re.MULTILINE)
+
+
+def page_priority(total_pages: int, head_pages: int = 2, tail_pages: int = 4) -> list:
+    """
+    Returns 0-based page indices in the order they are worth reading: the head pages,
+    then the tail pages from the last one backwards (e.g. 1, 2, 10, 9, 8, 7 for 10 pages).
+    """
+    order = list(range(min(head_pages, total_pages)))
+    for i in range(total_pages - 1, max(0, total_pages - tail_pages) - 1, -1):
+        if i not in order:
+            order.append(i)
+    return order
+
+
+def has_metadata_signal(text: str) -> bool:
+    """
+    True if a page looks like a title page: it carries a DOI or an abstract/keywords heading.
+    """
+    return bool(DOI_RE.search(text) or ABSTRACT_RE.search(text))
+
+
+def iter_pages(reader, head_pages: int = 2, tail_pages: int = 4):
+    """
+    Lazily yields (page_index, text) in priority order. Pages are only parsed when requested,
+    so a caller that stops early saves the remaining extract_text() calls.
+    text is None if the page could not be extracted.
+    """
+    for i in page_priority(len(reader.pages), head_pages, tail_pages):
+        try:
+            yield i, reader.pages[i].extract_text() or ""
+        except Exception:
+            yield i, None
+
+
+def extract_text_from_pdf(pdf_path: str, head_pages: int = 2, tail_pages: int = 4, max_chars: int = None, stop_on_signal: bool = False) -> str:
     """
     Extracts text from the first N and last M pages of a PDF.
     If the PDF has fewer pages than N+M, extracts all text.
+    max_chars: stop reading pages once this much text is collected (the last page is cut to fit).
+    stop_on_signal: stop after the first page carrying a DOI or abstract heading (once page 1 is read).
+    The result is always in page order.
+    """
+    return _read_pdf(pdf_path, head_pages, tail_pages, max_chars, stop_on_signal)[0]
+
+
+def _read_pdf(pdf_path, head_pages=2, tail_pages=4, max_chars=None, stop_on_signal=False, with_metadata=False):
+    """
+    Returns (text, metadata); metadata is read_pdf_metadata() output from the same reader, or None.
     """
-    text_content = []
+    pages = {}
+    used = 0
+    metadata = None
     
     try:
         reader = pypdf.PdfReader(pdf_path)
-        total_pages = len(reader.pages)
+        if with_metadata:
+            metadata = read_pdf_metadata(reader)
         
-        if total_pages == 0:
-            return ""
+        if len(reader.pages) == 0:
+            return "", metadata
 
-        # Determine which pages to extract
-        pages_to_extract = set()
-        
-        # Head pages
-        for i in range(min(head_pages, total_pages)):
-            pages_to_extract.add(i)
-            
-        # Tail pages
-        for i in range(max(0, total_pages - tail_pages), total_pages):
-            pages_to_extract.add(i)
-            
-        # Sort indices to keep order
-        sorted_indices = sorted(list(pages_to_extract))
-        
-        for i in sorted_indices:
-            try:
-                page = reader.pages[i]
-                text = page.extract_text()
-                if text:
-                    text_content.append(f"--- Page {i+1} ---")
-                    text_content.append(text)
-            except Exception as e:
-                text_content.append(f"--- Page {i+1} (Extraction Failed) ---")
+        for i, text in iter_pages(reader, head_pages, tail_pages):
+            if text is None:
+                pages[i] = f"--- Page {i+1} (Extraction Failed) ---"
+                continue
+            if not text:
+                continue
+            header = f"--- Page {i+1} ---\n"
+            if max_chars is not None:
+                # Budget covers the markers too, so the prompt's own truncation never cuts a page off
+                text = text[:max(0, max_chars - used - len(header))]
+            pages[i] = header + text
+            used += len(pages[i]) + 1
+
+            if max_chars is not None and used >= max_chars:
+                break
+            if stop_on_signal and i < head_pages and has_metadata_signal(text):
+                break
                 
-        return "\n".join(text_content)
+        return "\n".join(pages[i] for i in sorted(pages)), metadata
 
     except Exception as e:
         # In a real app, we might want to log this better
         print(f"Error reading {pdf_path}: {e}")
-        return ""
+        return "", metadata
+
+def prepare_document(pdf_path: str, with_hash: bool = False, max_chars: int = None, stop_on_signal: bool = False, compact_chars: int = None, read_metadata: bool = False, signature: bool = False) -> dict:
+    """
+    Extraction stage entry point (runs in a worker process, so it must stay picklable/top-level).
+    Returns {'text': str, 'content_hash': str or None, 'identifiers': {'doi': [...], 'isbn': [...], 'issn': [...]},
+             'chars_raw': int, 'pdf_fields': dict, 'signature': bytes or None, 'extract_seconds': float}.
+    compact_chars: compact the text (see compaction.py) to at most this many characters; None = send raw text.
+    read_metadata: also build fields from the PDF's /Info and XMP metadata (see pdf_metadata.py).
+    signature: also compute the MinHash signature for near-duplicate detection (see similarity.py).
+    """
+    started = time.perf_counter()
+    content_hash = None
+    if with_hash:
+        try:
+            content_hash = hash_file(pdf_path)
+        except OSError as e:
+            print(f"Failed to hash {pdf_path}: {e}")
+
+    text, metadata = _read_pdf(pdf_path, max_chars=max_chars, stop_on_signal=stop_on_signal, with_metadata=read_metadata)
+    # Identifiers on the first pages feed the offline metadata index (tail pages are mostly references)
+    head = head_text(text)
+    identifiers = find_identifiers(head)
+    # Embedded metadata is checked against the raw title pages (before compaction)
+    pdf_fields = metadata_to_fields(metadata, head, os.path.basename(pdf_path)) if metadata else {}
+    chars_raw = len(text)
+    if compact_chars is not None:
+        text = compact_text(text, compact_chars)
+    return {"text": text, "content_hash": content_hash, "identifiers": identifiers, "chars_raw": chars_raw, "pdf_fields": pdf_fields,
+            "signature": minhash_signature(text) if signature else None, "extract_seconds": time.perf_counter() - started}
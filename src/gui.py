@@ -1,13 +1,23 @@
 import sys
 import os
+import itertools
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
     QLabel, QLineEdit, QPushButton, QCheckBox, QComboBox, 
     QProgressBar, QTextEdit, QFileDialog, QMessageBox, QDialog, QSpinBox
 )
 from PySide6.QtCore import Qt, Signal, Slot
-from .config import load_config, save_config
-from .worker import ProcessingWorker
+from .config import load_config, save_config, DEFAULT_PACK_TOKEN_BUDGET, DEFAULT_COMPACT_TOKENS
+from .metadata_index import get_default_index_path
+from .similarity import get_default_index_path as get_default_similarity_path, DEFAULT_THRESHOLD as DEFAULT_DUPLICATE_THRESHOLD
+from .worker import ProcessingWorker, PlanWorker
+from .engine import ProcessingEngine
+from .planner import format_plan
+from .scanner import iter_pdf_files
+from .journal import RunJournal, DEFAULT_RETRY_CODES
+from .writer import LIBRARY_FILENAME
+from .backends import create_backend, backend_type
+from .processor import context_cache
 
 # User-friendly Error Mapping
 ERROR_MAP = {
@@ -36,14 +46,37 @@ class ResultDialog(QDialog):
         success = summary['success']
         rescued = summary.get('filename_only_success', 0)
         skipped = summary.get('skipped', 0)
+        cached = summary.get('cached', 0)
+        local_index = summary.get('local_index', 0)
+        pdf_metadata = summary.get('pdf_metadata', 0)
+        gap_requests = summary.get('gap_requests', 0)
+        escalated = summary.get('escalated', 0)
+        near_duplicates = summary.get('near_duplicates', 0)
+        chars_raw = summary.get('chars_raw', 0)
+        chars_compact = summary.get('chars_compact', 0)
+        saved_pct = (1 - chars_compact / chars_raw) * 100 if chars_raw else 0
+        rate_limited = summary.get('rate_limited', 0)
+        context_cached = summary.get('context_cached', 0)
+        avg_output_tokens = summary.get('avg_output_tokens', 0.0)
         failed = summary['failed']
+        stages = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in summary.get('stage_seconds', {}).items() if seconds)
         
         header = f"Status: {status}\n\n" \
                  f"Total Files: {total}\n" \
                  f"Success (Full): {success}\n" \
                  f"Success (Filename Only): {rescued}\n" \
                  f"Skipped (Existing): {skipped}\n" \
-                 f"Failed: {failed}\n"
+                 f"Reused from Cache: {cached}\n" \
+                 f"Resolved Offline (DOI/ISBN index): {local_index}\n" \
+                 f"Resolved from PDF Metadata: {pdf_metadata} (+{gap_requests} with missing fields only)\n" \
+                 f"Reused from Near-Duplicates: {near_duplicates}\n" \
+                 f"Escalated to Stronger Model: {escalated}\n" \
+                 f"Failed: {failed}\n" \
+                 f"Rate-limit responses (429): {rate_limited}\n" \
+                 f"Requests using cached instructions: {context_cached}\n" \
+                 f"Output tokens per document (est.): {avg_output_tokens:.0f}\n" \
+                 f"Prompt text: {chars_raw:,} -> {chars_compact:,} chars (-{saved_pct:.0f}%)\n" \
+                 f"Time by stage (summed over files): {stages or '-'}\n"
         
         self.text_edit = QTextEdit()
         self.text_edit.setReadOnly(True)
@@ -130,7 +163,7 @@ class ProgressDialog(QDialog):
         self.status_label.setText(f"Processing: {filename}")
         
     def on_cancel(self):
-        self.status_label.setText("Stopping (waiting for current file)...")
+        self.status_label.setText("Stopping...")
         self.cancel_btn.setEnabled(False)
         self.cancel_requested.emit()
 
@@ -162,8 +195,13 @@ class MainWindow(QMainWindow):
         folder_layout.addWidget(self.path_edit)
         folder_layout.addWidget(self.browse_btn)
         
-        layout.addWidget(QLabel("Target Folder (Subfolders ignored):"))
+        layout.addWidget(QLabel("Target Folder:"))
         layout.addLayout(folder_layout)
+
+        # Subfolders (include/exclude globs via "include_globs" / "exclude_globs" in config.json)
+        self.recursive_cb = QCheckBox("Include subfolders")
+        self.recursive_cb.setChecked(self.config.get("recursive", False))
+        layout.addWidget(self.recursive_cb)
         
         # 2. API Key
         self.api_key_edit = QLineEdit()
@@ -195,11 +233,46 @@ class MainWindow(QMainWindow):
         
         layout.addWidget(QLabel("Model:"))
         layout.addWidget(self.model_combo)
+
+        # Cascade: a stronger model re-checks only the fields the first one was unsure of
+        self.cascade_combo = QComboBox()
+        self.cascade_combo.addItem("Off", None)
+        self.cascade_combo.addItem("Gemini 3 Pro (Preview)", "gemini-3-pro-preview")
+        self.cascade_combo.addItem("Gemini 2.5 Pro", "gemini-2.5-pro")
+        idx = self.cascade_combo.findData(self.config.get("cascade_model"))
+        self.cascade_combo.setCurrentIndex(idx if idx >= 0 else 0)
+
+        layout.addWidget(QLabel("Escalate uncertain fields to:"))
+        layout.addWidget(self.cascade_combo)
         
         # Skip Option
-        self.skip_cb = QCheckBox("Skip already generated files (.ris exists)")
+        self.skip_cb = QCheckBox("Skip already generated files (.ris exists and the PDF is unchanged)")
         self.skip_cb.setChecked(True)
         layout.addWidget(self.skip_cb)
+
+        # Resume (retried failure codes via "resume_retry_codes" in config.json)
+        self.resume_cb = QCheckBox("Resume the previous run for this folder (retry rate-limit/timeout failures only)")
+        self.resume_cb.setChecked(False)
+        layout.addWidget(self.resume_cb)
+
+        self.library_cb = QCheckBox(f"Also write a combined library ({LIBRARY_FILENAME})")
+        self.library_cb.setChecked(self.config.get("write_library", False))
+        layout.addWidget(self.library_cb)
+
+        # Result Cache
+        self.cache_cb = QCheckBox("Reuse cached results for identical PDFs (no API call)")
+        self.cache_cb.setChecked(self.config.get("use_cache", True))
+        layout.addWidget(self.cache_cb)
+
+        # Server-side context cache (processor.ContextCache)
+        self.context_cache_cb = QCheckBox("Cache the instructions on Gemini's side (only models that accept small caches; storage is billed per hour)")
+        self.context_cache_cb.setChecked(self.config.get("context_cache", False))
+        layout.addWidget(self.context_cache_cb)
+
+        # Packed Requests
+        self.pack_cb = QCheckBox("Pack several PDFs into one request (for low requests/min quotas)")
+        self.pack_cb.setChecked(self.config.get("pack_requests", False))
+        layout.addWidget(self.pack_cb)
         
         # Sleep Prevention
         self.prevent_sleep_cb = QCheckBox("Prevent PC sleep while processing (Windows Only)")
@@ -208,9 +281,10 @@ class MainWindow(QMainWindow):
 
         # Concurrency
         concurrency_layout = QHBoxLayout()
-        concurrency_layout.addWidget(QLabel("Parallel Processing (Max threads):"))
+        concurrency_layout.addWidget(QLabel("Parallel Processing (Max concurrent requests):"))
         self.workers_spin = QSpinBox()
-        self.workers_spin.setRange(1, 10)
+        # Requests are coroutines, not threads; the real ceiling is the API quota (see MODEL_RATE_LIMITS)
+        self.workers_spin.setRange(1, 200)
         self.workers_spin.setValue(self.config.get("max_workers", 3))
         concurrency_layout.addWidget(self.workers_spin)
         concurrency_layout.addStretch()
@@ -219,16 +293,94 @@ class MainWindow(QMainWindow):
         layout.addStretch()
         
         # 4. Start Button
+        button_layout = QHBoxLayout()
+        self.plan_btn = QPushButton("Estimate Time")
+        self.plan_btn.setFixedHeight(40)
+        self.plan_btn.setToolTip("Dry run: estimate requests, tokens and time for each model (no API calls)")
+        self.plan_btn.clicked.connect(self.estimate_run)
         self.start_btn = QPushButton("Generate RIS Files")
         self.start_btn.setFixedHeight(40)
         self.start_btn.clicked.connect(self.start_processing)
-        layout.addWidget(self.start_btn)
+        button_layout.addWidget(self.plan_btn)
+        button_layout.addWidget(self.start_btn, 1)
+        layout.addLayout(button_layout)
+        self.plan_worker = None
+        self.journal = None
         
     def browse_folder(self):
         folder = QFileDialog.getExistingDirectory(self, "Select Folder")
         if folder:
             self.path_edit.setText(folder)
             
+    def scan_folder(self, folder_path):
+        """
+        Returns a lazy iterator of PDF paths (streams subfolders when enabled).
+        """
+        return iter_pdf_files(
+            folder_path,
+            recursive=self.recursive_cb.isChecked(),
+            include=self.config.get("include_globs"),
+            exclude=self.config.get("exclude_globs")
+        )
+
+    def estimate_run(self):
+        folder_path = self.path_edit.text().strip()
+        if not folder_path or not os.path.isdir(folder_path):
+            QMessageBox.warning(self, "Error", "Please select a valid folder.")
+            return
+        try:
+            files = list(self.scan_folder(folder_path))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to scan directory: {e}")
+            return
+        if not files:
+            QMessageBox.information(self, "Info", "No PDF files found in the selected folder.")
+            return
+
+        # Same settings as a real run, so the plan matches what "Generate" would do
+        try:
+            backend_spec = self.config.get("backend")
+            backend = create_backend(backend_spec) if backend_type(backend_spec) != "gemini" else None
+        except (TypeError, ValueError):
+            backend = None
+        engine = ProcessingEngine(
+            files,
+            "",
+            self.model_combo.currentData(),
+            max_workers=self.workers_spin.value(),
+            use_cache=self.cache_cb.isChecked(),
+            skip_existing=self.skip_cb.isChecked(),
+            pack_token_budget=self.config.get("pack_token_budget", DEFAULT_PACK_TOKEN_BUDGET) if self.pack_cb.isChecked() else 0,
+            metadata_index_path=self.config.get("metadata_index_path", get_default_index_path()),
+            compact_tokens=self.config.get("compact_tokens", DEFAULT_COMPACT_TOKENS),
+            use_pdf_metadata=self.config.get("use_pdf_metadata", True),
+            backend=backend,
+            similarity_index_path=self.config.get("similarity_index_path", get_default_similarity_path()),
+            duplicate_threshold=self.config.get("duplicate_threshold", DEFAULT_DUPLICATE_THRESHOLD),
+            schema_mode=self.config.get("schema_mode", "full")
+        )
+        models = [self.model_combo.itemData(i) for i in range(self.model_combo.count())]
+
+        self.plan_btn.setEnabled(False)
+        self.plan_btn.setText("Estimating...")
+        self.plan_worker = PlanWorker(engine, models)
+        self.plan_worker.plan_ready.connect(self.on_plan_ready)
+        self.plan_worker.error_occurred.connect(self.on_plan_error)
+        self.plan_worker.finished.connect(self.on_plan_finished)
+        self.plan_worker.start()
+
+    def on_plan_ready(self, plan):
+        QMessageBox.information(self, "Estimate", format_plan(plan))
+
+    def on_plan_error(self, message):
+        QMessageBox.critical(self, "Error", f"Estimate failed: {message}")
+
+    def on_plan_finished(self):
+        self.plan_btn.setEnabled(True)
+        self.plan_btn.setText("Estimate Time")
+        self.plan_worker.deleteLater()
+        self.plan_worker = None
+
     def start_processing(self):
         folder_path = self.path_edit.text().strip()
         api_key = self.api_key_edit.text().strip()
@@ -237,21 +389,32 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Error", "Please select a valid folder.")
             return
             
-        if not api_key:
+        # Gemini needs a key; other backends (config.json "backend") bring their own settings
+        backend = None
+        backend_spec = self.config.get("backend")
+        if backend_type(backend_spec) != "gemini":
+            try:
+                backend = create_backend(backend_spec)
+            except (TypeError, ValueError) as e:
+                QMessageBox.warning(self, "Error", f"Invalid backend in config.json: {e}")
+                return
+        elif not api_key:
             QMessageBox.warning(self, "Error", "Please enter an API Key.")
             return
+        context_cache.enabled = self.context_cache_cb.isChecked()
             
-        # scan files
+        # scan files (streamed: processing starts while subfolders are still being walked)
         try:
-            files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) 
-                     if f.lower().endswith('.pdf') and os.path.isfile(os.path.join(folder_path, f))]
+            files = self.scan_folder(folder_path)
+            first = next(files, None)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to scan directory: {e}")
             return
             
-        if not files:
+        if first is None:
             QMessageBox.information(self, "Info", "No PDF files found in the selected folder.")
             return
+        files = itertools.chain([first], files)
 
         # Save Config
         save_config(
@@ -259,16 +422,58 @@ class MainWindow(QMainWindow):
             self.save_key_cb.isChecked(),
             self.model_combo.currentData(),
             self.prevent_sleep_cb.isChecked(),
-            self.workers_spin.value()
+            self.workers_spin.value(),
+            self.cache_cb.isChecked(),
+            self.pack_cb.isChecked(),
+            self.recursive_cb.isChecked(),
+            self.library_cb.isChecked(),
+            self.cascade_combo.currentData(),
+            self.context_cache_cb.isChecked()
         )
             
+        # Run Journal (per-file states, enables resuming after a crash or cancel)
+        journal = None
+        resume_states = None
+        label = f"{os.path.abspath(folder_path)}|recursive={self.recursive_cb.isChecked()}"
+        try:
+            journal = RunJournal()
+            if self.resume_cb.isChecked():
+                previous = journal.latest_run(label)
+                if previous is None:
+                    QMessageBox.information(self, "Info", "No previous run found for this folder; starting a new run.")
+                else:
+                    resume_states = journal.last_states(previous["run_id"])
+            journal.start_run(label)
+        except Exception as e:
+            print(f"Run journal unavailable: {e}")
+            journal = None
+        self.journal = journal
+
         # Start Worker & Progress Dialog
         self.worker = ProcessingWorker(
             files, 
             api_key, 
             self.model_combo.currentData(),
             prevent_sleep=self.prevent_sleep_cb.isChecked(),
-            max_workers=self.workers_spin.value()
+            max_workers=self.workers_spin.value(),
+            use_cache=self.cache_cb.isChecked(),
+            pack_token_budget=self.config.get("pack_token_budget", DEFAULT_PACK_TOKEN_BUDGET) if self.pack_cb.isChecked() else 0,
+            metadata_index_path=self.config.get("metadata_index_path", get_default_index_path()),
+            compact_tokens=self.config.get("compact_tokens", DEFAULT_COMPACT_TOKENS),
+            journal=journal,
+            resume_states=resume_states,
+            retry_codes=self.config.get("resume_retry_codes", DEFAULT_RETRY_CODES),
+            use_pdf_metadata=self.config.get("use_pdf_metadata", True),
+            backend=backend,
+            cascade_model=self.cascade_combo.currentData(),
+            similarity_index_path=self.config.get("similarity_index_path", get_default_similarity_path()),
+            duplicate_threshold=self.config.get("duplicate_threshold", DEFAULT_DUPLICATE_THRESHOLD),
+            trace_path=self.config.get("trace_path"),
+            metrics_path=self.config.get("metrics_path"),
+            metrics_port=self.config.get("metrics_port"),
+            max_attempts=self.config.get("max_attempts", 3),
+            schema_mode=self.config.get("schema_mode", "full"),
+            library_path=os.path.join(folder_path, LIBRARY_FILENAME) if self.library_cb.isChecked() else None
         )
         self.worker.set_skip_existing(self.skip_cb.isChecked())
         
@@ -294,6 +499,11 @@ class MainWindow(QMainWindow):
             
         self.worker.deleteLater()
         self.worker = None
+
+        if self.journal is not None:
+            self.journal.finish_run(summary["cancelled"])
+            self.journal.close()
+            self.journal = None
         
         # Show Result
         dlg = ResultDialog(summary, self)
@@ -0,0 +1,170 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+from .config import get_config_path
+
+JOURNAL_FILENAME = "run_journal.sqlite3"
+
+# File states, in the order a file moves through them
+QUEUED = "queued"
+STARTED = "started"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+# Failure codes retried by default when resuming (transient API conditions)
+DEFAULT_RETRY_CODES = ("RATE_LIMIT", "TIMEOUT")
+
+
+def get_journal_path():
+    # Lives next to config.json (AppData / ~/.risgenerator)
+    return os.path.join(os.path.dirname(get_config_path()), JOURNAL_FILENAME)
+
+
+def base_code(code: str) -> str:
+    """
+    'API_ERROR: details' -> 'API_ERROR'
+    """
+    return (code or "").split(":", 1)[0].strip()
+
+
+class RunJournal:
+    """
+    Append-only, crash-safe log of per-file states (SQLite in WAL mode).
+    Events are buffered and written in batches; after a crash at most the last unflushed batch is lost,
+    and those files simply count as not finished when the run is resumed.
+    """
+
+    def __init__(self, path: str = None, batch_size: int = 500, flush_interval: float = 1.0):
+        self.path = path or get_journal_path()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.run_id = None
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " run_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " label TEXT NOT NULL,"
+            " inputs TEXT,"
+            " resumed_from INTEGER,"
+            " started REAL NOT NULL,"
+            " finished REAL,"
+            " cancelled INTEGER)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " run_id INTEGER NOT NULL,"
+            " path TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " code TEXT,"
+            " ts REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_events_run_path ON events(run_id, path)")
+        self._conn.commit()
+
+    # --- Runs ---
+
+    def start_run(self, label: str = "", inputs=None, resumed_from: int = None) -> int:
+        """
+        Opens a new run; label identifies the batch (e.g. the folder) for latest_run().
+        inputs: optional JSON-serializable description of the batch, returned by get_run() for resuming.
+        """
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO runs (label, inputs, resumed_from, started) VALUES (?, ?, ?, ?)",
+                (label, json.dumps(inputs) if inputs is not None else None, resumed_from, time.time())
+            )
+            self._conn.commit()
+            self.run_id = cur.lastrowid
+        return self.run_id
+
+    def finish_run(self, cancelled: bool = False):
+        self.flush()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET finished = ?, cancelled = ? WHERE run_id = ?",
+                (time.time(), int(cancelled), self.run_id)
+            )
+            self._conn.commit()
+
+    def get_run(self, run_id: int) -> typing.Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT run_id, label, inputs, resumed_from, started, finished, cancelled FROM runs WHERE run_id = ?",
+                (run_id,)
+            ).fetchone()
+        return self._run_dict(row)
+
+    def latest_run(self, label: str = None) -> typing.Optional[dict]:
+        """
+        Most recent run (optionally with this label), excluding the one currently open.
+        """
+        query = "SELECT run_id, label, inputs, resumed_from, started, finished, cancelled FROM runs WHERE run_id IS NOT ?"
+        params = [self.run_id]
+        if label is not None:
+            query += " AND label = ?"
+            params.append(label)
+        with self._lock:
+            row = self._conn.execute(query + " ORDER BY run_id DESC LIMIT 1", params).fetchone()
+        return self._run_dict(row)
+
+    @staticmethod
+    def _run_dict(row):
+        if row is None:
+            return None
+        keys = ("run_id", "label", "inputs", "resumed_from", "started", "finished", "cancelled")
+        run = dict(zip(keys, row))
+        run["inputs"] = json.loads(run["inputs"]) if run["inputs"] else None
+        return run
+
+    # --- Events ---
+
+    def record(self, path: str, state: str, code: str = None, autoflush: bool = True) -> bool:
+        """
+        Buffers one state change; written when the batch is full or flush_interval has passed.
+        autoflush=False leaves that write to the caller (e.g. on a worker thread); returns whether it is due.
+        """
+        with self._lock:
+            self._buffer.append((self.run_id, os.path.abspath(path), state, code, time.time()))
+            due = len(self._buffer) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval
+        if due and autoflush:
+            self.flush()
+        return due
+
+    def flush(self):
+        with self._lock:
+            if self._buffer:
+                self._conn.executemany("INSERT INTO events (run_id, path, state, code, ts) VALUES (?, ?, ?, ?, ?)", self._buffer)
+                self._conn.commit()
+                self._buffer = []
+            self._last_flush = time.monotonic()
+
+    def last_states(self, run_id: int) -> typing.Dict[str, typing.Tuple[str, typing.Optional[str]]]:
+        """
+        Returns {absolute path: (state, code)} with each file's final state in that run.
+        """
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, state, code FROM events WHERE seq IN"
+                " (SELECT MAX(seq) FROM events WHERE run_id = ? GROUP BY path)",
+                (run_id,)
+            ).fetchall()
+        return {path: (state, code) for path, state, code in rows}
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
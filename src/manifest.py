@@ -0,0 +1,135 @@
+import json
+import os
+import typing
+
+from .cache import hash_file
+
+MANIFEST_FILENAME = ".risgenerator-manifest.json"
+MANIFEST_VERSION = 1
+
+# check() results
+UNCHANGED = "unchanged" # tracked, same size/mtime (or same content), .ris present -> skip
+CHANGED = "changed" # tracked but the PDF was replaced (or its .ris is gone) -> regenerate
+NEW = "new" # not tracked and no .ris -> generate
+UNTRACKED = "untracked" # .ris exists but was made before manifests (or by hand) -> treat as done
+
+
+class FolderManifest:
+    """
+    Per-folder record of each PDF's size, mtime, content hash and the .ris it produced.
+    Loading reads the manifest file and lists the folder once (os.scandir), so skip checks for
+    every PDF in the folder need no further filesystem calls, which matters on SMB shares.
+    Only PDFs with the recorded size but a new mtime (touched, copied or synced) are read once
+    at load time: if their content hash is unchanged they count as unchanged.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_FILENAME)
+        self.entries = {} # pdf name -> {"size", "mtime", "hash", "ris"}
+        self.listing = {} # pdf name -> (size, mtime) at load time
+        self.ris_names = set()
+        self.dirty = False
+
+    @classmethod
+    def load(cls, folder: str) -> "FolderManifest":
+        manifest = cls(folder)
+        try:
+            with open(manifest.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                manifest.entries = data.get("files", {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable manifest {manifest.path}: {e}")
+
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    lower = entry.name.lower()
+                    try:
+                        if lower.endswith('.pdf') and entry.is_file():
+                            st = entry.stat() # free on Windows (comes with the listing)
+                            manifest.listing[entry.name] = (st.st_size, int(st.st_mtime))
+                        elif lower.endswith('.ris'):
+                            manifest.ris_names.add(entry.name)
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Cannot list {folder}: {e}")
+
+        for name, current in manifest.listing.items():
+            entry = manifest.entries.get(name)
+            if not entry or not entry.get("hash") or entry.get("size") != current[0] or entry.get("mtime") == current[1] \
+                    or manifest.ris_name(name) not in manifest.ris_names:
+                continue
+            try:
+                same = hash_file(os.path.join(folder, name)) == entry["hash"]
+            except OSError:
+                continue
+            if same:
+                entry["mtime"] = current[1] # not hashed again next time
+                manifest.dirty = True
+        return manifest
+
+    @staticmethod
+    def ris_name(pdf_name: str) -> str:
+        return os.path.splitext(pdf_name)[0] + ".ris"
+
+    def check(self, pdf_name: str) -> typing.Optional[str]:
+        """
+        Returns UNCHANGED / CHANGED / NEW / UNTRACKED, or None if the PDF was not in the folder listing.
+        """
+        current = self.listing.get(pdf_name)
+        if current is None:
+            return None
+        entry = self.entries.get(pdf_name)
+        has_ris = self.ris_name(pdf_name) in self.ris_names
+        if entry is None:
+            return UNTRACKED if has_ris else NEW
+        if has_ris and (entry.get("size"), entry.get("mtime")) == current:
+            return UNCHANGED
+        return CHANGED
+
+    def record(self, pdf_name: str, content_hash: str = None):
+        """
+        Marks pdf_name as generated from its current version.
+        """
+        current = self.listing.get(pdf_name)
+        if current is None:
+            try:
+                st = os.stat(os.path.join(self.folder, pdf_name))
+                current = (st.st_size, int(st.st_mtime))
+            except OSError:
+                return
+        previous = self.entries.get(pdf_name, {})
+        self.entries[pdf_name] = {
+            "size": current[0],
+            "mtime": current[1],
+            # Keep an earlier hash if this run did not compute one and the file is unchanged
+            "hash": content_hash or (previous.get("hash") if (previous.get("size"), previous.get("mtime")) == current else None),
+            "ris": self.ris_name(pdf_name),
+        }
+        self.ris_names.add(self.ris_name(pdf_name))
+        self.dirty = True
+
+    def snapshot(self) -> dict:
+        """
+        Copies the entries for saving and clears the dirty flag (call on the thread that records).
+        """
+        self.dirty = False
+        return {"version": MANIFEST_VERSION, "files": dict(self.entries)}
+
+    def save(self, snapshot: dict = None):
+        """
+        Writes atomically (temp file + rename); may run on another thread when given a snapshot.
+        """
+        data = snapshot or self.snapshot()
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Failed to save manifest {self.path}: {e}")
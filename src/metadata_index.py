@@ -0,0 +1,364 @@
+"""
+Offline metadata index: resolves DOIs/ISBNs found in the PDF text without calling Gemini.
+
+Build an index from a Crossref-style dump (JSON Lines, or JSON with an "items" array; .gz allowed):
+
+    python -m src.metadata_index build crossref-part-0001.json.gz [more dumps...] [--index PATH]
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import typing
+
+from .config import get_config_path
+
+INDEX_FILENAME = "metadata_index.sqlite3"
+
+DOI_RE = re.compile(r'\b(10\.\d{4,9}/[^\s"<>]+)', re.IGNORECASE)
+ISBN_RE = re.compile(r'\bISBN(?:-1[03])?:?\s*((?:97[89][\s-]?)?(?:\d[\s-]?){9}[\dXx])\b', re.IGNORECASE)
+ISSN_RE = re.compile(r'\b(\d{4}-\d{3}[\dXx])\b')
+PAGE_MARKER_RE = re.compile(r'^--- Page (\d+)', re.MULTILINE)
+
+# Crossref "type" -> RIS TY
+CROSSREF_TYPES = {
+    "journal-article": "JOUR",
+    "proceedings-article": "CONF",
+    "book-chapter": "CHAP",
+    "book-section": "CHAP",
+    "book-part": "CHAP",
+    "book": "BOOK",
+    "monograph": "BOOK",
+    "edited-book": "BOOK",
+    "reference-book": "BOOK",
+    "dissertation": "THES",
+}
+
+
+def get_default_index_path():
+    # Lives next to config.json (AppData / ~/.risgenerator)
+    return os.path.join(os.path.dirname(get_config_path()), INDEX_FILENAME)
+
+
+# --- Identifier extraction ---
+
+def normalize_doi(doi: str) -> str:
+    return doi.strip().rstrip('.,;:)]}\'"').lower()
+
+
+def isbn_valid(digits: str) -> bool:
+    """
+    ISBN-10/13 checksum over the digits (hyphens removed).
+    """
+    if len(digits) == 10:
+        total = sum((10 - i) * (10 if c in "Xx" else int(c)) for i, c in enumerate(digits))
+        return total % 11 == 0
+    if len(digits) == 13 and digits.isdigit():
+        total = sum(int(c) * (1 if i % 2 == 0 else 3) for i, c in enumerate(digits))
+        return total % 10 == 0
+    return False
+
+
+def issn_valid(issn: str) -> bool:
+    """
+    ISSN check digit of an NNNN-NNNC string.
+    """
+    digits = issn.replace("-", "")
+    total = sum((8 - i) * int(c) for i, c in enumerate(digits[:7]))
+    check = (11 - total % 11) % 11
+    return digits[7].upper() == ("X" if check == 10 else str(check))
+
+
+def head_text(text: str, pages: int = 2) -> str:
+    """
+    Returns the part of extract_text_from_pdf() output that belongs to the first `pages` pages.
+    Identifiers on tail pages are usually references to *other* works, so they are ignored.
+    """
+    markers = list(PAGE_MARKER_RE.finditer(text))
+    if not markers:
+        return text
+    for m in markers:
+        if int(m.group(1)) > pages:
+            return text[:m.start()]
+    return text
+
+
+def find_identifiers(text: str) -> dict:
+    """
+    Returns {'doi': [...], 'isbn': [...], 'issn': [...]} in order of appearance (deduplicated, validated).
+    """
+    found = {"doi": [], "isbn": [], "issn": []}
+    for m in DOI_RE.finditer(text):
+        doi = normalize_doi(m.group(1))
+        if doi not in found["doi"]:
+            found["doi"].append(doi)
+    for m in ISBN_RE.finditer(text):
+        digits = re.sub(r'[\s-]', '', m.group(1)).upper()
+        if isbn_valid(digits) and digits not in found["isbn"]:
+            found["isbn"].append(digits)
+    for m in ISSN_RE.finditer(text):
+        issn = m.group(1).upper()
+        if issn_valid(issn) and issn not in found["issn"]:
+            found["issn"].append(issn)
+    return found
+
+
+# --- Crossref record conversion ---
+
+def _field(value, source="local index"):
+    return {"value": str(value), "confidence": "high", "evidence": [source]}
+
+
+def _first(value):
+    if isinstance(value, list):
+        return value[0] if value else ""
+    return value or ""
+
+
+def _year(item):
+    for key in ("issued", "published-print", "published-online", "published", "created"):
+        parts = (item.get(key) or {}).get("date-parts") or []
+        if parts and parts[0] and parts[0][0]:
+            return str(parts[0][0])
+    return ""
+
+
+def crossref_to_fields(item: dict) -> dict:
+    """
+    Converts one Crossref work to the field/confidence dict dict_to_ris() consumes.
+    """
+    ty = CROSSREF_TYPES.get(item.get("type", ""), "GEN")
+    data = {"TY": _field(ty)}
+
+    title = _first(item.get("title"))
+    if title: data["TI"] = _field(" ".join(title.split()))
+
+    authors = []
+    for a in item.get("author") or []:
+        if a.get("family"):
+            name = a["family"] + (f", {a['given']}" if a.get("given") else "")
+        else:
+            name = a.get("name", "")
+        if name: authors.append(_field(name))
+    data["AU"] = authors
+
+    year = _year(item)
+    if year: data["PY"] = _field(year)
+
+    container = _first(item.get("container-title"))
+    if container:
+        data["BT" if ty in ("CHAP", "BOOK") else "JO"] = _field(container)
+
+    page = item.get("page", "")
+    if page:
+        sp, _, ep = page.partition("-")
+        if sp.strip(): data["SP"] = _field(sp.strip())
+        if ep.strip(): data["EP"] = _field(ep.strip())
+
+    if item.get("DOI"): data["DO"] = _field(item["DOI"])
+    if item.get("publisher"): data["PB"] = _field(item["publisher"])
+    sn = _first(item.get("ISSN")) or _first(item.get("ISBN"))
+    if sn: data["SN"] = _field(sn)
+    if item.get("URL"): data["UR"] = _field(item["URL"])
+    if item.get("language"): data["LA"] = _field(item["language"])
+    if item.get("volume"): data["VL"] = _field(item["volume"])
+    if item.get("issue"): data["IS"] = _field(item["issue"])
+    return data
+
+
+def title_matches(title: str, text: str) -> bool:
+    """
+    Plausibility check: most significant title words must appear in the page text,
+    so a DOI that belongs to a cited work is not mistaken for the document's own.
+    A title without such words (or no title at all) cannot be checked and never matches.
+    """
+    words = [w for w in re.findall(r'\w+', (title or "").lower()) if len(w) >= 4]
+    if not words:
+        return False
+    haystack = text.lower()
+    hits = sum(1 for w in words if w in haystack)
+    return hits / len(words) >= 0.6
+
+
+# --- Streaming dump reader ---
+
+def _open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def iter_dump_items(path: str, chunk_size: int = 1 << 20) -> typing.Iterator[dict]:
+    """
+    Streams Crossref works from a dump with bounded memory.
+    Supports JSON Lines, a top-level JSON array, or an object with an "items" array
+    (Crossref API / public data file layout).
+    """
+    with _open_dump(path) as f:
+        buf = f.read(chunk_size)
+        stripped = buf.lstrip()
+        if not stripped:
+            return
+
+        if not stripped.startswith("[") and not re.search(r'"items"\s*:\s*\[', buf):
+            # JSON Lines (also handles a single small JSON object per line)
+            for line in _iter_lines(buf, f, chunk_size):
+                line = line.strip()
+                if line:
+                    obj = json.loads(line)
+                    yield from obj.get("message", {}).get("items", []) if "message" in obj else [obj]
+            return
+
+        # Array streaming: seek to the first item, then raw_decode one object at a time
+        decoder = json.JSONDecoder()
+        m = re.search(r'"items"\s*:\s*\[', buf)
+        pos = m.end() if m else buf.index("[") + 1
+        while True:
+            while True:
+                # skip separators
+                while pos < len(buf) and buf[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buf):
+                    break
+                more = f.read(chunk_size)
+                if not more:
+                    return
+                buf, pos = more, 0
+            if buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield item
+            buf, pos = buf[end:], 0
+
+
+def _iter_lines(first_chunk, f, chunk_size):
+    pending = first_chunk
+    for chunk in iter(lambda: f.read(chunk_size), ""):
+        pending += chunk
+        *lines, pending = pending.split("\n")
+        yield from lines
+    yield pending
+
+
+# --- Index ---
+
+class MetadataIndex:
+    """
+    SQLite index: normalized DOI / ISBN -> field dict ready for dict_to_ris().
+    Lookups are primary-key reads (well under a millisecond).
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or get_default_index_path()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS works (doi TEXT PRIMARY KEY, record TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS isbn (isbn TEXT PRIMARY KEY, doi TEXT NOT NULL)")
+        self._conn.commit()
+
+    def add_items(self, items: typing.Iterable[dict], batch_size: int = 5000) -> int:
+        """
+        Inserts Crossref works in batches (bounded memory). Returns the number of works added.
+        """
+        count = 0
+        works, isbns = [], []
+        for item in items:
+            doi = item.get("DOI")
+            if not doi:
+                continue
+            doi = normalize_doi(doi)
+            works.append((doi, json.dumps(crossref_to_fields(item), ensure_ascii=False)))
+            for isbn in item.get("ISBN") or []:
+                digits = re.sub(r'[\s-]', '', isbn).upper()
+                if isbn_valid(digits):
+                    isbns.append((digits, doi))
+            count += 1
+            if len(works) >= batch_size:
+                self._flush(works, isbns)
+                works, isbns = [], []
+        self._flush(works, isbns)
+        return count
+
+    def _flush(self, works, isbns):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO works (doi, record) VALUES (?, ?)", works)
+            self._conn.executemany("INSERT OR IGNORE INTO isbn (isbn, doi) VALUES (?, ?)", isbns)
+            self._conn.commit()
+
+    def lookup_doi(self, doi: str) -> typing.Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM works WHERE doi = ?", (normalize_doi(doi),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def lookup_isbn(self, isbn: str) -> typing.Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT w.record FROM isbn i JOIN works w ON w.doi = i.doi WHERE i.isbn = ?", (isbn,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def resolve(self, text: str, identifiers: dict = None) -> typing.Optional[dict]:
+        """
+        Returns a field dict for the document if one of its own identifiers (first pages only)
+        resolves and the record's title is found in the text; otherwise None.
+        """
+        head = head_text(text)
+        if identifiers is None:
+            identifiers = find_identifiers(head)
+
+        candidates = [self.lookup_doi(d) for d in identifiers.get("doi", [])]
+        candidates += [self.lookup_isbn(i) for i in identifiers.get("isbn", [])]
+        for data in candidates:
+            if not data:
+                continue
+            # A record without a usable title is no better than asking the API
+            title = (data.get("TI") or {}).get("value") or ""
+            if not title.strip() or not title_matches(title, head):
+                continue
+            if "SN" not in data and identifiers.get("issn"):
+                data["SN"] = _field(identifiers["issn"][0], "text")
+            return data
+        return None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM works").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.metadata_index", description="Manage the offline metadata index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Add works from Crossref-style dumps to the index")
+    build.add_argument("dumps", nargs="+", help="JSON / JSON Lines dump files (.gz allowed)")
+    build.add_argument("--index", default=get_default_index_path(), help="Index file (default: next to config.json)")
+    args = parser.parse_args(argv)
+
+    index = MetadataIndex(args.index)
+    try:
+        for dump in args.dumps:
+            added = index.add_items(iter_dump_items(dump))
+            print(f"{dump}: {added} works")
+        print(f"Index {args.index}: {len(index)} works total")
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
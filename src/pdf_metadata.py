@@ -0,0 +1,292 @@
+"""
+Local metadata from the PDF itself: the document /Info dictionary and XMP (Dublin Core, PRISM).
+Publisher PDFs usually carry title, authors, DOI and journal there; authoring tools often leave
+junk instead ("Microsoft Word - draft3.docx", "Administrator"), so every value is checked for
+plausibility and against the first pages' text before it is trusted.
+"""
+import datetime
+import os
+import re
+import typing
+
+from .metadata_index import DOI_RE, ISSN_RE, normalize_doi, title_matches, issn_valid, isbn_valid
+
+PRISM_NS_PREFIX = "http://prismstandard.org/namespaces/"
+
+EVIDENCE = "pdf metadata"
+
+# Titles written by authoring tools, templates or file names rather than by a publisher
+JUNK_TITLE_RE = re.compile(
+    r'^\s*(microsoft (word|powerpoint|excel)\b|untitled|document\s*\d*\s*$|title\s*$|slide\s*\d+|'
+    r'new document|doi:|10\.\d{4,9}/|pii:|s\d{4}-\d{3})'
+    r'|\.(docx?|pdf|tex|dvi|indd|qxd|rtf|odt|e?ps|pptx?|xlsx?|jpe?g|png|tiff?)\s*$',
+    re.IGNORECASE
+)
+# Account names and placeholders found in /Author
+JUNK_AUTHOR_RE = re.compile(
+    r'^\s*(admin(istrator)?|user|owner|author|unknown|default|guest|staff|editor|windows user|'
+    r'microsoft office user|pc|desktop|scanner)\s*$',
+    re.IGNORECASE
+)
+YEAR_RE = re.compile(r'(?<!\d)(1[89]\d\d|20\d\d)(?!\d)')
+
+# prism:aggregationType -> RIS TY
+AGGREGATION_TYPES = {
+    "journal": "JOUR",
+    "magazine": "JOUR",
+    "newsletter": "JOUR",
+    "conference": "CONF",
+    "proceedings": "CONF",
+    "book": "BOOK",
+    "booksection": "CHAP",
+}
+
+
+# --- Reading (runs in the extraction process, on the already opened reader) ---
+
+def _clean(value) -> str:
+    if value is None:
+        return ""
+    return " ".join(str(value).replace("\x00", "").split())
+
+
+def _node_text(node) -> str:
+    if node.nodeType == node.ATTRIBUTE_NODE:
+        return node.nodeValue or ""
+    parts = []
+    for child in node.childNodes:
+        if child.nodeType == child.TEXT_NODE:
+            parts.append(child.data)
+        else:
+            text = _node_text(child)
+            if text:
+                parts.append(text + " ")
+    return "".join(parts)
+
+
+def _prism_values(xmp) -> dict:
+    """
+    Returns {local name: text} for every PRISM property (any PRISM version, element or attribute form).
+    """
+    values = {}
+    for desc in xmp.rdf_root.getElementsByTagNameNS("http://www.w3.org/1999/02/22-rdf-syntax-ns#", "Description"):
+        nodes = [desc.attributes.item(i) for i in range(desc.attributes.length)] + list(desc.childNodes)
+        for node in nodes:
+            ns = getattr(node, "namespaceURI", None) or ""
+            if ns.startswith(PRISM_NS_PREFIX) and node.localName not in values:
+                text = _clean(_node_text(node))
+                if text:
+                    values[node.localName] = text
+    return values
+
+
+def read_pdf_metadata(reader) -> dict:
+    """
+    Collects the raw bibliographic values of an open pypdf.PdfReader (plain strings, picklable).
+    Keys (all optional): title, authors (list), date (PRISM), dc_date, created, doi, journal, volume, issue,
+    start_page, end_page, publisher, issn, isbn, aggregation_type.
+    """
+    meta = {}
+
+    # XMP first: structured (author list, typed dates) and set by most publishers
+    try:
+        xmp = reader.xmp_metadata
+    except Exception:
+        xmp = None
+    if xmp is not None:
+        try:
+            titles = xmp.dc_title or {}
+            title = titles.get("x-default") or next(iter(titles.values()), "")
+            if _clean(title): meta["title"] = _clean(title)
+            creators = [_clean(c) for c in (xmp.dc_creator or []) if _clean(c)]
+            if creators: meta["authors"] = creators
+            dates = xmp.dc_date or []
+            if dates:
+                meta["dc_date"] = dates[0].isoformat() if isinstance(dates[0], (datetime.date, datetime.datetime)) else _clean(dates[0])
+            for identifier in xmp.dc_identifier or []:
+                m = DOI_RE.search(_clean(identifier))
+                if m:
+                    meta["doi"] = m.group(1)
+                    break
+            publishers = [_clean(p) for p in (xmp.dc_publisher or []) if _clean(p)]
+            if publishers: meta["publisher"] = publishers[0]
+
+            prism = _prism_values(xmp)
+            for key, names in (
+                ("doi", ("doi",)),
+                ("journal", ("publicationName",)),
+                ("volume", ("volume",)),
+                ("issue", ("number", "issueIdentifier")),
+                ("start_page", ("startingPage",)),
+                ("end_page", ("endingPage",)),
+                ("issn", ("issn", "eIssn")),
+                ("isbn", ("isbn",)),
+                ("date", ("coverDate", "publicationDate", "coverDisplayDate")),
+                ("aggregation_type", ("aggregationType",)),
+            ):
+                for name in names:
+                    if prism.get(name):
+                        meta[key] = prism[name] # PRISM is the publisher's own record: it wins over DC
+                        break
+        except Exception as e:
+            print(f"Unreadable XMP metadata: {e}")
+
+    # Document /Info dictionary fills what XMP did not carry
+    try:
+        info = reader.metadata or {}
+    except Exception:
+        info = {}
+    try:
+        if not meta.get("title") and _clean(info.get("/Title")):
+            meta["title"] = _clean(info.get("/Title"))
+        if not meta.get("authors") and _clean(info.get("/Author")):
+            meta["authors"] = split_authors(_clean(info.get("/Author")))
+        if not meta.get("doi"):
+            for key in ("/doi", "/DOI", "/WPS-ARTICLEDOI"):
+                m = DOI_RE.search(_clean(info.get(key)))
+                if m:
+                    meta["doi"] = m.group(1)
+                    break
+        created = _clean(info.get("/CreationDate"))
+        if created:
+            meta["created"] = created
+    except Exception as e:
+        print(f"Unreadable document info: {e}")
+    return meta
+
+
+def split_authors(value: str) -> typing.List[str]:
+    """
+    Splits an /Info Author string: 'A; B', 'A and B', 'A, B, C' (when every part is a full name)
+    or a single 'Last, First'.
+    """
+    parts = [p.strip() for p in re.split(r';|\s+and\s+|\s*&\s*', value) if p.strip()]
+    if len(parts) == 1 and "," in value:
+        pieces = [p.strip() for p in value.split(",") if p.strip()]
+        if len(pieces) > 2 or all(" " in p for p in pieces):
+            parts = pieces
+    return parts
+
+
+# --- Plausibility checks and field building ---
+
+def _field(value, confidence):
+    return {"value": str(value), "confidence": confidence, "evidence": [EVIDENCE]}
+
+
+def plausible_title(title: str, filename: str = "") -> bool:
+    if not title or len(title) < 8 or len(title) > 400:
+        return False
+    if JUNK_TITLE_RE.search(title):
+        return False
+    letters = sum(c.isalpha() for c in title)
+    if letters < len(title) / 2:
+        return False
+    stem = os.path.splitext(filename)[0].lower()
+    if stem and title.lower() in (stem, stem.replace("_", " ")):
+        return False
+    return True
+
+
+def plausible_author(name: str) -> bool:
+    if not name or len(name) > 100 or "@" in name or "\\" in name or any(c.isdigit() for c in name):
+        return False
+    if JUNK_AUTHOR_RE.match(name):
+        return False
+    # A single lowercase token is an account name ("jsmith"), not an author
+    if " " not in name and "," not in name and name.lower() == name:
+        return False
+    return sum(c.isalpha() for c in name) >= 2
+
+
+def ris_author(name: str) -> str:
+    """
+    'Jane Q. Doe' -> 'Doe, Jane Q.'; names that already have a comma are kept.
+    """
+    if "," in name:
+        return name
+    tokens = name.split()
+    if len(tokens) < 2:
+        return name
+    return f"{tokens[-1]}, {' '.join(tokens[:-1])}"
+
+
+def _surname(name: str) -> str:
+    return ris_author(name).split(",")[0].strip()
+
+
+def _year_of(value: str) -> str:
+    # PDF dates ("D:20200101120000+09'00'") start with the year; ISO and free-text dates are searched
+    m = re.match(r'^(?:D:)?(\d{4})', value or "") or YEAR_RE.search(value or "")
+    if not m:
+        return ""
+    year = int(m.group(1))
+    return str(year) if 1900 <= year <= datetime.date.today().year + 1 else ""
+
+
+def metadata_to_fields(meta: dict, head: str, filename: str = "") -> dict:
+    """
+    Builds the field/confidence dict dict_to_ris() consumes from read_pdf_metadata() output.
+    head: text of the first pages; values it confirms are 'high', publisher-only values 'medium',
+    and weak evidence (unconfirmed title/authors, dc:date or file creation date) 'low'.
+    Implausible values are dropped.
+    """
+    if not meta:
+        return {}
+    haystack = head.lower()
+    fields = {}
+
+    title = meta.get("title", "")
+    if plausible_title(title, filename):
+        fields["TI"] = _field(title, "high" if head.strip() and title_matches(title, head) else "low")
+
+    authors = [a for a in meta.get("authors", []) if plausible_author(a)]
+    if authors:
+        fields["AU"] = [_field(ris_author(a), "high" if _surname(a).lower() in haystack else "low") for a in authors]
+
+    year = _year_of(meta.get("date", ""))
+    if year:
+        # PRISM cover/publication date: the publisher's own record
+        fields["PY"] = _field(year, "high" if year in head else "medium")
+    elif _year_of(meta.get("dc_date", "")):
+        # dc:date is often the file's modification or export date: trusted only if the title page agrees
+        year = _year_of(meta["dc_date"])
+        fields["PY"] = _field(year, "high" if year in head else "low")
+    else:
+        # File creation date: only the publication year if the title page agrees
+        year = _year_of(meta.get("created", ""))
+        if year:
+            fields["PY"] = _field(year, "medium" if year in head else "low")
+
+    doi = meta.get("doi", "")
+    if DOI_RE.fullmatch(doi.strip()):
+        doi = normalize_doi(doi)
+        fields["DO"] = _field(doi, "high" if doi in haystack else "medium")
+
+    journal = meta.get("journal", "")
+    if journal and not JUNK_TITLE_RE.search(journal):
+        fields["JO"] = _field(journal, "high" if journal.lower() in haystack else "medium")
+    for key, tag in (("volume", "VL"), ("issue", "IS")):
+        if meta.get(key, "").isalnum() and len(meta[key]) <= 10:
+            fields[tag] = _field(meta[key], "medium")
+    for key, tag in (("start_page", "SP"), ("end_page", "EP")):
+        if meta.get(key, "").isdigit():
+            fields[tag] = _field(meta[key], "medium")
+    if meta.get("publisher") and not JUNK_AUTHOR_RE.match(meta["publisher"]):
+        fields["PB"] = _field(meta["publisher"], "medium")
+
+    isbn = re.sub(r'[\s-]', '', meta.get("isbn", "")).upper()
+    issn = meta.get("issn", "").upper()
+    if isbn_valid(isbn):
+        fields["SN"] = _field(isbn, "medium")
+    elif ISSN_RE.fullmatch(issn) and issn_valid(issn):
+        fields["SN"] = _field(issn, "medium")
+
+    aggregation = meta.get("aggregation_type", "").lower().replace(" ", "")
+    if aggregation in AGGREGATION_TYPES:
+        fields["TY"] = _field(AGGREGATION_TYPES[aggregation], "medium")
+    elif "JO" in fields or ("DO" in fields and "SN" in fields and "-" in fields["SN"]["value"]):
+        fields["TY"] = _field("JOUR", "medium")
+    elif isbn_valid(isbn):
+        fields["TY"] = _field("BOOK", "medium")
+    return fields
@@ -0,0 +1,216 @@
+"""
+Dry-run planner: estimates prompt tokens, request count and wall-clock time for a batch
+before any generation call is made.
+
+Only the extraction stage runs (on a random sample for large folders); prompts are built exactly
+as the engine would build them and measured with estimate_tokens(). Totals are extrapolated
+with 95% confidence intervals.
+"""
+import concurrent.futures
+import math
+import os
+import random
+import time
+import typing
+
+from .cache import ResultCache, make_cache_key
+from .metadata_index import MetadataIndex
+from .similarity import SimilarityIndex
+from .manifest import CHANGED
+from .processor import estimate_tokens, build_prompt, build_packed_prompt, build_content_block, missing_fields, OUTPUT_SCHEMA
+from .scheduler import get_scheduler
+
+DEFAULT_SAMPLE_SIZE = 200
+# Seconds per request when this process has not seen a real one for the model yet
+DEFAULT_LATENCY_SECONDS = 8.0
+Z_95 = 1.96
+
+
+def _mean_ci(values, population):
+    """
+    Returns (total, half_width) for the population total estimated from a simple random sample.
+    """
+    n = len(values)
+    if n == 0:
+        return 0.0, 0.0
+    mean = sum(values) / n
+    if n == population or n < 2:
+        return mean * population, 0.0
+    var = sum((v - mean) ** 2 for v in values) / (n - 1)
+    fpc = math.sqrt((population - n) / (population - 1))
+    return mean * population, Z_95 * math.sqrt(var / n) * fpc * population
+
+
+def _sample_documents(engine, files, with_hash):
+    """
+    Runs the engine's extraction stage on files. Returns (docs, seconds per file as seen by the pipeline).
+    """
+    if not files:
+        return [], 0.0
+    started = time.monotonic()
+    try:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=engine.extract_workers)
+    except (NotImplementedError, OSError):
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=engine.extract_workers)
+    with pool:
+        futures = [pool.submit(engine.extraction_job(path, with_hash)) for path in files]
+        docs = []
+        for path, future in zip(files, futures):
+            try:
+                docs.append((path, future.result()))
+            except Exception as e:
+                print(f"Extraction Error ({os.path.basename(path)}): {e}")
+                docs.append((path, {"text": "", "content_hash": None, "identifiers": {}}))
+    return docs, (time.monotonic() - started) / len(files)
+
+
+def plan_run(engine, models: typing.List[str] = None, sample_size: int = DEFAULT_SAMPLE_SIZE, seed: int = None) -> dict:
+    """
+    Plans engine's batch (its files and settings) for each model without calling the API.
+    Returns {'files', 'skipped', 'to_process', 'sampled', 'filename_mode', 'models': [per-model dict]}.
+    Per-model: requests, prompt_tokens, eta_seconds (each with a *_ci 95% half-width),
+    'bound' (what limits the run: 'rpm', 'tpm', 'concurrency' or 'extraction') and the limits used.
+    """
+    models = models or [engine.model_name]
+    files = list(engine.pdf_files)
+    states = dict(engine.pending_files(files))
+    todo = list(states)
+    population = len(todo)
+
+    rng = random.Random(seed)
+    sample = todo if population <= sample_size else rng.sample(todo, sample_size)
+    docs, extract_seconds = _sample_documents(engine, sample, engine._hash_files())
+
+    cache = None
+    index = None
+    similar = None
+    try:
+        if engine.use_cache:
+            try:
+                cache = ResultCache()
+            except Exception as e:
+                print(f"Result cache unavailable: {e}")
+        if engine.metadata_index_path and os.path.exists(engine.metadata_index_path):
+            index = MetadataIndex(engine.metadata_index_path)
+        if engine.similarity_index_path and engine.duplicate_threshold and os.path.exists(engine.similarity_index_path):
+            similar = SimilarityIndex(engine.similarity_index_path, engine.duplicate_threshold)
+
+        def near_duplicate(path, doc):
+            # As in the run: never the PDF's own entry, and no reuse for a PDF replaced since its .ris
+            if not similar or not doc.get("signature") or states[path] == CHANGED:
+                return None
+            return similar.lookup(doc["signature"], path, doc.get("content_hash"))
+
+        filename_mode = sum(1 for _, doc in docs if not doc["text"].strip())
+        local = [bool(doc["text"].strip() and (engine._complete_pdf_fields(doc) or
+                                               (index and doc.get("identifiers") and index.resolve(doc["text"], doc["identifiers"])) or
+                                               near_duplicate(path, doc)))
+                 for path, doc in docs]
+        pack_overhead = estimate_tokens(build_packed_prompt([], engine.schema_mode))
+
+        results = []
+        for model in models:
+            requests = []
+            tokens = []
+            for (path, doc), resolved_locally in zip(docs, local):
+                basename = os.path.basename(path)
+                use_filename_mode = not doc["text"].strip()
+                if resolved_locally:
+                    requests.append(0.0)
+                    tokens.append(0.0)
+                    continue
+                if cache is not None and doc.get("content_hash"):
+                    key = make_cache_key(doc["content_hash"], engine.model_key(model), use_filename_mode, engine.prompt_version, basename)
+                    if cache.get(key) is not None:
+                        requests.append(0.0)
+                        tokens.append(0.0)
+                        continue
+                if engine.pack_token_budget and not use_filename_mode:
+                    # Packed: this document's share of a request and of the instruction overhead
+                    content = estimate_tokens(build_content_block(doc["text"], basename))
+                    per_request = max(1, min(engine.pack_max_docs, engine.pack_token_budget // max(1, content)))
+                    requests.append(1.0 / per_request)
+                    tokens.append(content + pack_overhead / per_request)
+                else:
+                    requests.append(1.0)
+                    # Partial embedded metadata: only the missing fields are requested
+                    pdf_fields = {} if use_filename_mode else engine._pdf_fields(doc)
+                    gaps = missing_fields(pdf_fields, list(OUTPUT_SCHEMA["properties"])) if pdf_fields else None
+                    tokens.append(float(estimate_tokens(build_prompt(doc["text"], basename, use_filename_mode, gaps, engine.schema_mode))))
+
+            req_total, req_ci = _mean_ci(requests, population)
+            tok_total, tok_ci = _mean_ci(tokens, population)
+            limits = engine.rate_limits_for(model)
+            latency = get_scheduler(engine.model_key(model), limits["rpm"], limits["tpm"]).observed_latency or DEFAULT_LATENCY_SECONDS
+
+            def eta(req, tok):
+                bounds = {
+                    "rpm": req / limits["rpm"] * 60.0,
+                    "tpm": tok / limits["tpm"] * 60.0,
+                    "concurrency": req * latency / engine.max_workers,
+                    "extraction": population * extract_seconds,
+                }
+                bound = max(bounds, key=bounds.get)
+                return bounds[bound], bound
+
+            eta_seconds, bound = eta(req_total, tok_total)
+            eta_high, _ = eta(req_total + req_ci, tok_total + tok_ci)
+            results.append({
+                "model": model,
+                "requests": round(req_total),
+                "requests_ci": round(req_ci),
+                "prompt_tokens": round(tok_total),
+                "prompt_tokens_ci": round(tok_ci),
+                "eta_seconds": round(eta_seconds),
+                "eta_seconds_ci": round(eta_high - eta_seconds),
+                "bound": bound,
+                "rpm": limits["rpm"],
+                "tpm": limits["tpm"],
+                "latency_seconds": round(latency, 2),
+            })
+    finally:
+        if cache is not None:
+            cache.close()
+        if index is not None:
+            index.close()
+        if similar is not None:
+            similar.close()
+
+    return {
+        "files": len(files),
+        "skipped": len(files) - population,
+        "to_process": population,
+        "sampled": len(sample),
+        "filename_mode": round(filename_mode / len(docs) * population) if docs else 0,
+        "extract_seconds_per_file": round(extract_seconds, 3),
+        "models": results,
+    }
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60}s"
+    if seconds < 86400:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    return f"{seconds // 86400}d {seconds % 86400 // 3600}h"
+
+
+def format_plan(plan: dict) -> str:
+    """
+    Human-readable report (GUI dialog).
+    """
+    lines = [
+        f"Files: {plan['files']} (skipped: {plan['skipped']}, to process: {plan['to_process']})",
+        f"Sampled: {plan['sampled']} (filename-only: ~{plan['filename_mode']})",
+        "",
+    ]
+    for m in plan["models"]:
+        lines.append(f"{m['model']}  ({m['rpm']} RPM / {m['tpm']:,} TPM, ~{m['latency_seconds']}s per request)")
+        lines.append(f"  Requests: {m['requests']:,} ± {m['requests_ci']:,}")
+        lines.append(f"  Prompt tokens: {m['prompt_tokens']:,} ± {m['prompt_tokens_ci']:,}")
+        lines.append(f"  ETA: {format_duration(m['eta_seconds'])} (+{format_duration(m['eta_seconds_ci'])}), limited by {m['bound']}")
+    return "\n".join(lines)
+
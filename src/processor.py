@@ -1,8 +1,14 @@
 
-import google.generativeai as genai
+import asyncio
 import json
 import typing
 import re
+import hashlib
+import threading
+import time
+import google.ai.generativelanguage as glm
+from google.protobuf import duration_pb2
+from .clients import model_pool
 
 # Standard Field Schema
 def field_schema(desc):
@@ -46,33 +52,57 @@ OUTPUT_SCHEMA = {
     "required": ["TY", "TI", "AU", "PY"]
 }
 
-def generate_ris_data(text_context: str, filename: str, api_key: str, model_name: str = "gemini-3-flash-preview", filename_mode: bool = False) -> typing.Optional[dict]:
-    """
-    Calls Gemini API to extract bibliographic info and returns a dictionary.
-    filename_mode: If True, instructs Gemini to ONLY use filename (for OCR rescue).
-    """
-    try:
-        genai.configure(api_key=api_key)
-        
-        generation_config = {
-            "temperature": 0.1,
-            "response_mime_type": "application/json",
-            "response_schema": OUTPUT_SCHEMA
-        }
+# Bump when the instruction text changes; the schema is fingerprinted automatically.
+# Used as part of the result cache key so stale results are never reused.
+PROMPT_REVISION = "1"
+
+def _fingerprint(schema: dict) -> str:
+    return PROMPT_REVISION + "-" + hashlib.sha1(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+PROMPT_VERSION = _fingerprint(OUTPUT_SCHEMA)
+
+# Compact answers: short keys and confidence codes, no evidence, authors as one list with one code.
+# Output tokens dominate generation latency; expand_record() turns answers back into the full shape.
+SCHEMA_MODES = ("full", "compact")
+CONFIDENCE_CODES = {"h": "high", "m": "medium", "l": "low", "x": "conflict"}
+
+def compact_field_schema(desc, value=None):
+    return {
+        "type": "object",
+        "properties": {
+            "v": value or {"type": "string", "description": desc},
+            "c": {"type": "string", "enum": list(CONFIDENCE_CODES), "description": "Confidence code"}
+        },
+        "required": ["v", "c"]
+    }
 
-        model = genai.GenerativeModel(model_name, generation_config=generation_config)
+def _compact_property(prop: dict) -> dict:
+    if prop["type"] == "array": # AU: plain names, one confidence for the list
+        desc = prop["items"]["properties"]["value"]["description"]
+        return compact_field_schema(desc, {"type": "array", "items": {"type": "string"}, "description": f"{prop['description']}: {desc}"})
+    return compact_field_schema(prop["properties"]["value"]["description"])
 
-        if filename_mode:
-            instruction = """
+COMPACT_OUTPUT_SCHEMA = {
+    "type": "object",
+    "properties": {tag: _compact_property(prop) for tag, prop in OUTPUT_SCHEMA["properties"].items()},
+    "required": OUTPUT_SCHEMA["required"]
+}
+
+COMPACT_PROMPT_VERSION = _fingerprint(COMPACT_OUTPUT_SCHEMA)
+
+def prompt_version(schema_mode: str = "full") -> str:
+    return COMPACT_PROMPT_VERSION if schema_mode == "compact" else PROMPT_VERSION
+
+# Prompt text is shared by single and packed requests
+FILENAME_MODE_INSTRUCTION = """
             CRITICAL: The extracted text was empty. You must infer metadata ONLY from the Filename.
             - If the filename contains a Title or Author, extract it.
             - If you are unsure, leave the field value empty.
             - Do NOT hallucinate. Low confidence is expected.
             - Set 'confidence' to 'low' or 'medium' mostly.
             """
-            content_block = f"Filename: {filename}"
-        else:
-            instruction = """
+
+TEXT_MODE_INSTRUCTION = """
             You are a bibliographic data extractor. Extract metadata from the text and filename.
             
             UNCCERTAINTY RULES:
@@ -89,9 +119,135 @@ def generate_ris_data(text_context: str, filename: str, api_key: str, model_name
             - AU: List all authors.
             - Do NOT invent facts. If a field is not found, set 'value' to empty string.
             """
-            content_block = f"Filename: {filename}\n\nInput Text (first/last pages):\n{text_context[:20000]}"
 
-        prompt = f"""
+PACKED_INSTRUCTION = """
+            MULTIPLE DOCUMENTS: The input contains several independent documents, each between
+            <<<DOCUMENT ID=...>>> and <<<END DOCUMENT>>> markers.
+            - Return a JSON array with exactly one object per document.
+            - Copy the document's ID into the 'ID' field of its object.
+            - Never mix information between documents.
+            """
+
+# Compact schema: the same rules, written for {"v", "c"} fields
+COMPACT_FILENAME_MODE_INSTRUCTION = """
+            CRITICAL: The extracted text was empty. You must infer metadata ONLY from the Filename.
+            COMPACT OUTPUT: Every field is {"v": value, "c": confidence code} (h/m/l/x = high/medium/low/conflict).
+            - If the filename contains a Title or Author, extract it.
+            - If you are unsure, leave the field out.
+            - Do NOT hallucinate. Low confidence is expected.
+            - Set "c" to "l" or "m" mostly.
+            """
+
+COMPACT_TEXT_MODE_INSTRUCTION = """
+            You are a bibliographic data extractor. Extract metadata from the text and filename.
+            
+            COMPACT OUTPUT: Every field is {"v": value, "c": confidence code}.
+            - "h": matches text perfectly.
+            - "m": inferred or minor typo fix.
+            - "l": guessed or from filename only when text is messy.
+            - "x": Text and Filename contradict (trust text usually, but mark "x").
+            
+            FIELD RULES:
+            - TY: Must be one of JOUR, CONF, CHAP, BOOK, THES, GEN.
+            - PY: Year only (YYYY).
+            - DO: DOI format only (e.g. 10.xxxx/...).
+            - AU: "v" lists all authors, "c" is one code for the whole list.
+            - Do NOT invent facts. Leave out fields that are not found.
+            """
+
+def mode_instruction(filename_mode: bool = False, schema_mode: str = "full") -> str:
+    if schema_mode == "compact":
+        return COMPACT_FILENAME_MODE_INSTRUCTION if filename_mode else COMPACT_TEXT_MODE_INSTRUCTION
+    return FILENAME_MODE_INSTRUCTION if filename_mode else TEXT_MODE_INSTRUCTION
+
+GAP_INSTRUCTION = """
+            PARTIAL REQUEST: The other fields are already known.
+            Extract ONLY these fields: {fields}.
+            """
+
+MAX_TEXT_CHARS = 20000
+CHARS_PER_TOKEN = 4 # rough estimate, good enough for budgeting
+
+# Packed mode: an array of OUTPUT_SCHEMA objects tagged with the document ID
+def _packed(schema: dict) -> dict:
+    return {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {"ID": {"type": "string", "description": "Document ID from the input marker"}, **schema["properties"]},
+            "required": ["ID"] + schema["required"]
+        }
+    }
+
+PACKED_SCHEMA = _packed(OUTPUT_SCHEMA)
+COMPACT_PACKED_SCHEMA = _packed(COMPACT_OUTPUT_SCHEMA)
+
+def output_schema(schema_mode: str = "full", packed: bool = False) -> dict:
+    if schema_mode == "compact":
+        return COMPACT_PACKED_SCHEMA if packed else COMPACT_OUTPUT_SCHEMA
+    return PACKED_SCHEMA if packed else OUTPUT_SCHEMA
+
+# Fields whose confidence is good enough to skip asking Gemini for them
+CONFIDENT = ("high", "medium")
+
+# Gap requests: OUTPUT_SCHEMA reduced to the fields still needed, built once per field set
+_GAP_SCHEMAS = {}
+
+def gap_schema(fields: typing.Sequence[str], schema_mode: str = "full") -> dict:
+    key = (schema_mode,) + tuple(fields)
+    schema = _GAP_SCHEMAS.get(key)
+    if schema is None:
+        full = output_schema(schema_mode)
+        schema = {
+            "type": "object",
+            "properties": {f: full["properties"][f] for f in fields},
+            "required": [f for f in full["required"] if f in fields]
+        }
+        _GAP_SCHEMAS[key] = schema
+    return schema
+
+def _is_confident(field_data) -> bool:
+    if isinstance(field_data, list):
+        return bool(field_data) and all(_is_confident(item) for item in field_data)
+    if not isinstance(field_data, dict):
+        return False
+    return bool(str(field_data.get("value", "")).strip()) and field_data.get("confidence", "high") in CONFIDENT
+
+def missing_fields(data: dict, fields: typing.Sequence[str] = None) -> typing.List[str]:
+    """
+    Returns the schema fields (default: the required ones) that data lacks or has only with low confidence.
+    """
+    fields = OUTPUT_SCHEMA["required"] if fields is None else fields
+    return [f for f in fields if not _is_confident((data or {}).get(f))]
+
+def merge_fields(local: dict, generated: dict) -> dict:
+    """
+    Combines locally found fields with Gemini's: confident local values win, Gemini fills the rest.
+    """
+    merged = dict(generated or {})
+    for key, value in (local or {}).items():
+        if _is_confident(value) or not merged.get(key):
+            merged[key] = value
+    return merged
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def build_content_block(text_context: str, filename: str, filename_mode: bool = False) -> str:
+    if filename_mode:
+        return f"Filename: {filename}"
+    return f"Filename: {filename}\n\nInput Text (first/last pages):\n{text_context[:MAX_TEXT_CHARS]}"
+
+def build_prompt(text_context: str, filename: str, filename_mode: bool = False, fields: typing.Sequence[str] = None, schema_mode: str = "full") -> str:
+    """
+    fields: request only these schema fields (gap request); None = all fields.
+    schema_mode: 'compact' asks for the compact answer shape (see COMPACT_OUTPUT_SCHEMA).
+    """
+    instruction = mode_instruction(filename_mode, schema_mode)
+    if fields:
+        instruction += GAP_INSTRUCTION.format(fields=", ".join(fields))
+    content_block = build_content_block(text_context, filename, filename_mode)
+    return f"""
         {instruction}
         
         Return JSON matching the schema strictly.
@@ -99,29 +255,448 @@ def generate_ris_data(text_context: str, filename: str, api_key: str, model_name
         {content_block}
         """
 
-        response = model.generate_content(prompt)
+def build_packed_content(documents: typing.List[dict]) -> str:
+    """
+    documents: [{'id': str, 'filename': str, 'text': str}, ...] -> the marked-up document blocks.
+    """
+    return "\n\n".join(
+        f"<<<DOCUMENT ID={doc['id']}>>>\n{build_content_block(doc['text'], doc['filename'])}\n<<<END DOCUMENT>>>"
+        for doc in documents
+    )
+
+def build_packed_prompt(documents: typing.List[dict], schema_mode: str = "full") -> str:
+    """
+    documents: [{'id': str, 'filename': str, 'text': str}, ...]
+    """
+    content_block = build_packed_content(documents)
+    return f"""
+        {mode_instruction(False, schema_mode)}
+        {PACKED_INSTRUCTION}
+        
+        Return JSON matching the schema strictly.
+        
+        {content_block}
+        """
+
+def plan_packs(documents: typing.List[dict], token_budget: int, max_docs: int = 10) -> typing.List[typing.List[dict]]:
+    """
+    Greedily groups documents (in order) so each pack's estimated prompt stays within token_budget.
+    A document larger than the budget on its own becomes a single-document pack.
+    """
+    overhead = estimate_tokens(TEXT_MODE_INSTRUCTION + PACKED_INSTRUCTION)
+    packs = []
+    current = []
+    used = overhead
+    for doc in documents:
+        cost = estimate_tokens(build_content_block(doc['text'], doc['filename'])) + 16 # markers
+        if current and (used + cost > token_budget or len(current) >= max_docs):
+            packs.append(current)
+            current = []
+            used = overhead
+        current.append(doc)
+        used += cost
+    if current:
+        packs.append(current)
+    return packs
+
+def _generation_config(schema: dict) -> dict:
+    return {
+        "temperature": 0.1,
+        "response_mime_type": "application/json",
+        "response_schema": schema
+    }
+
+# Built once so the model pool can recognise them cheaply
+_GENERATION_CONFIGS = {}
+
+def _shared_generation_config(schema: dict) -> dict:
+    config = _GENERATION_CONFIGS.get(id(schema))
+    if config is None or config["response_schema"] is not schema:
+        config = _generation_config(schema)
+        _GENERATION_CONFIGS[id(schema)] = config
+    return config
+
+def _parse_response(response):
+    if not response.candidates or not response.candidates[0].content.parts:
+        print("Gemini returned empty candidates/parts.")
+        raise Exception("AI_EMPTY_RESPONSE")
+
+    if response.text:
+        try:
+            return json.loads(response.text)
+        except json.JSONDecodeError:
+            print("Failed to parse JSON response")
+            # Return None treated as AI_NULL in worker, but let's be explicit if we want
+            return None
+    return None
+
+# --- Server-side context cache ---
+
+# Seconds a cached prefix lives on the server; it is extended this long before it would expire
+CONTEXT_CACHE_TTL = 3600
+CONTEXT_CACHE_REFRESH_MARGIN = 300
+# After a failed create (model without caching, prefix below its minimum size, quota), requests
+# go out uncached for this long before the cache is tried again
+CONTEXT_CACHE_RETRY = 900
+
+def context_prefix(mode: str) -> str:
+    """
+    The constant part of every prompt of a mode ('text', 'filename' or 'packed', with a '-compact'
+    suffix for the compact schema): the instruction. Requests against the cached prefix send only
+    the content block(s); the schema is not part of the prefix because every request carries it
+    as response_schema anyway.
+    """
+    base, _, schema_mode = mode.partition("-")
+    instruction = mode_instruction(base == "filename", schema_mode or "full")
+    if base == "packed":
+        instruction += PACKED_INSTRUCTION
+    return f"""
+        {instruction}
         
-        if not response.candidates or not response.candidates[0].content.parts:
-            print("Gemini returned empty candidates/parts.")
-            raise Exception("AI_EMPTY_RESPONSE")
+        Return JSON matching the schema strictly.
+        """
+
+def is_context_cache_error(error: Exception) -> bool:
+    """
+    True for errors caused by the cached prefix itself (expired, deleted, unknown), not by the request.
+    """
+    msg = str(error).lower()
+    return "cachedcontent" in msg or "cached content" in msg or "cached_content" in msg
+
+class ContextCache:
+    """
+    Server-side cached-content handles for the constant prompt prefix (the instruction), one per
+    (endpoint, API key, model, prompt version, mode). Requests then carry the document text and the
+    response schema. Off by default: the instruction is smaller than most models' minimum cached
+    size, and where it is accepted each request saves only its tokens at the cached-token discount.
+
+    Handles are extended shortly before they expire and recreated if the server dropped them.
+    Models or prefixes the server cannot cache fall back to plain requests, transparently.
+    Thread-safe; stats counts 'created', 'refreshed', 'requests' (answered against a handle) and 'fallbacks'.
+    """
 
-        if response.text:
+    def __init__(self, enabled: bool = False, ttl: int = CONTEXT_CACHE_TTL):
+        self.enabled = enabled
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._handles = {} # key -> (name, expires_at monotonic)
+        self._unavailable = {} # key -> monotonic time to try again
+        self._key_locks = {} # key -> lock held while creating or refreshing
+        self.stats = {"created": 0, "refreshed": 0, "requests": 0, "fallbacks": 0}
+
+    def _key(self, api_key, model_name, mode):
+        return (model_pool.endpoint, api_key, model_name, PROMPT_VERSION, mode)
+
+    def _current(self, key):
+        """
+        Returns (name or None, needs work). Lock-free fast path for the common case.
+        """
+        now = time.monotonic()
+        entry = self._handles.get(key)
+        if entry is not None and entry[1] - now > CONTEXT_CACHE_REFRESH_MARGIN:
+            return entry[0], False
+        if entry is None and self._unavailable.get(key, 0.0) > now:
+            return None, False
+        return None, True
+
+    def handle(self, api_key: str, model_name: str, mode: str) -> typing.Optional[str]:
+        """
+        Returns the cached-content name for the prefix, creating or extending it if needed; None = send uncached.
+        Blocks on the cache service when work is needed.
+        """
+        if not self.enabled:
+            return None
+        key = self._key(api_key, model_name, mode)
+        name, needs_work = self._current(key)
+        if not needs_work:
+            return name
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock: # one create per prefix, however many requests arrive at once
+            name, needs_work = self._current(key)
+            if not needs_work:
+                return name
+            entry = self._handles.get(key)
+            client = model_pool.get_cache_client(api_key)
+            if entry is not None:
+                try:
+                    client.update_cached_content(
+                        cached_content=glm.CachedContent(name=entry[0], ttl=duration_pb2.Duration(seconds=self.ttl)),
+                        update_mask={"paths": ["ttl"]}
+                    )
+                    self._handles[key] = (entry[0], time.monotonic() + self.ttl)
+                    self.count("refreshed")
+                    return entry[0]
+                except Exception as e:
+                    print(f"Context cache refresh failed, recreating: {e}")
+                    self._handles.pop(key, None)
             try:
-                return json.loads(response.text)
-            except json.JSONDecodeError:
-                print("Failed to parse JSON response")
-                # Return None treated as AI_NULL in worker, but let's be explicit if we want
+                created = client.create_cached_content(cached_content=glm.CachedContent(
+                    model=model_name if model_name.startswith("models/") else f"models/{model_name}",
+                    display_name=f"risgen-{mode}-{PROMPT_VERSION}",
+                    system_instruction=glm.Content(parts=[glm.Part(text=context_prefix(mode))]),
+                    ttl=duration_pb2.Duration(seconds=self.ttl)
+                ))
+            except Exception as e:
+                print(f"Context cache unavailable for {model_name} ({mode}), sending full prompts: {e}")
+                self._unavailable[key] = time.monotonic() + CONTEXT_CACHE_RETRY
                 return None
-        return None
+            self._handles[key] = (created.name, time.monotonic() + self.ttl)
+            self._unavailable.pop(key, None)
+            self.count("created")
+            return created.name
+
+    async def handle_async(self, api_key: str, model_name: str, mode: str) -> typing.Optional[str]:
+        if not self.enabled:
+            return None
+        name, needs_work = self._current(self._key(api_key, model_name, mode))
+        if not needs_work:
+            return name
+        return await asyncio.to_thread(self.handle, api_key, model_name, mode)
+
+    def invalidate(self, api_key: str, model_name: str, mode: str, name: str):
+        """
+        Forgets a handle the server rejected; the next request creates a new one.
+        """
+        key = self._key(api_key, model_name, mode)
+        with self._lock:
+            if self._handles.get(key, (None,))[0] == name:
+                del self._handles[key]
+        self.count("fallbacks")
+
+    def count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def clear(self):
+        with self._lock:
+            self._handles.clear()
+            self._unavailable.clear()
+
+# Shared by every caller in the process
+context_cache = ContextCache()
+
+def _call_gemini(prompt: str, api_key: str, model_name: str, schema: dict, context: tuple = None):
+    """
+    context: optional (mode, content) - send only content against the cached prefix for mode when
+    the context cache has one; prompt (the full text) is the fallback.
+    """
+    if context is not None:
+        mode, content = context
+        name = context_cache.handle(api_key, model_name, mode)
+        if name:
+            try:
+                # The response schema stays in the request: decoding is constrained as without the cache
+                model = model_pool.get_model(api_key, model_name, _shared_generation_config(schema), cached_content=name)
+                data = _parse_response(model.generate_content(content))
+                if data:
+                    context_cache.count("requests")
+                return data
+            except Exception as e:
+                if not is_context_cache_error(e):
+                    raise
+                print(f"Cached prefix rejected, sending the full prompt: {e}")
+                context_cache.invalidate(api_key, model_name, mode, name)
+    # Pooled per (api_key, model, config): no genai.configure() race, connections are reused
+    model = model_pool.get_model(api_key, model_name, _shared_generation_config(schema))
+    return _parse_response(model.generate_content(prompt))
+
+async def _call_gemini_async(prompt: str, api_key: str, model_name: str, schema: dict, context: tuple = None):
+    if context is not None:
+        mode, content = context
+        name = await context_cache.handle_async(api_key, model_name, mode)
+        if name:
+            try:
+                model = model_pool.get_async_model(api_key, model_name, _shared_generation_config(schema), cached_content=name)
+                data = _parse_response(await model.generate_content_async(content))
+                if data:
+                    context_cache.count("requests")
+                return data
+            except Exception as e:
+                if not is_context_cache_error(e):
+                    raise
+                print(f"Cached prefix rejected, sending the full prompt: {e}")
+                context_cache.invalidate(api_key, model_name, mode, name)
+    model = model_pool.get_async_model(api_key, model_name, _shared_generation_config(schema))
+    return _parse_response(await model.generate_content_async(prompt))
+
+def _demux_packed(items, documents: typing.List[dict]) -> typing.Dict[str, dict]:
+    wanted = {doc['id'] for doc in documents}
+    results = {}
+    if isinstance(items, list):
+        for item in items:
+            if not isinstance(item, dict): continue
+            doc_id = str(item.pop("ID", "")).strip()
+            if doc_id in wanted and doc_id not in results:
+                results[doc_id] = item
+    return results
+
+def _context_mode(base: str, schema_mode: str) -> str:
+    return base if schema_mode == "full" else f"{base}-{schema_mode}"
+
+def generate_ris_data(text_context: str, filename: str, api_key: str, model_name: str = "gemini-3-flash-preview", filename_mode: bool = False, backend=None, schema_mode: str = "full") -> typing.Optional[dict]:
+    """
+    Calls Gemini API to extract bibliographic info and returns a dictionary.
+    filename_mode: If True, instructs Gemini to ONLY use filename (for OCR rescue).
+    backend: optional backends.LLMBackend to send the prompt to instead of Gemini.
+    schema_mode: 'compact' returns the compact answer as given (expand it with expand_record()).
+    """
+    try:
+        prompt = build_prompt(text_context, filename, filename_mode, schema_mode=schema_mode)
+        schema = output_schema(schema_mode)
+        if backend is not None:
+            return backend.generate(prompt, schema, model_name)
+        context = (_context_mode("filename" if filename_mode else "text", schema_mode), build_content_block(text_context, filename, filename_mode))
+        return _call_gemini(prompt, api_key, model_name, schema, context)
 
     except Exception as e:
         print(f"Gemini API Error: {e}")
         raise e 
 
+async def generate_ris_data_async(text_context: str, filename: str, api_key: str, model_name: str = "gemini-3-flash-preview", filename_mode: bool = False, fields: typing.Sequence[str] = None, backend=None, schema_mode: str = "full") -> typing.Optional[dict]:
+    """
+    Async variant of generate_ris_data (uses the SDK's async call; no thread is blocked while waiting).
+    fields: ask only for these schema fields (the rest is known locally); None = full extraction.
+    """
+    try:
+        prompt = build_prompt(text_context, filename, filename_mode, fields, schema_mode)
+        schema = gap_schema(fields, schema_mode) if fields else output_schema(schema_mode)
+        if backend is not None:
+            return await backend.generate_async(prompt, schema, model_name)
+        # Gap requests have their own field set, so only full extractions use the cached prefix
+        context = None if fields else (_context_mode("filename" if filename_mode else "text", schema_mode), build_content_block(text_context, filename, filename_mode))
+        return await _call_gemini_async(prompt, api_key, model_name, schema, context)
+
+    except Exception as e:
+        print(f"Gemini API Error: {e}")
+        raise e 
+
+def generate_ris_data_packed(documents: typing.List[dict], api_key: str, model_name: str = "gemini-3-flash-preview", backend=None, schema_mode: str = "full") -> typing.Dict[str, dict]:
+    """
+    Extracts several documents in one request.
+    documents: [{'id': str, 'filename': str, 'text': str}, ...] (text mode only)
+    Returns {id: data}; IDs missing from the response are simply absent (caller falls back to single calls).
+    """
+    try:
+        prompt = build_packed_prompt(documents, schema_mode)
+        schema = output_schema(schema_mode, packed=True)
+        if backend is not None:
+            items = backend.generate(prompt, schema, model_name)
+        else:
+            items = _call_gemini(prompt, api_key, model_name, schema, (_context_mode("packed", schema_mode), build_packed_content(documents)))
+
+    except Exception as e:
+        print(f"Gemini API Error (packed): {e}")
+        raise e
+
+    return _demux_packed(items, documents)
+
+async def generate_ris_data_packed_async(documents: typing.List[dict], api_key: str, model_name: str = "gemini-3-flash-preview", backend=None, schema_mode: str = "full") -> typing.Dict[str, dict]:
+    """
+    Async variant of generate_ris_data_packed.
+    """
+    try:
+        prompt = build_packed_prompt(documents, schema_mode)
+        schema = output_schema(schema_mode, packed=True)
+        if backend is not None:
+            items = await backend.generate_async(prompt, schema, model_name)
+        else:
+            items = await _call_gemini_async(prompt, api_key, model_name, schema, (_context_mode("packed", schema_mode), build_packed_content(documents)))
+
+    except Exception as e:
+        print(f"Gemini API Error (packed): {e}")
+        raise e
+
+    return _demux_packed(items, documents)
+
+# Validators (dict_to_ris drops or flags values that fail them)
+def check_py(v): return bool(re.match(r"^\d{4}$", v))
+def check_ty(v): return v in ["JOUR", "CONF", "CHAP", "BOOK", "THES", "GEN"]
+def check_num(v): return v.isdigit()
+def check_doi(v): return "10." in v # simple check
+def check_url(v): return "http" in v
+
+FIELD_VALIDATORS = {
+    "TY": check_ty,
+    "PY": check_py,
+    "SP": check_num,
+    "EP": check_num,
+    "DO": check_doi,
+    "UR": check_url,
+}
+
+def escalation_fields(data: dict) -> typing.List[str]:
+    """
+    Fields a stronger model should re-check: required fields that are empty or only low/conflict
+    confidence, and any field whose value dict_to_ris() would reject.
+    """
+    data = data or {}
+    fields = missing_fields(data)
+    for tag, validator in FIELD_VALIDATORS.items():
+        field_data = data.get(tag)
+        if tag in fields or not isinstance(field_data, dict):
+            continue
+        value = str(field_data.get("value", "")).strip()
+        if value and not validator(value):
+            fields.append(tag)
+    return [f for f in OUTPUT_SCHEMA["properties"] if f in fields]
+
+def apply_escalation(data: dict, strong: dict, fields: typing.Sequence[str]) -> dict:
+    """
+    Replaces the escalated fields with the stronger model's answer where it gave one.
+    """
+    merged = dict(data or {})
+    for f in fields:
+        value = (strong or {}).get(f)
+        if value and (not isinstance(value, dict) or str(value.get("value", "")).strip()):
+            merged[f] = value
+    return merged
+
+def expand_field(field_data, confidence: str = "high"):
+    """
+    One field in the full shape: {"value", "confidence"} dicts pass through, compact {"v", "c"}
+    dicts are expanded and plain values get `confidence`.
+    """
+    if isinstance(field_data, dict):
+        if "v" in field_data and "value" not in field_data:
+            value = field_data["v"]
+            code = field_data.get("c")
+            return {"value": "" if value is None else str(value), "confidence": CONFIDENCE_CODES.get(code, code or confidence)}
+        return field_data
+    if field_data is None:
+        return None
+    return {"value": str(field_data), "confidence": confidence}
+
+def expand_record(data: dict) -> dict:
+    """
+    Returns a record in the full OUTPUT_SCHEMA shape, accepting compact answers and plain values
+    ("TI": "Title", "AU": ["Doe, Jane"]). Keys outside the schema are kept as they are.
+    """
+    if not isinstance(data, dict):
+        return data
+    expanded = {}
+    for tag, field_data in data.items():
+        if tag not in OUTPUT_SCHEMA["properties"] or field_data is None:
+            expanded[tag] = field_data
+        elif tag == "AU":
+            if isinstance(field_data, dict) and isinstance(field_data.get("v"), list):
+                code = field_data.get("c")
+                confidence = CONFIDENCE_CODES.get(code, code or "high")
+                expanded[tag] = [{"value": str(name), "confidence": confidence} for name in field_data["v"]]
+            elif isinstance(field_data, list):
+                expanded[tag] = [expand_field(item) for item in field_data]
+            else:
+                expanded[tag] = [expand_field(field_data)]
+        else:
+            expanded[tag] = expand_field(field_data)
+    return expanded
+
 def dict_to_ris(data: dict) -> str:
     """
     Converts the deep JSON structure to RIS format string with validation and uncertainty markers.
+    Compact answers and plain values are accepted too (see expand_record).
     """
+    data = expand_record(data or {})
     lines = []
     
     # Helper for free-text fields with uncertainty
@@ -152,12 +727,6 @@ def dict_to_ris(data: dict) -> str:
             
         lines.append(f"{tag}  - {val}")
 
-    # Validators
-    def check_py(v): return bool(re.match(r"^\d{4}$", v))
-    def check_ty(v): return v in ["JOUR", "CONF", "CHAP", "BOOK", "THES", "GEN"]
-    def check_num(v): return v.isdigit()
-    def check_doi(v): return "10." in v # simple check
-    
     # --- Processing ---
 
     # TY - Strict
@@ -220,7 +789,7 @@ def dict_to_ris(data: dict) -> str:
     add_typed("SN", data.get("SN"))
 
     # UR (Typed) - simple check?
-    add_typed("UR", data.get("UR"), lambda v: "http" in v)
+    add_typed("UR", data.get("UR"), check_url)
     add_typed("LA", data.get("LA")) # Text but typed-ish. User said typed.
 
     # N1 (Custom + existing)
@@ -0,0 +1,70 @@
+"""
+Deferred retries: a failed API attempt gives its slot back and waits here until its backoff
+has passed, so the slots keep working on fresh documents in the meantime.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class RetryLater(Exception):
+    """
+    Raised by a retryable attempt that should be scheduled again after `delay` seconds
+    instead of sleeping in its slot. attempt: index of the attempt that failed.
+    """
+
+    def __init__(self, delay: float, attempt: int, reason: str = ""):
+        super().__init__(f"retry in {delay:.1f}s after attempt {attempt + 1}: {reason}")
+        self.delay = delay
+        self.attempt = attempt
+        self.reason = reason
+
+
+class RetryQueue:
+    """
+    Items ordered by not-before time, for one event loop. get() returns the earliest item once it
+    is due; `pending` counts items pushed and not yet marked done(). Everything waiting on it is
+    plain asyncio, so cancelling the run drops queued retries immediately.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._heap = []
+        self._seq = itertools.count() # FIFO among equal times; items are never compared
+        self._changed = asyncio.Event()
+        self.pending = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, item, delay: float):
+        heapq.heappush(self._heap, (self._clock() + max(0.0, delay), next(self._seq), item))
+        self.pending += 1
+        self._changed.set()
+
+    def done(self):
+        """
+        Marks a popped item as handed over (e.g. dispatched as a new task).
+        """
+        self.pending -= 1
+        self._changed.set()
+
+    async def get(self):
+        while True:
+            self._changed.clear()
+            if self._heap:
+                wait = self._heap[0][0] - self._clock()
+                if wait <= 0:
+                    return heapq.heappop(self._heap)[2]
+            else:
+                wait = None
+            try:
+                # Woken early by a push (which may be due sooner than the current head)
+                await asyncio.wait_for(self._changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def wait_changed(self):
+        self._changed.clear()
+        await self._changed.wait()
@@ -0,0 +1,54 @@
+import fnmatch
+import os
+import typing
+
+
+def _matches(rel_path: str, name: str, patterns) -> bool:
+    # A pattern may target the path relative to the root ("drafts/*.pdf") or just the name ("*_old.pdf")
+    return any(fnmatch.fnmatch(rel_path, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def iter_pdf_files(root: str, recursive: bool = False, include: typing.List[str] = None, exclude: typing.List[str] = None) -> typing.Iterator[str]:
+    """
+    Lazily yields PDF paths under root using os.scandir (one directory listing in memory at a time).
+    Directories are walked depth-first in name order; PDFs are yielded as soon as their folder is read,
+    so processing can start while a large tree is still being scanned.
+    include: glob patterns a file must match (default: all PDFs); matched case-insensitively on Windows.
+    exclude: glob patterns for files or folders to skip (matching folders are not entered).
+    Unreadable folders are reported and skipped.
+    """
+    include = [p.replace("\\", "/") for p in include or []]
+    exclude = [p.replace("\\", "/") for p in exclude or []]
+    stack = [(root, "")]
+
+    while stack:
+        folder, rel_folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print(f"Cannot read folder {folder}: {e}")
+            continue
+
+        subfolders = []
+        for entry in entries:
+            rel_path = f"{rel_folder}/{entry.name}" if rel_folder else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and not _matches(rel_path, entry.name, exclude):
+                        subfolders.append((entry.path, rel_path))
+                    continue
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            if not entry.name.lower().endswith('.pdf'):
+                continue
+            if include and not _matches(rel_path, entry.name, include):
+                continue
+            if exclude and _matches(rel_path, entry.name, exclude):
+                continue
+            yield entry.path
+
+        # Reversed so the stack pops subfolders in name order
+        stack.extend(reversed(subfolders))
@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+import typing
+
+# Burst allowance: how many seconds' worth of quota may be spent at once
+BURST_SECONDS = 6.0
+
+
+class RateScheduler:
+    """
+    Shared RPM/TPM token bucket for all workers calling one model.
+    Every API attempt calls acquire() first. The effective rate shrinks multiplicatively on 429s
+    and grows back additively on successes (AIMD), so workers settle just under the real quota
+    instead of bursting and backing off together.
+    """
+
+    def __init__(self, rpm: float, tpm: float, min_factor: float = 0.02, increase_step: float = 0.05,
+                 decrease_factor: float = 0.5, decrease_cooldown: float = 5.0,
+                 clock: typing.Callable[[], float] = time.monotonic, sleep: typing.Callable[[float], None] = time.sleep):
+        self.rpm = float(rpm)
+        self.tpm = float(tpm)
+        self.min_factor = min_factor
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._factor = 1.0
+        self._last_decrease = None
+        self._last_refill = clock()
+        self._requests = self._request_capacity()
+        self._tokens = self._token_capacity()
+        self.rate_limited_count = 0
+        self._latency = None # smoothed seconds per successful request (used by the planner)
+
+    # --- Capacity (scaled by the adaptive factor) ---
+
+    def _request_capacity(self):
+        return max(1.0, self.rpm * self._factor * BURST_SECONDS / 60.0)
+
+    def _token_capacity(self):
+        return max(1.0, self.tpm * self._factor * BURST_SECONDS / 60.0)
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._requests = min(self._request_capacity(), self._requests + elapsed * self.rpm * self._factor / 60.0)
+        self._tokens = min(self._token_capacity(), self._tokens + elapsed * self.tpm * self._factor / 60.0)
+
+    def _wait_time(self, tokens):
+        # A request larger than the bucket may start once the bucket is full (it then goes into debt)
+        need_tokens = min(tokens, self._token_capacity())
+        wait_req = max(0.0, 1.0 - self._requests) * 60.0 / (self.rpm * self._factor)
+        wait_tok = max(0.0, need_tokens - self._tokens) * 60.0 / (self.tpm * self._factor)
+        return max(wait_req, wait_tok)
+
+    # --- Public API ---
+
+    def acquire(self, tokens: int = 0, should_stop: typing.Callable[[], bool] = None) -> bool:
+        """
+        Blocks until one request with `tokens` estimated prompt tokens fits the budget.
+        Returns False if should_stop() became true while waiting.
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    self._requests -= 1.0
+                    self._tokens -= tokens
+                    return True
+
+            if should_stop and should_stop():
+                return False
+            self._sleep(min(wait, 0.5))
+
+    async def acquire_async(self, tokens: int = 0):
+        """
+        Async variant of acquire(); waits with asyncio.sleep and is cancelled with its task.
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    self._requests -= 1.0
+                    self._tokens -= tokens
+                    return
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self._factor = min(1.0, self._factor + self.increase_step)
+
+    def record_latency(self, seconds: float, weight: float = 0.2):
+        with self._lock:
+            self._latency = seconds if self._latency is None else (1 - weight) * self._latency + weight * seconds
+
+    def on_rate_limited(self):
+        """
+        Shrinks the rate. 429s arriving together from concurrent workers count once per cooldown.
+        """
+        with self._lock:
+            self.rate_limited_count += 1
+            now = self._clock()
+            if self._last_decrease is not None and now - self._last_decrease < self.decrease_cooldown:
+                return
+            self._last_decrease = now
+            self._refill()
+            self._factor = max(self.min_factor, self._factor * self.decrease_factor)
+            # Drop any burst credit so the reduced rate applies immediately
+            self._requests = min(self._requests, 0.0)
+            self._tokens = min(self._tokens, 0.0)
+
+    @property
+    def observed_latency(self):
+        """
+        Smoothed request latency in seconds, or None before the first successful request.
+        """
+        return self._latency
+
+    @property
+    def effective_rpm(self):
+        return self.rpm * self._factor
+
+    @property
+    def effective_tpm(self):
+        return self.tpm * self._factor
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(model_name: str, rpm: float, tpm: float) -> RateScheduler:
+    """
+    Returns the process-wide scheduler for a model, so every worker (and every run) shares one budget.
+    A scheduler is recreated if the configured limits change.
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(model_name)
+        if scheduler is None or scheduler.rpm != rpm or scheduler.tpm != tpm:
+            scheduler = RateScheduler(rpm, tpm)
+            _schedulers[model_name] = scheduler
+        return scheduler
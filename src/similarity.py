@@ -0,0 +1,209 @@
+"""
+Near-duplicate detection: MinHash signatures of the extracted text and a persistent LSH index.
+
+Libraries hold the same paper many times (preprint and published version, renamed downloads,
+supplementary copies). A document whose signature matches an already processed one above the
+threshold reuses that record instead of calling the API.
+
+Signatures are NUM_PERM MinHash values over word 5-shingles, computed in the extraction process.
+The index splits them into BANDS bands of ROWS values; documents sharing any band bucket are
+candidates, and the best candidate is accepted if its estimated Jaccard similarity reaches the
+threshold. A lookup is one indexed query over BANDS keys plus a few signature compares, so it
+stays in the millisecond range for 100k+ documents.
+"""
+import array
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import typing
+
+from .config import get_config_path
+
+INDEX_FILENAME = "similarity_index.sqlite3"
+
+SHINGLE_WORDS = 5
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# Estimated Jaccard similarity of the shingle sets at which a document counts as a copy
+DEFAULT_THRESHOLD = 0.8
+# Shorter texts (cover pages, OCR fragments) match too easily to be trusted
+MIN_SHINGLES = 50
+
+# One random XOR mask per MinHash value: a permutation of the 64-bit shingle hashes that costs
+# a single operation (about 4x faster than (a*h + b) mod p in pure Python).
+# Fixed seed: signatures must be comparable across runs and processes.
+_rng = random.Random(0x5EED)
+_MASKS = [_rng.getrandbits(64) for _ in range(NUM_PERM)]
+
+WORD_RE = re.compile(r'\w+')
+
+
+def get_default_index_path():
+    # Lives next to config.json (AppData / ~/.risgenerator)
+    return os.path.join(os.path.dirname(get_config_path()), INDEX_FILENAME)
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_WORDS) -> typing.Set[int]:
+    """
+    64-bit hashes of the overlapping word n-grams of the lowercased text.
+    """
+    words = WORD_RE.findall(text.lower())
+    return {
+        int.from_bytes(hashlib.blake2b(" ".join(words[i:i + size]).encode("utf-8"), digest_size=8).digest(), "little")
+        for i in range(len(words) - size + 1)
+    }
+
+
+def minhash_signature(text: str) -> typing.Optional[bytes]:
+    """
+    Returns the packed MinHash signature of the text, or None if the text is too short to compare.
+    """
+    hashes = list(shingle_hashes(text))
+    if len(hashes) < MIN_SHINGLES:
+        return None
+    values = [min(map(mask.__xor__, hashes)) for mask in _MASKS]
+    return array.array("Q", values).tobytes()
+
+
+def _unpack(signature: bytes) -> array.array:
+    values = array.array("Q")
+    values.frombytes(signature)
+    return values
+
+
+def estimate_similarity(sig_a: bytes, sig_b: bytes) -> float:
+    """
+    Estimated Jaccard similarity: the fraction of equal MinHash values.
+    """
+    a, b = _unpack(sig_a), _unpack(sig_b)
+    if len(a) != len(b) or not a:
+        return 0.0
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def band_keys(signature: bytes) -> typing.List[int]:
+    """
+    One bucket key per band (63-bit, so it fits an SQLite INTEGER).
+    """
+    size = ROWS * 8
+    return [
+        int.from_bytes(hashlib.blake2b(bytes([band]) + signature[band * size:(band + 1) * size], digest_size=8).digest(), "little") >> 1
+        for band in range(BANDS)
+    ]
+
+
+def duplicate_record(record: dict, original: str, similarity: float) -> dict:
+    """
+    Copy of an indexed record for a near-duplicate, with an N1 note naming the original.
+    """
+    data = dict(record)
+    note = f"DUPLICATE: metadata reused from {original} (similarity {similarity:.2f})"
+    previous = data.get("N1")
+    if isinstance(previous, dict) and str(previous.get("value", "")).strip():
+        note = f"{previous['value'].strip()}; {note}"
+    data["N1"] = {"value": note, "confidence": "high"}
+    return data
+
+
+class SimilarityIndex:
+    """
+    SQLite LSH index: document signature -> the record generated for it.
+    Each entry remembers the source PDF's path and content hash, so a document never matches itself.
+    Thread-safe; kept across runs next to the result cache.
+    """
+
+    def __init__(self, path: str = None, threshold: float = DEFAULT_THRESHOLD):
+        self.path = path or get_default_index_path()
+        self.threshold = threshold
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " id INTEGER PRIMARY KEY,"
+            " signature BLOB NOT NULL UNIQUE,"
+            " filename TEXT NOT NULL,"
+            " record TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " path TEXT,"
+            " content_hash TEXT)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(docs)")}
+        for column in ("path", "content_hash"): # indexes created before these were stored
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE docs ADD COLUMN {column} TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_path ON docs(path)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bands (key INTEGER NOT NULL, doc_id INTEGER NOT NULL, PRIMARY KEY (key, doc_id)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def lookup(self, signature: bytes, path: str = None, content_hash: str = None) -> typing.Optional[typing.Tuple[dict, float, str]]:
+        """
+        Returns (record, similarity, filename) of the most similar indexed document at or above
+        the threshold, or None. Entries of the same path or the same content hash are not matches:
+        that is the document itself (an earlier run, or an edited version), not a copy.
+        """
+        if not signature:
+            return None
+        path = os.path.abspath(path) if path else None
+        keys = band_keys(signature)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT d.signature, d.filename, d.record, d.path, d.content_hash FROM docs d WHERE d.id IN "
+                f"(SELECT doc_id FROM bands WHERE key IN ({','.join('?' * len(keys))}))",
+                keys
+            ).fetchall()
+        best = None
+        for other, filename, record, other_path, other_hash in rows:
+            if (path and other_path == path) or (content_hash and other_hash == content_hash):
+                continue
+            similarity = estimate_similarity(signature, other)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (record, similarity, filename)
+        if best is None:
+            return None
+        try:
+            return json.loads(best[0]), best[1], best[2]
+        except json.JSONDecodeError:
+            return None
+
+    def add(self, signature: bytes, record: dict, filename: str, path: str = None, content_hash: str = None):
+        """
+        Indexes a processed document. Re-indexing a path replaces its entry; otherwise a signature
+        that is already indexed keeps its first record.
+        """
+        if not signature:
+            return
+        path = os.path.abspath(path) if path else None
+        payload = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            if path:
+                stale = [row[0] for row in self._conn.execute("SELECT id FROM docs WHERE path = ?", (path,))]
+                if stale:
+                    marks = ",".join("?" * len(stale))
+                    self._conn.execute(f"DELETE FROM bands WHERE doc_id IN ({marks})", stale)
+                    self._conn.execute(f"DELETE FROM docs WHERE id IN ({marks})", stale)
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO docs (signature, filename, record, created, path, content_hash) VALUES (?, ?, ?, ?, ?, ?)",
+                (signature, filename, payload, time.time(), path, content_hash)
+            )
+            if cur.rowcount:
+                self._conn.executemany("INSERT OR IGNORE INTO bands (key, doc_id) VALUES (?, ?)",
+                                       [(key, cur.lastrowid) for key in band_keys(signature)])
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,242 @@
+"""
+Per-stage tracing and metrics for the processing pipeline.
+
+Spans: one JSON line per stage of a file (scan, extract, queue, api, postprocess, write) with its
+duration and attributes (token counts, retries, failure code). Written to a JSONL trace file.
+
+Metrics: counters, gauges and latency histograms in the Prometheus text format, written to a file
+every few seconds and/or served on http://127.0.0.1:PORT/metrics while a run is active.
+
+Stage totals also go into the run summary ("stage_seconds"), which is usually enough to tell
+whether pypdf, the API or the file system limits a run.
+"""
+import contextlib
+import http.server
+import json
+import os
+import threading
+import time
+
+STAGES = ("scan", "extract", "queue", "api", "postprocess", "write")
+
+# Seconds; covers cached lookups up to slow retried API calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Seconds between metrics file writes during a run (always written at the end)
+METRICS_WRITE_INTERVAL = 5.0
+
+PREFIX = "risgen_"
+
+METRIC_HELP = {
+    "files_total": ("counter", "Files finished, by status"),
+    "failures_total": ("counter", "Failed files, by error code"),
+    "api_calls_total": ("counter", "API calls (one per document or pack)"),
+    "api_attempts_total": ("counter", "API attempts"),
+    "api_retries_total": ("counter", "API attempts that were retries"),
+    "api_rate_limited_total": ("counter", "429 / ResourceExhausted responses"),
+    "prompt_tokens_total": ("counter", "Estimated prompt tokens sent"),
+    "response_tokens_total": ("counter", "Estimated response tokens received"),
+    "response_documents_total": ("counter", "Documents covered by API responses"),
+    "api_in_flight": ("gauge", "API requests in flight"),
+    "run_elapsed_seconds": ("gauge", "Seconds since the run started"),
+    "stage_seconds": ("histogram", "Per-file stage durations in seconds"),
+}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+class Telemetry:
+    """
+    Collects spans and metrics for one run. Thread-safe (the HTTP endpoint reads from its own thread).
+    trace_path: JSONL span file (None = no trace). metrics_path: Prometheus text file (None = none).
+    metrics_port: serve /metrics on 127.0.0.1 (None = no endpoint).
+    """
+
+    def __init__(self, trace_path: str = None, metrics_path: str = None, metrics_port: int = None):
+        self.trace_path = trace_path
+        self.metrics_path = metrics_path
+        self.metrics_port = metrics_port
+        self._lock = threading.Lock()
+        self._trace = None
+        self._server = None
+        self._started = time.monotonic()
+        self._last_write = 0.0
+        self._counters = {} # (name, labels tuple) -> value
+        self._gauges = {}
+        self._histograms = {} # (name, labels tuple) -> [bucket counts..., count, sum]
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+
+    # --- Lifecycle ---
+
+    def start(self):
+        self._started = time.monotonic()
+        if self.trace_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.trace_path)), exist_ok=True)
+            self._trace = open(self.trace_path, "w", encoding="utf-8", buffering=1 << 16)
+        if self.metrics_port is not None:
+            self._server = _serve(self, self.metrics_port)
+        return self
+
+    def close(self):
+        """
+        Writes the final metrics file and closes the trace and the endpoint.
+        """
+        self.write_metrics()
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    # --- Spans ---
+
+    def record_span(self, stage: str, file: str, seconds: float, **attrs):
+        """
+        Records a finished span: stage totals, the latency histogram and one trace line.
+        """
+        seconds = max(0.0, seconds)
+        self.observe("stage_seconds", seconds, stage=stage)
+        with self._lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+            if self._trace is not None:
+                line = {"ts": round(time.time() - seconds, 6), "stage": stage, "file": file, "seconds": round(seconds, 6)}
+                line.update({k: round(v, 6) if isinstance(v, float) else v for k, v in attrs.items() if v is not None})
+                self._trace.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    @contextlib.contextmanager
+    def span(self, stage: str, file: str, **attrs):
+        """
+        Times the with-block as one span. The yielded dict takes attributes set inside the block;
+        an exception leaves its message as 'error' and is re-raised.
+        """
+        attrs = dict(attrs)
+        started = time.monotonic()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs.setdefault("error", str(e) or type(e).__name__)
+            raise
+        finally:
+            self.record_span(stage, file, time.monotonic() - started, **attrs)
+
+    # --- Metrics ---
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def add_gauge(self, name: str, delta: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0.0) + delta
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * len(LATENCY_BUCKETS) + [0, 0.0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    hist[i] += 1
+            hist[-2] += 1
+            hist[-1] += value
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0.0)
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            gauges = dict(self._gauges)
+            gauges[("run_elapsed_seconds", ())] = time.monotonic() - self._started
+            counters = dict(self._counters)
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            help_text = METRIC_HELP.get(name, (kind, name.replace("_", " ")))[1]
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{PREFIX}{name}{_labels(dict(labels))} {value:g}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{PREFIX}{name}{_labels(dict(labels))} {value:g}")
+        for (name, labels), hist in sorted(histograms.items()):
+            header(name, "histogram")
+            base = dict(labels)
+            for bound, count in zip(LATENCY_BUCKETS, hist):
+                lines.append(f"{PREFIX}{name}_bucket{_labels({**base, 'le': f'{bound:g}'})} {count}")
+            lines.append(f"{PREFIX}{name}_bucket{_labels({**base, 'le': '+Inf'})} {hist[-2]}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(base)} {hist[-1]:g}")
+            lines.append(f"{PREFIX}{name}_count{_labels(base)} {hist[-2]}")
+        return "\n".join(lines) + "\n"
+
+    def metrics_due(self) -> bool:
+        return bool(self.metrics_path) and time.monotonic() - self._last_write >= METRICS_WRITE_INTERVAL
+
+    def write_metrics(self):
+        """
+        Atomically replaces the metrics file (node_exporter textfile collectors read it at any time).
+        """
+        if not self.metrics_path:
+            return
+        self._last_write = time.monotonic()
+        tmp = self.metrics_path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.metrics_path)), exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(tmp, self.metrics_path)
+        except OSError as e:
+            print(f"Failed to write metrics: {e}")
+
+
+def _serve(telemetry: Telemetry, port: int):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = telemetry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # scrapes every few seconds would flood the console
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Metrics on http://127.0.0.1:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import queue
+import threading
+
+LIBRARY_FILENAME = "RisGenerator_library.ris"
+
+_STOP = object()
+
+
+class RisWriter:
+    """
+    Output stage: one thread writes every .ris file, so API tasks never do file I/O themselves.
+    Each file is written atomically (temp file + os.replace), so a crash never leaves a half-written .ris.
+    Requests are drained in batches; the optional combined library file is streamed to disk
+    (flushed once per batch) and only renamed into place when the run closes.
+    Memory stays bounded: every write() caller waits for its own write, so at most one item
+    per in-flight API task is queued.
+    """
+
+    def __init__(self, library_path: str = None, batch_size: int = 64):
+        self.library_path = library_path
+        self.batch_size = batch_size
+        self.written = 0
+        self.library_records = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._library = None
+
+    def start(self):
+        if self.library_path:
+            try:
+                self._library = open(self.library_path + ".part", 'w', encoding='utf-8')
+            except OSError as e:
+                print(f"Cannot create library file {self.library_path}: {e}")
+                self._library = None
+        self._thread = threading.Thread(target=self._run, name="ris-writer", daemon=True)
+        self._thread.start()
+
+    async def write(self, ris_path: str, ris_content: str):
+        """
+        Queues one .ris file and waits until it is on disk (raises the OSError if writing failed).
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((ris_path, ris_content, loop, future))
+        await future
+
+    def add_to_library(self, ris_path: str):
+        """
+        Copies an existing .ris (e.g. a skipped, already generated file) into the library. Fire and forget.
+        """
+        if self._library is not None:
+            self._queue.put((ris_path, None, None, None))
+
+    def close(self):
+        """
+        Writes everything still queued, then finalizes the library file. Blocking.
+        """
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        if self._library is not None:
+            self._library.close()
+            try:
+                os.replace(self.library_path + ".part", self.library_path)
+                print(f"Library written: {self.library_path} ({self.library_records} records)")
+            except OSError as e:
+                print(f"Failed to finalize library {self.library_path}: {e}")
+            self._library = None
+
+    # --- Writer thread ---
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopping = True
+                batch = [item for item in batch if item is not _STOP]
+                # Drain anything queued behind the stop marker as well
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+
+            for ris_path, ris_content, loop, future in batch:
+                error = None
+                try:
+                    if ris_content is None:
+                        with open(ris_path, 'r', encoding='utf-8') as f:
+                            self._append_library(f.read())
+                        continue
+                    self._write_atomic(ris_path, ris_content)
+                    self.written += 1
+                    self._append_library(ris_content)
+                except FileNotFoundError as e:
+                    error = e
+                except Exception as e:
+                    error = e
+                    if future is None:
+                        print(f"Library: cannot read {ris_path}: {e}")
+                if future is not None:
+                    try:
+                        loop.call_soon_threadsafe(self._resolve, future, error)
+                    except RuntimeError:
+                        pass # loop already closed (run cancelled)
+
+            if self._library is not None:
+                self._library.flush()
+
+    @staticmethod
+    def _write_atomic(ris_path, ris_content):
+        tmp_path = ris_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(ris_content)
+            os.replace(tmp_path, ris_path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _append_library(self, ris_content):
+        if self._library is not None and ris_content.strip():
+            self._library.write(ris_content.rstrip("\n") + "\n\n")
+            self.library_records += 1
+
+    @staticmethod
+    def _resolve(future, error):
+        if future.cancelled():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(None)
@@ -0,0 +1,128 @@
+import unittest
+from unittest.mock import patch
+import json
+import sys
+import os
+import tempfile
+
+# Add src and benchmarks to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+from src import engine
+from src.batch import BatchJob, BatchClient, BatchError, request_line, parse_response, PREPARED, SUBMITTED, DONE
+from src.engine import ProcessingEngine
+from src.manifest import FolderManifest
+from fake_batch import FakeBatchServer
+from synthetic_corpus import make_corpus
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.state_path = os.path.join(self.tmpdir.name, "job", "batch_job.json")
+        self.server = FakeBatchServer(polls=1).start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.tmpdir.cleanup()
+
+    def make_engine(self, files, **kwargs):
+        return ProcessingEngine(files, "key", "test-model", use_cache=False, extract_workers=1, use_pdf_metadata=False,
+                                rate_limits={"rpm": 10**6, "tpm": 10**9}, **kwargs)
+
+    def test_request_line_matches_engine_prompt(self):
+        line = request_line("7", "PROMPT")
+        self.assertEqual(line["key"], "7")
+        self.assertEqual(line["request"]["contents"][0]["parts"][0]["text"], "PROMPT")
+        config = line["request"]["generationConfig"]
+        self.assertEqual(config["responseMimeType"], "application/json")
+        self.assertEqual(config["responseSchema"]["type"], "OBJECT")
+        self.assertEqual(config["responseSchema"]["properties"]["AU"]["items"]["properties"]["value"]["type"], "STRING")
+
+        response = {"candidates": [{"content": {"parts": [{"text": '{"TI": {"value": "T", "confidence": "high"}}'}]}}]}
+        self.assertEqual(parse_response(response)["TI"]["value"], "T")
+        with self.assertRaises(Exception) as ctx:
+            parse_response({"candidates": []})
+        self.assertIn("AI_EMPTY_RESPONSE", str(ctx.exception))
+
+    def test_job_resumes_from_state_file_and_writes_ris(self):
+        files = make_corpus(self.tmpdir.name, files=3, pages=(2, 2), image_only=0.0, seed=4)
+        client = BatchClient("key", self.server.base_url)
+
+        job = BatchJob(self.state_path)
+        self.assertEqual(job.prepare(self.make_engine(files), files), 3)
+        self.assertEqual(job.phase, PREPARED)
+        with open(job.requests_path, encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        self.assertIn("Filename: " + os.path.basename(files[0]), lines[0]["request"]["contents"][0]["parts"][0]["text"])
+        job.submit(client)
+        self.assertEqual(job.phase, SUBMITTED)
+        self.assertFalse(job.poll(client)) # still running
+
+        # A new process picks the job up from its state file
+        job = BatchJob(self.state_path)
+        self.assertEqual(job.phase, SUBMITTED)
+        self.assertTrue(job.wait(client, poll_seconds=0.01))
+        self.assertEqual(job.phase, DONE)
+        job.submit(client) # no-op once submitted
+        self.assertEqual(self.server.stats()["uploads"], 1)
+        self.assertEqual(self.server.stats()["batches"], 1)
+
+        records, errors = job.results()
+        self.assertEqual(errors, {})
+        eng = self.make_engine(job.paths, batch_results=records)
+        with patch.object(engine, 'generate_ris_data_async', side_effect=AssertionError("no API call expected")):
+            summary = eng.run()
+        self.assertEqual(summary["batch"], 3)
+        self.assertEqual(summary["failed"], 0)
+        stem = os.path.splitext(files[1])[0]
+        with open(stem + ".ris", encoding="utf-8") as f:
+            self.assertIn(f"TI  - Synthetic Study of {os.path.basename(stem)}", f.read())
+
+    def test_failed_lines_fall_back_to_api(self):
+        files = make_corpus(self.tmpdir.name, files=2, pages=(2, 2), image_only=0.0, seed=5)
+        self.server.error_rate = 1.0
+        client = BatchClient("key", self.server.base_url)
+        job = BatchJob(self.state_path)
+        job.prepare(self.make_engine(files), files)
+        job.submit(client)
+        job.wait(client, poll_seconds=0.01)
+        records, errors = job.results()
+        self.assertEqual(records, {})
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(all(e.startswith("API_ERROR") for e in errors.values()))
+
+        calls = []
+        async def fake_generate(text_context, filename, api_key, model_name, filename_mode):
+            calls.append(filename)
+            return {"TI": {"value": "Fallback", "confidence": "high"}}
+
+        with patch.object(engine, 'generate_ris_data_async', fake_generate):
+            summary = self.make_engine(job.paths, batch_results=records).run()
+        self.assertEqual(sorted(calls), sorted(os.path.basename(f) for f in files))
+        self.assertEqual(summary["success"], 2)
+
+    def test_changed_pdf_gets_a_request_despite_old_ris(self):
+        files = make_corpus(self.tmpdir.name, files=3, pages=(2, 2), image_only=0.0, seed=6)
+        manifest = FolderManifest.load(os.path.dirname(files[0]))
+        for path in files:
+            with open(os.path.splitext(path)[0] + ".ris", "w", encoding="utf-8") as f:
+                f.write("TY  - JOUR\nER  - \n")
+            manifest.record(os.path.basename(path))
+        manifest.save()
+        # Replaced after its .ris was written: the collecting run regenerates it, so it belongs in the batch
+        with open(files[1], "ab") as f:
+            f.write(b"\n% revised\n")
+
+        job = BatchJob(self.state_path)
+        self.assertEqual(job.prepare(self.make_engine(files, skip_existing=True), files), 1)
+        self.assertEqual(list(job.state["requests"].values()), [os.path.abspath(files[1])])
+
+    def test_errors_keep_status_code(self):
+        with self.assertRaises(BatchError) as ctx:
+            BatchClient("", self.server.base_url).get("batches/missing")
+        self.assertIn("403", str(ctx.exception))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import sys
+import os
+import asyncio
+import tempfile
+import time
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.cache import ResultCache, make_cache_key
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(os.path.join(self.tmpdir.name, "cache.sqlite3"))
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmpdir.cleanup()
+
+    def test_key_ignores_filename_unless_filename_mode(self):
+        a = make_cache_key("abc", "m", False, "1", "a.pdf")
+        b = make_cache_key("abc", "m", False, "1", "b.pdf")
+        self.assertEqual(a, b)
+        self.assertNotEqual(
+            make_cache_key("abc", "m", True, "1", "a.pdf"),
+            make_cache_key("abc", "m", True, "1", "b.pdf")
+        )
+        self.assertNotEqual(a, make_cache_key("abc", "other-model", False, "1"))
+
+    def test_single_flight(self):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.2)
+            return {"TI": {"value": "Title", "confidence": "high"}}
+
+        async def run():
+            return await asyncio.gather(*[self.cache.get_or_compute_async("k", compute) for _ in range(4)])
+
+        results = asyncio.run(run())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sum(1 for _, hit in results if hit), 3)
+        self.assertTrue(all(data["TI"]["value"] == "Title" for data, _ in results))
+
+    def test_failed_results_not_stored(self):
+        async def compute():
+            return None
+
+        data, hit = asyncio.run(self.cache.get_or_compute_async("k", compute))
+        self.assertIsNone(data)
+        self.assertFalse(hit)
+        self.assertIsNone(self.cache.get("k"))
+
+    def test_eviction_by_count(self):
+        self.cache.max_entries = 2
+        for i in range(4):
+            self.cache.put(f"k{i}", {"i": i})
+            time.sleep(0.01)
+        self.cache.evict()
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNotNone(self.cache.get("k3"))
+        self.assertIsNone(self.cache.get("k0"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.cli import collect_inputs, main, EXIT_USAGE
+
+class TestCli(unittest.TestCase):
+
+    def test_collect_inputs_expands_folders_and_dedupes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ["a.pdf", "B.PDF", "notes.txt"]:
+                open(os.path.join(tmp, name), "w").close()
+            os.mkdir(os.path.join(tmp, "sub"))
+            open(os.path.join(tmp, "sub", "c.pdf"), "w").close()
+
+            list_path = os.path.join(tmp, "list.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                f.write(os.path.join(tmp, "a.pdf") + "\n\n" + os.path.join(tmp, "missing.pdf") + "\n")
+
+            files, missing = collect_inputs([tmp], list_path)
+
+            self.assertEqual(sorted(os.path.basename(f) for f in files), ["B.PDF", "a.pdf"])
+            self.assertEqual(missing, [os.path.join(tmp, "missing.pdf")])
+
+    def test_no_inputs_is_usage_error(self):
+        self.assertEqual(main(["--api-key", "x"]), EXIT_USAGE)
+
+if __name__ == '__main__':
+    unittest.main()
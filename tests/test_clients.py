@@ -0,0 +1,37 @@
+import unittest
+import asyncio
+import sys
+import os
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.clients import ModelPool
+
+CONFIG = {"temperature": 0.1, "response_mime_type": "application/json"}
+
+class TestModelPool(unittest.TestCase):
+
+    def test_models_reused_per_key_and_config(self):
+        pool = ModelPool()
+        a = pool.get_model("key-a", "model-x", CONFIG)
+        self.assertIs(a, pool.get_model("key-a", "model-x", dict(CONFIG)))
+        b = pool.get_model("key-b", "model-x", CONFIG)
+        self.assertIsNot(a, b)
+        # Each API key has its own client; models on the same key share one
+        self.assertIsNot(a._client, b._client)
+        self.assertIs(a._client, pool.get_model("key-a", "model-y", CONFIG)._client)
+
+    def test_async_models_are_per_event_loop(self):
+        pool = ModelPool()
+
+        async def get():
+            return pool.get_async_model("key-a", "model-x", CONFIG)
+
+        first = asyncio.run(get())
+        second = asyncio.run(get())
+        self.assertIsNot(first, second)
+        self.assertIsNotNone(first._async_client)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import sys
+import os
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.compaction import compact_text
+
+def sample_text():
+    pages = [
+        "--- Page 1 ---\nJournal of Examples   Vol. 12 (2021)\nA Study of Com-\npaction Methods\nJane Doe\n2021\nAbstract\nWe study things.\n1"
+    ]
+    pages.append("--- Page 2 ---\nJournal of Examples   Vol. 12 (2021)\nIntroduction    text with    spaces\n2")
+    refs = "\n".join(f"[{i}] Author {i}, A. (2019). Some cited work {i}. Journal {i}, 1-10." for i in range(1, 41))
+    pages.append(f"--- Page 9 ---\nJournal of Examples   Vol. 12 (2021)\nReferences\n{refs}\n9")
+    pages.append(f"--- Page 10 ---\nJournal of Examples   Vol. 12 (2021)\n{refs}\n10")
+    return "\n".join(pages)
+
+class TestCompaction(unittest.TestCase):
+
+    def test_removes_boilerplate_and_references(self):
+        raw = sample_text()
+        text = compact_text(raw)
+
+        # Running header kept once, gutters gone, hyphenation rejoined, whitespace collapsed
+        self.assertEqual(text.count("Journal of Examples"), 1)
+        self.assertIn("A Study of Compaction Methods", text.replace("\n", " "))
+        self.assertIn("Introduction text with spaces", text)
+        self.assertNotIn("\n9\n", text)
+        self.assertIn("2021", text)
+
+        # Reference lists shrink to a few lines (continuation page included)
+        self.assertIn("[1] Author 1", text)
+        self.assertNotIn("[10] Author 10", text)
+        self.assertIn("reference lines omitted", text)
+        self.assertIn("--- Page 10 ---", text)
+        self.assertLess(len(text), len(raw) * 0.3)
+
+    def test_budget_keeps_first_page(self):
+        raw = "--- Page 1 ---\nTitle Line\n" + "a" * 3000 + "\n--- Page 5 ---\n" + "b" * 3000
+        text = compact_text(raw, max_chars=1000)
+        self.assertLessEqual(len(text), 1000)
+        self.assertIn("Title Line", text)
+        self.assertIn("--- Page 5 ---", text)
+
+if __name__ == '__main__':
+    unittest.main()
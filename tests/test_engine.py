@@ -0,0 +1,153 @@
+import unittest
+from unittest.mock import patch
+import asyncio
+import sys
+import os
+import tempfile
+import time
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import engine
+from src.engine import ProcessingEngine
+from src.writer import RisWriter
+
+def fake_result(filename):
+    return {
+        "TY": {"value": "JOUR", "confidence": "high"},
+        "TI": {"value": f"Title of {filename}", "confidence": "high"},
+        "AU": [{"value": "Doe, John", "confidence": "high"}],
+        "PY": {"value": "2020", "confidence": "high"}
+    }
+
+class TestProcessingEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.files = []
+        for i in range(5):
+            path = os.path.join(self.tmpdir.name, f"doc{i}.pdf")
+            with open(path, "w") as f:
+                f.write("not a real pdf") # no text layer -> filename mode
+            self.files.append(path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_engine(self, **kwargs):
+        return ProcessingEngine(self.files, "key", "test-model", use_cache=False, extract_workers=1,
+                                rate_limits={"rpm": 10**6, "tpm": 10**9}, **kwargs)
+
+    def test_run_writes_ris_files(self):
+        async def fake_generate(text_context, filename, api_key, model_name, filename_mode):
+            return fake_result(filename)
+
+        with patch.object(engine, 'generate_ris_data_async', fake_generate):
+            summary = self.make_engine(max_workers=50).run()
+
+        self.assertEqual(summary["processed"], 5)
+        self.assertEqual(summary["filename_only_success"], 5)
+        self.assertFalse(summary["cancelled"])
+        with open(os.path.join(self.tmpdir.name, "doc0.ris"), encoding="utf-8") as f:
+            self.assertIn("TI  - Title of doc0.pdf", f.read())
+
+    def test_stop_cancels_in_flight_requests(self):
+        eng = self.make_engine()
+
+        async def hanging_generate(text_context, filename, api_key, model_name, filename_mode):
+            eng.request_stop()
+            await asyncio.sleep(60)
+
+        with patch.object(engine, 'generate_ris_data_async', hanging_generate):
+            summary = eng.run()
+
+        self.assertTrue(summary["cancelled"])
+        self.assertEqual(summary["success"] + summary["filename_only_success"], 0)
+
+    def test_streamed_file_iterator(self):
+        async def fake_generate(text_context, filename, api_key, model_name, filename_mode):
+            return fake_result(filename)
+
+        eng = self.make_engine()
+        eng.pdf_files = (f for f in self.files) # no len(): consumed lazily, total counted as found
+        with patch.object(engine, 'generate_ris_data_async', fake_generate):
+            summary = eng.run()
+
+        self.assertEqual(summary["total"], 5)
+        self.assertEqual(summary["filename_only_success"], 5)
+
+    def test_retry_backoff_frees_the_slot(self):
+        order = []
+
+        async def fake_generate(text_context, filename, api_key, model_name, filename_mode):
+            order.append(filename)
+            if order.count("doc0.pdf") == 1 and filename == "doc0.pdf":
+                raise Exception("429 Resource has been exhausted")
+            return fake_result(filename)
+
+        with patch.object(engine, 'generate_ris_data_async', fake_generate), \
+             patch.object(engine, 'backoff_delay', lambda *a, **k: 0.2):
+            summary = self.make_engine(max_workers=1).run()
+
+        self.assertEqual(summary["filename_only_success"], 5)
+        # doc0's retry waited in the delay queue while the single slot processed the others
+        self.assertEqual(order[0], "doc0.pdf")
+        self.assertEqual(order[-1], "doc0.pdf")
+        self.assertEqual(len(order), 6)
+
+    def test_stop_drops_deferred_retries(self):
+        eng = self.make_engine(max_workers=1)
+        calls = []
+
+        async def failing_generate(text_context, filename, api_key, model_name, filename_mode):
+            calls.append(filename)
+            if len(calls) == 5:
+                eng.request_stop()
+            raise Exception("503 overloaded")
+
+        started = time.monotonic()
+        with patch.object(engine, 'generate_ris_data_async', failing_generate), \
+             patch.object(engine, 'backoff_delay', lambda *a, **k: 60):
+            summary = eng.run()
+
+        self.assertTrue(summary["cancelled"])
+        self.assertEqual(len(calls), 5)
+        self.assertLess(time.monotonic() - started, 30)
+
+    def test_cascade_escalates_only_uncertain_fields(self):
+        calls = []
+
+        async def fake_generate(text_context, filename, api_key, model_name, filename_mode, fields=None):
+            calls.append((model_name, fields))
+            if model_name == "strong-model":
+                return {"PY": {"value": "2021", "confidence": "high"}, "DO": {"value": "10.1000/xyz", "confidence": "high"}}
+            data = fake_result(filename)
+            data["PY"] = {"value": "2021", "confidence": "low"}
+            data["DO"] = {"value": "doi-unknown", "confidence": "high"} # fails check_doi
+            return data
+
+        eng = self.make_engine(cascade_model="strong-model")
+        doc = {"text": "Title page text", "content_hash": None}
+
+        async def run_one():
+            eng._writer = RisWriter()
+            eng._writer.start()
+            try:
+                return await eng._process_single_file(self.files[0], doc, 0, 1)
+            finally:
+                eng._writer.close()
+
+        with patch.object(engine, 'generate_ris_data_async', fake_generate):
+            res = asyncio.run(run_one())
+
+        self.assertEqual(res["status"], "success")
+        self.assertEqual(res["escalated"], ["PY", "DO"])
+        self.assertEqual(calls, [("test-model", None), ("strong-model", ["PY", "DO"])])
+        with open(os.path.join(self.tmpdir.name, "doc0.ris"), encoding="utf-8") as f:
+            ris = f.read()
+        self.assertIn("PY  - 2021", ris)
+        self.assertIn("DO  - 10.1000/xyz", ris)
+
+if __name__ == '__main__':
+    unittest.main()
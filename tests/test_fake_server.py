@@ -0,0 +1,86 @@
+import unittest
+import sys
+import os
+import asyncio
+import tempfile
+
+# Add src and benchmarks to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+from src.clients import model_pool
+from src.processor import generate_ris_data_async, context_cache
+from fake_gemini import FakeGeminiServer
+from synthetic_corpus import make_corpus
+from src.extraction import extract_text_from_pdf
+
+class TestBenchmarkHarness(unittest.TestCase):
+
+    def test_sdk_talks_to_fake_server(self):
+        server = FakeGeminiServer(latency="const:0.01", err429=1.0, seed=1).start()
+        try:
+            model_pool.set_endpoint(server.endpoint)
+            with self.assertRaises(Exception) as ctx:
+                asyncio.run(generate_ris_data_async("text", "paper.pdf", "key", "test-model"))
+            self.assertIn("429", str(ctx.exception))
+
+            server.err429 = 0.0
+            data = asyncio.run(generate_ris_data_async("text", "paper.pdf", "key", "test-model"))
+            self.assertEqual(data["TI"]["value"], "Synthetic Study of paper")
+            self.assertEqual(server.stats()["429"], 1)
+            self.assertEqual(server.stats()["ok"], 1)
+        finally:
+            model_pool.set_endpoint(None)
+            server.stop()
+
+    def test_context_cache_sends_prefix_once(self):
+        # The instruction alone is below real models' minimum; this server accepts it
+        server = FakeGeminiServer(latency="const:0", seed=1, cache_min_tokens=100).start()
+        text = "Results of the growth study. " * 100
+        self.assertFalse(context_cache.enabled) # opt-in
+        context_cache.enabled = True
+        try:
+            model_pool.set_endpoint(server.endpoint)
+            for name in ("a.pdf", "b.pdf"):
+                asyncio.run(generate_ris_data_async(text, name, "key", "test-model"))
+            stats = server.stats()
+            self.assertEqual(stats["cache_creates"], 1)
+            self.assertEqual(stats["cached_calls"], 2)
+            self.assertEqual(stats["schema_calls"], 2) # constrained decoding with the cached prefix too
+            cached_call_tokens = stats["prompt_tokens"] / stats["calls"]
+            cached_call_total = (stats["prompt_tokens"] + stats["cached_tokens"]) / stats["calls"]
+
+            # Dropped by the server: answered with the full prompt, then cached again
+            server.expire_caches()
+            data = asyncio.run(generate_ris_data_async(text, "c.pdf", "key", "test-model"))
+            self.assertEqual(data["TI"]["value"], "Synthetic Study of c")
+            asyncio.run(generate_ris_data_async(text, "d.pdf", "key", "test-model"))
+            self.assertEqual(server.stats()["cache_creates"], 2)
+
+            # Prefix below the server's minimum size: plain requests
+            context_cache.clear()
+            server.cache_min_tokens = 10**6
+            server.reset_stats()
+            data = asyncio.run(generate_ris_data_async(text, "e.pdf", "key", "test-model"))
+            self.assertEqual(data["TI"]["value"], "Synthetic Study of e")
+            self.assertEqual(server.stats()["cached_calls"], 0)
+            self.assertEqual(server.stats()["calls"], 1)
+            # Fewer uncached tokens, and no input counted twice: the schema is not in the cached prefix
+            self.assertLess(cached_call_tokens, server.stats()["prompt_tokens"])
+            self.assertLessEqual(cached_call_total, server.stats()["prompt_tokens"])
+        finally:
+            context_cache.enabled = False
+            context_cache.clear()
+            model_pool.set_endpoint(None)
+            server.stop()
+
+    def test_synthetic_corpus(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = make_corpus(tmpdir, files=4, pages=(3, 3), image_only=0.5, size_kb=(20, 20), seed=3)
+            texts = [extract_text_from_pdf(p) for p in paths]
+            self.assertTrue(any(t == "" for t in texts)) # image-only documents
+            self.assertTrue(any("doi:10.5555/synthetic" in t for t in texts))
+            self.assertTrue(all(os.path.getsize(p) > 20 * 1024 for p in paths))
+
+if __name__ == '__main__':
+    unittest.main()
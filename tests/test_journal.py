@@ -0,0 +1,84 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import engine
+from src.engine import ProcessingEngine
+from src.journal import RunJournal, QUEUED, STARTED, SUCCEEDED, FAILED
+
+class TestRunJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "journal.sqlite3")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_batched_writes_and_last_state(self):
+        journal = RunJournal(self.path, batch_size=3, flush_interval=3600)
+        run_id = journal.start_run("folder", {"inputs": ["folder"]})
+        journal.record("a.pdf", QUEUED)
+        journal.record("a.pdf", STARTED)
+
+        # Not flushed yet: a second reader sees nothing
+        reader = RunJournal(self.path)
+        self.assertEqual(reader.last_states(run_id), {})
+
+        journal.record("a.pdf", FAILED, "RATE_LIMIT") # third event fills the batch
+        self.assertEqual(reader.last_states(run_id), {os.path.abspath("a.pdf"): (FAILED, "RATE_LIMIT")})
+        self.assertEqual(reader.latest_run("folder")["inputs"], {"inputs": ["folder"]})
+
+        # Without autoflush a full batch is only reported; the caller writes it (off the event loop)
+        journal.record("b.pdf", QUEUED, autoflush=False)
+        journal.record("b.pdf", STARTED, autoflush=False)
+        self.assertTrue(journal.record("b.pdf", SUCCEEDED, autoflush=False))
+        self.assertNotIn(os.path.abspath("b.pdf"), reader.last_states(run_id))
+        journal.flush()
+        self.assertEqual(reader.last_states(run_id)[os.path.abspath("b.pdf")], (SUCCEEDED, None))
+        reader.close()
+        journal.close()
+
+    def test_engine_resume_retries_selected_codes(self):
+        files = []
+        for name in ["done.pdf", "limited.pdf", "broken.pdf", "never.pdf"]:
+            path = os.path.join(self.tmpdir.name, name)
+            with open(path, "w") as f:
+                f.write("not a real pdf")
+            files.append(path)
+        previous = {
+            os.path.abspath(files[0]): (SUCCEEDED, None),
+            os.path.abspath(files[1]): (FAILED, "RATE_LIMIT"),
+            os.path.abspath(files[2]): (FAILED, "API_ERROR: bad request"),
+        }
+        called = []
+
+        async def fake_generate(text_context, filename, api_key, model_name, filename_mode):
+            called.append(filename)
+            return {"TI": {"value": "Title", "confidence": "high"}, "AU": [{"value": "Doe, J", "confidence": "high"}]}
+
+        journal = RunJournal(self.path)
+        run_id = journal.start_run("folder")
+        eng = ProcessingEngine(files, "key", "test-model", use_cache=False, extract_workers=1,
+                               rate_limits={"rpm": 10**6, "tpm": 10**9}, journal=journal,
+                               resume_states=previous, retry_codes=["RATE_LIMIT"])
+        with patch.object(engine, 'generate_ris_data_async', fake_generate):
+            summary = eng.run()
+
+        self.assertEqual(sorted(called), ["limited.pdf", "never.pdf"])
+        self.assertEqual(summary["skipped"], 1)
+        self.assertEqual(summary["failed"], 1)
+
+        # The new run records every file, so it can be resumed again
+        states = journal.last_states(run_id)
+        self.assertEqual(states[os.path.abspath(files[1])][0], SUCCEEDED)
+        self.assertEqual(states[os.path.abspath(files[2])], (FAILED, "API_ERROR: bad request"))
+        journal.close()
+
+if __name__ == '__main__':
+    unittest.main()
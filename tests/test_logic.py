@@ -2,11 +2,12 @@ import unittest
 from unittest.mock import MagicMock, patch
 import sys
 import os
+import json
 
 # Add src to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from src.processor import dict_to_ris
+from src.processor import dict_to_ris, plan_packs, generate_ris_data_packed, expand_record, build_prompt, COMPACT_OUTPUT_SCHEMA
 from src.extraction import extract_text_from_pdf
 
 class TestRisGenerator(unittest.TestCase):
@@ -82,5 +83,74 @@ class TestRisGenerator(unittest.TestCase):
         self.assertIn("Page 9", text)
         self.assertIn("Page 10", text)
 
+    @patch('src.extraction.pypdf.PdfReader')
+    def test_extraction_stops_early(self, mock_reader_cls):
+        # Mock a 300 page thesis
+        pages = []
+        for i in range(300):
+            p = MagicMock()
+            p.extract_text.return_value = f"Page Content {i+1} " + "x" * 1000
+            pages.append(p)
+        pages[0].extract_text.return_value = "A Thesis Title\nAbstract\nThis thesis..."
+        mock_reader = MagicMock()
+        mock_reader.pages = pages
+        mock_reader_cls.return_value = mock_reader
+
+        # Title page signal: only page 1 is read
+        text = extract_text_from_pdf("dummy.pdf", stop_on_signal=True)
+        self.assertIn("A Thesis Title", text)
+        self.assertEqual(sum(p.extract_text.call_count for p in pages), 1)
+
+        # Character budget: pages 1, 2, then the last page (cut to fit), in page order
+        pages[0].extract_text.return_value = "A Thesis Title"
+        text = extract_text_from_pdf("dummy.pdf", max_chars=1500)
+        self.assertLessEqual(len(text), 1500)
+        self.assertLess(text.index("Page Content 2 "), text.index("Page Content 300"))
+        self.assertEqual(pages[298].extract_text.call_count, 0)
+
+    def test_plan_packs_respects_budget(self):
+        docs = [{"id": str(i), "filename": f"{i}.pdf", "text": "x" * 4000} for i in range(5)]
+        packs = plan_packs(docs, token_budget=2600, max_docs=10)
+        self.assertEqual([len(p) for p in packs], [2, 2, 1])
+        # Oversized documents still get their own pack
+        packs = plan_packs(docs[:2], token_budget=10)
+        self.assertEqual([len(p) for p in packs], [1, 1])
+
+    @patch('src.processor._call_gemini')
+    def test_packed_response_demux(self, mock_call):
+        mock_call.return_value = [
+            {"ID": "D2", "TI": {"value": "Second", "confidence": "high"}},
+            {"ID": "D9", "TI": {"value": "Unknown", "confidence": "high"}},
+        ]
+        docs = [{"id": "D1", "filename": "a.pdf", "text": "A"}, {"id": "D2", "filename": "b.pdf", "text": "B"}]
+        results = generate_ris_data_packed(docs, api_key="k")
+        self.assertEqual(list(results), ["D2"])
+        self.assertEqual(results["D2"]["TI"]["value"], "Second")
+        self.assertNotIn("ID", results["D2"])
+
+    def test_compact_answers_expand_to_full_shape(self):
+        compact = {
+            "TY": {"v": "CONF", "c": "h"},
+            "TI": {"v": "Short Answers", "c": "m"},
+            "AU": {"v": ["Doe, Jane", "Sato, Ken"], "c": "l"},
+            "PY": {"v": "2021", "c": "x"},
+        }
+        data = expand_record(compact)
+        self.assertEqual(data["TI"], {"value": "Short Answers", "confidence": "medium"})
+        self.assertEqual(data["AU"], [{"value": "Doe, Jane", "confidence": "low"}, {"value": "Sato, Ken", "confidence": "low"}])
+        self.assertEqual(data["PY"]["confidence"], "conflict")
+        self.assertEqual(expand_record(data), data) # the full shape passes through
+        self.assertEqual(dict_to_ris(compact), dict_to_ris(data))
+        self.assertIn("AU  - Sato, Ken??", dict_to_ris(compact))
+
+        self.assertNotIn("evidence", json.dumps(COMPACT_OUTPUT_SCHEMA))
+        self.assertEqual(COMPACT_OUTPUT_SCHEMA["properties"]["AU"]["properties"]["v"]["type"], "array")
+        for filename_mode in (False, True):
+            prompt = build_prompt("text", "a.pdf", filename_mode, schema_mode="compact")
+            self.assertIn("COMPACT OUTPUT", prompt)
+            self.assertNotIn("'value'", prompt) # no instructions for the full shape
+            self.assertNotIn("'confidence'", prompt)
+        self.assertNotIn("COMPACT OUTPUT", build_prompt("text", "a.pdf"))
+
 if __name__ == '__main__':
     unittest.main()
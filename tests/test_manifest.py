@@ -0,0 +1,84 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import engine
+from src.engine import ProcessingEngine
+from src.manifest import FolderManifest, MANIFEST_FILENAME, UNCHANGED, CHANGED, NEW, UNTRACKED
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.files = []
+        for i in range(3):
+            path = os.path.join(self.tmpdir.name, f"doc{i}.pdf")
+            with open(path, "w") as f:
+                f.write("not a real pdf")
+            self.files.append(path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_engine(self):
+        called = []
+
+        async def fake_generate(text_context, filename, api_key, model_name, filename_mode):
+            called.append(filename)
+            return {"TI": {"value": f"Title of {filename}", "confidence": "high"}, "AU": [{"value": "Doe, J", "confidence": "high"}]}
+
+        eng = ProcessingEngine(self.files, "key", "test-model", use_cache=False, extract_workers=1,
+                               skip_existing=True, rate_limits={"rpm": 10**6, "tpm": 10**9})
+        with patch.object(engine, 'generate_ris_data_async', fake_generate):
+            eng.run()
+        return sorted(called)
+
+    def test_only_new_or_changed_pdfs_are_regenerated(self):
+        # doc2 already has a .ris from before manifests existed: adopted, not regenerated
+        with open(os.path.join(self.tmpdir.name, "doc2.ris"), "w") as f:
+            f.write("TY  - JOUR\nER  - \n")
+
+        self.assertEqual(self.run_engine(), ["doc0.pdf", "doc1.pdf"])
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, MANIFEST_FILENAME)))
+        self.assertEqual(self.run_engine(), [])
+
+        # A corrected PDF replaces doc1 (the old .ris is still there)
+        with open(self.files[1], "w") as f:
+            f.write("not a real pdf, corrected version")
+        manifest = FolderManifest.load(self.tmpdir.name)
+        self.assertEqual(manifest.check("doc0.pdf"), UNCHANGED)
+        self.assertEqual(manifest.check("doc1.pdf"), CHANGED)
+        self.assertEqual(self.run_engine(), ["doc1.pdf"])
+
+    def test_touched_but_identical_pdf_is_not_regenerated(self):
+        self.assertEqual(self.run_engine(), ["doc0.pdf", "doc1.pdf", "doc2.pdf"])
+        # Hashes are recorded without the result cache too
+        manifest = FolderManifest.load(self.tmpdir.name)
+        self.assertTrue(all(entry["hash"] for entry in manifest.entries.values()))
+
+        # Same bytes, new mtime (copied or synced): confirmed by the hash; a same-size edit is still caught
+        st = os.stat(self.files[0])
+        os.utime(self.files[0], (st.st_atime, st.st_mtime + 100))
+        with open(self.files[1], "w") as f:
+            f.write("not a real PDF")
+        os.utime(self.files[1], (st.st_atime, st.st_mtime + 100))
+        manifest = FolderManifest.load(self.tmpdir.name)
+        self.assertEqual(manifest.check("doc0.pdf"), UNCHANGED)
+        self.assertEqual(manifest.check("doc1.pdf"), CHANGED)
+        self.assertEqual(self.run_engine(), ["doc1.pdf"])
+
+    def test_check_states(self):
+        with open(os.path.join(self.tmpdir.name, "doc1.ris"), "w") as f:
+            f.write("")
+        manifest = FolderManifest.load(self.tmpdir.name)
+        self.assertEqual(manifest.check("doc0.pdf"), NEW)
+        self.assertEqual(manifest.check("doc1.pdf"), UNTRACKED)
+        self.assertIsNone(manifest.check("elsewhere.pdf"))
+
+if __name__ == '__main__':
+    unittest.main()
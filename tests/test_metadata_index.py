@@ -0,0 +1,82 @@
+import unittest
+import sys
+import os
+import gzip
+import json
+import tempfile
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.metadata_index import MetadataIndex, find_identifiers, head_text, iter_dump_items
+from src.processor import dict_to_ris
+
+WORK = {
+    "DOI": "10.1234/ABC.5678",
+    "type": "journal-article",
+    "title": ["Deep Learning for Citation Parsing"],
+    "author": [{"family": "Doe", "given": "Jane"}, {"name": "Example Consortium"}],
+    "issued": {"date-parts": [[2021, 5]]},
+    "container-title": ["Journal of Examples"],
+    "page": "10-20",
+    "volume": "7",
+    "ISSN": ["1234-5679"],
+}
+
+PAGE_TEXT = (
+    "--- Page 1 ---\nDeep Learning for Citation Parsing\nJane Doe\n"
+    "https://doi.org/10.1234/abc.5678.\nISSN 0317-8471\n"
+    "--- Page 9 ---\nReferences\n[1] Other work. doi:10.9999/cited.1\n"
+)
+
+class TestMetadataIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.index = MetadataIndex(os.path.join(self.tmpdir.name, "index.sqlite3"))
+
+    def tearDown(self):
+        self.index.close()
+        self.tmpdir.cleanup()
+
+    def test_identifiers_only_from_first_pages(self):
+        ids = find_identifiers(head_text(PAGE_TEXT))
+        self.assertEqual(ids["doi"], ["10.1234/abc.5678"])
+        self.assertEqual(ids["issn"], ["0317-8471"])
+        self.assertIn("10.9999/cited.1", find_identifiers(PAGE_TEXT)["doi"])
+
+    def test_streamed_dump_formats(self):
+        items_json = os.path.join(self.tmpdir.name, "dump.json.gz")
+        with gzip.open(items_json, "wt", encoding="utf-8") as f:
+            json.dump({"items": [WORK, {"DOI": "10.1/x", "title": ["X"]}]}, f)
+        lines = os.path.join(self.tmpdir.name, "dump.jsonl")
+        with open(lines, "w", encoding="utf-8") as f:
+            f.write(json.dumps(WORK) + "\n\n" + json.dumps({"DOI": "10.1/y"}) + "\n")
+
+        # Tiny chunks force objects to span buffer refills
+        self.assertEqual([w["DOI"] for w in iter_dump_items(items_json, chunk_size=16)], ["10.1234/ABC.5678", "10.1/x"])
+        self.assertEqual(len(list(iter_dump_items(lines, chunk_size=16))), 2)
+
+    def test_resolve_checks_title(self):
+        self.index.add_items([WORK])
+        data = self.index.resolve(PAGE_TEXT)
+        self.assertEqual(data["TI"]["value"], "Deep Learning for Citation Parsing")
+        ris = dict_to_ris(data)
+        self.assertIn("AU  - Doe, Jane", ris)
+        self.assertIn("PY  - 2021", ris)
+        self.assertIn("SP  - 10", ris)
+
+        # Same DOI, but the text is about something else -> not trusted
+        self.assertIsNone(self.index.resolve("--- Page 1 ---\nUnrelated Paper\n10.1234/abc.5678"))
+
+    def test_resolve_requires_title(self):
+        self.index.add_items([
+            {"DOI": "10.5555/untitled.1", "author": [{"family": "Doe", "given": "Jane"}], "issued": {"date-parts": [[2020]]}},
+            {"DOI": "10.5555/short.2", "title": ["On AI"]},
+        ])
+        # No TI (or no checkable title words): the API has to fill the record, not the index
+        self.assertIsNone(self.index.resolve("--- Page 1 ---\nJane Doe 2020\ndoi:10.5555/untitled.1"))
+        self.assertIsNone(self.index.resolve("--- Page 1 ---\nOn AI\ndoi:10.5555/short.2"))
+
+if __name__ == '__main__':
+    unittest.main()
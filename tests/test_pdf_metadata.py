@@ -0,0 +1,122 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+
+import pypdf
+from pypdf.generic import StreamObject, NameObject
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import engine
+from src.engine import ProcessingEngine
+from src.pdf_metadata import read_pdf_metadata, metadata_to_fields, split_authors
+from src.processor import missing_fields, merge_fields
+
+XMP = '''<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/"
+ xmlns:prism="http://prismstandard.org/namespaces/basic/2.0/" prism:doi="10.1016/j.cell.2020.01.001" prism:volume="180">
+<dc:title><rdf:Alt><rdf:li xml:lang="x-default">{title}</rdf:li></rdf:Alt></dc:title>
+{creators}
+<prism:publicationName>Cell</prism:publicationName>
+<prism:coverDate>2020-02-06</prism:coverDate>
+</rdf:Description></rdf:RDF></x:xmpmeta><?xpacket end="w"?>'''
+
+
+def write_pdf(path, info=None, title="Cell Growth in Small Spaces", authors=("Jane Doe", "Ken Sato")):
+    writer = pypdf.PdfWriter()
+    writer.add_blank_page(612, 792)
+    if info:
+        writer.add_metadata(info)
+    creators = "<dc:creator><rdf:Seq>" + "".join(f"<rdf:li>{a}</rdf:li>" for a in authors) + "</rdf:Seq></dc:creator>" if authors else ""
+    stream = StreamObject()
+    stream.set_data(XMP.format(title=title, creators=creators).encode("utf-8"))
+    stream.update({NameObject("/Type"): NameObject("/Metadata"), NameObject("/Subtype"): NameObject("/XML")})
+    writer._root_object[NameObject("/Metadata")] = writer._add_object(stream)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+class TestPdfMetadata(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_xmp_wins_over_junk_info(self):
+        path = os.path.join(self.tmpdir.name, "paper.pdf")
+        write_pdf(path, info={"/Title": "Microsoft Word - draft3.docx", "/Author": "Administrator"})
+        meta = read_pdf_metadata(pypdf.PdfReader(path))
+        self.assertEqual(meta["title"], "Cell Growth in Small Spaces")
+        self.assertEqual(meta["authors"], ["Jane Doe", "Ken Sato"])
+        self.assertEqual(meta["doi"], "10.1016/j.cell.2020.01.001")
+
+        fields = metadata_to_fields(meta, "Cell Growth in Small Spaces\nJane Doe and Ken Sato\n2020", "paper.pdf")
+        self.assertEqual(fields["TI"]["confidence"], "high")
+        self.assertEqual([a["value"] for a in fields["AU"]], ["Doe, Jane", "Sato, Ken"])
+        self.assertEqual(fields["PY"]["value"], "2020")
+        self.assertEqual(fields["TY"]["value"], "JOUR")
+        self.assertEqual(missing_fields(fields), [])
+
+    def test_plausibility_checks(self):
+        junk = {"title": "Microsoft Word - draft3.docx", "authors": ["Administrator", "jsmith"], "created": "D:20200101120000"}
+        fields = metadata_to_fields(junk, "Some Other Paper\nA. Author\n", "draft3.pdf")
+        self.assertNotIn("TI", fields)
+        self.assertNotIn("AU", fields)
+        self.assertEqual(fields["PY"]["confidence"], "low") # creation date not confirmed by the text
+        # dc:date is often an export date: without PRISM or the title page it cannot complete the record
+        fields = metadata_to_fields({"dc_date": "2023-11-02"}, "Cell Growth in Small Spaces\n2020", "x.pdf")
+        self.assertEqual(fields["PY"]["confidence"], "low")
+        self.assertEqual(metadata_to_fields({"date": "2020-02-06"}, "", "x.pdf")["PY"]["confidence"], "medium")
+        self.assertEqual(missing_fields(fields), ["TY", "TI", "AU", "PY"])
+        # A title that is not on the title page is kept only as a low-confidence hint
+        fields = metadata_to_fields({"title": "Annual Report Template"}, "Cell Growth in Small Spaces", "x.pdf")
+        self.assertEqual(fields["TI"]["confidence"], "low")
+        self.assertEqual(split_authors("Jane Doe, Ken Sato"), ["Jane Doe", "Ken Sato"])
+        self.assertEqual(split_authors("Doe, Jane"), ["Doe, Jane"])
+
+    def test_merge_keeps_confident_local_fields(self):
+        local = {"TI": {"value": "Local", "confidence": "high"}, "PY": {"value": "2019", "confidence": "low"}}
+        generated = {"TI": {"value": "Remote", "confidence": "high"}, "PY": {"value": "2020", "confidence": "high"}}
+        merged = merge_fields(local, generated)
+        self.assertEqual(merged["TI"]["value"], "Local")
+        self.assertEqual(merged["PY"]["value"], "2020")
+
+    def test_engine_calls_api_only_for_gaps(self):
+        complete = os.path.join(self.tmpdir.name, "complete.pdf")
+        partial = os.path.join(self.tmpdir.name, "partial.pdf")
+        write_pdf(complete)
+        write_pdf(partial, authors=())
+        calls = []
+
+        async def fake_generate(text_context, filename, api_key, model_name, filename_mode, fields=None):
+            calls.append((filename, fields))
+            return {"AU": [{"value": "Doe, J", "confidence": "high"}]}
+
+        # Blank pages have no text layer, so feed a title page for both files
+        title_page = "--- Page 1 ---\nCell Growth in Small Spaces\nJane Doe Ken Sato\nCell 180 (2020)"
+        eng = ProcessingEngine([complete, partial], "key", "test-model", use_cache=False, extract_workers=1,
+                               rate_limits={"rpm": 10**6, "tpm": 10**9})
+        with patch.object(engine, 'generate_ris_data_async', fake_generate), \
+             patch('src.extraction.iter_pages', lambda reader, *a: iter([(0, title_page)])):
+            summary = eng.run()
+
+        self.assertEqual(summary["pdf_metadata"], 1)
+        self.assertEqual(summary["gap_requests"], 1)
+        self.assertEqual(len(calls), 1)
+        filename, fields = calls[0]
+        self.assertEqual(filename, "partial.pdf")
+        self.assertIn("AU", fields)
+        self.assertNotIn("TI", fields)
+        with open(os.path.join(self.tmpdir.name, "partial.ris"), encoding="utf-8") as f:
+            ris = f.read()
+        self.assertIn("TI  - Cell Growth in Small Spaces", ris)
+        self.assertIn("AU  - Doe, J", ris)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+
+# Add src and benchmarks to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+from src import engine as engine_module
+from src.engine import ProcessingEngine
+from src.manifest import FolderManifest
+from src.planner import plan_run, _mean_ci
+from synthetic_corpus import make_corpus
+
+class TestPlanner(unittest.TestCase):
+
+    def test_mean_ci(self):
+        # Full population: exact total, no interval
+        self.assertEqual(_mean_ci([1.0, 3.0], 2), (4.0, 0.0))
+        total, half = _mean_ci([1.0, 3.0, 2.0, 2.0], 1000)
+        self.assertEqual(total, 2000.0)
+        self.assertGreater(half, 0)
+
+    def test_plan_samples_without_api_calls(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = []
+            for i in range(30):
+                path = os.path.join(tmpdir, f"doc{i}.pdf")
+                with open(path, "w") as f:
+                    f.write("not a real pdf") # no text layer -> filename mode
+                files.append(path)
+            with open(os.path.join(tmpdir, "doc0.ris"), "w") as f:
+                f.write("TY  - JOUR\nER  - \n")
+
+            engine = ProcessingEngine(files, "", "gemini-3-pro-preview", use_cache=False, extract_workers=1,
+                                      skip_existing=True, max_workers=1)
+            with patch('src.processor._call_gemini', side_effect=AssertionError("no API calls")):
+                plan = plan_run(engine, ["gemini-3-pro-preview"], sample_size=10, seed=1)
+
+        self.assertEqual(plan["skipped"], 1)
+        self.assertEqual(plan["sampled"], 10)
+        self.assertEqual(plan["filename_mode"], 29)
+        model = plan["models"][0]
+        self.assertEqual(model["requests"], 29)
+        self.assertGreater(model["prompt_tokens"], 0)
+        self.assertGreater(model["eta_seconds"], 0)
+
+    def test_changed_pdf_is_planned_despite_old_ris(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = []
+            for i in range(3):
+                path = os.path.join(tmpdir, f"doc{i}.pdf")
+                with open(path, "w") as f:
+                    f.write("not a real pdf")
+                with open(os.path.join(tmpdir, f"doc{i}.ris"), "w") as f:
+                    f.write("TY  - JOUR\nER  - \n")
+                files.append(path)
+            manifest = FolderManifest.load(tmpdir)
+            for path in files:
+                manifest.record(os.path.basename(path))
+            manifest.save()
+            # doc1 is replaced after its .ris was written: the run regenerates it, so the plan counts it
+            with open(files[1], "w") as f:
+                f.write("not a real pdf, corrected version")
+
+            engine = ProcessingEngine(files, "", "gemini-3-pro-preview", use_cache=False, extract_workers=1,
+                                      skip_existing=True, max_workers=1)
+            plan = plan_run(engine, ["gemini-3-pro-preview"])
+
+        self.assertEqual(plan["skipped"], 2)
+        self.assertEqual(plan["to_process"], 1)
+        self.assertEqual(plan["models"][0]["requests"], 1)
+
+    def test_replanning_processed_folder_does_not_match_own_entries(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = make_corpus(tmpdir, files=3, pages=(2, 2), image_only=0.0, seed=3)
+            index_path = os.path.join(tmpdir, "similarity.sqlite3")
+
+            def make_engine():
+                return ProcessingEngine(files, "key", "gemini-3-pro-preview", use_cache=False, extract_workers=1, use_pdf_metadata=False,
+                                        max_workers=1, rate_limits={"rpm": 10**6, "tpm": 10**9}, similarity_index_path=index_path)
+
+            async def fake_generate(text_context, filename, api_key, model_name, filename_mode):
+                return {"TI": {"value": f"Title of {filename}", "confidence": "high"}}
+
+            with patch.object(engine_module, 'generate_ris_data_async', fake_generate):
+                make_engine().run()
+            # skip_existing off: the run sends every PDF again, so the plan must count them all
+            plan = plan_run(make_engine(), ["gemini-3-pro-preview"])
+
+        self.assertEqual(plan["to_process"], 3)
+        self.assertEqual(plan["models"][0]["requests"], 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.scanner import iter_pdf_files
+
+class TestScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        root = self.tmpdir.name
+        for rel in ["a.pdf", "b.PDF", "notes.txt", "sub/c.pdf", "sub/deeper/d.pdf", "drafts/e.pdf", "sub/f_old.pdf"]:
+            path = os.path.join(root, *rel.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "w").close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def names(self, **kwargs):
+        return [os.path.relpath(p, self.tmpdir.name).replace(os.sep, "/") for p in iter_pdf_files(self.tmpdir.name, **kwargs)]
+
+    def test_flat_scan_ignores_subfolders(self):
+        self.assertEqual(self.names(), ["a.pdf", "b.PDF"])
+
+    def test_recursive_scan_with_globs(self):
+        self.assertEqual(
+            self.names(recursive=True),
+            ["a.pdf", "b.PDF", "drafts/e.pdf", "sub/c.pdf", "sub/f_old.pdf", "sub/deeper/d.pdf"]
+        )
+        self.assertEqual(
+            self.names(recursive=True, exclude=["drafts", "*_old.pdf"]),
+            ["a.pdf", "b.PDF", "sub/c.pdf", "sub/deeper/d.pdf"]
+        )
+        self.assertEqual(self.names(recursive=True, include=["sub/*"]), ["sub/c.pdf", "sub/f_old.pdf", "sub/deeper/d.pdf"])
+
+    def test_is_lazy(self):
+        files = iter_pdf_files(self.tmpdir.name, recursive=True)
+        self.assertEqual(os.path.basename(next(files)), "a.pdf")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import sys
+import os
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.scheduler import RateScheduler
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+    def sleep(self, seconds):
+        self.now += seconds
+
+class TestRateScheduler(unittest.TestCase):
+
+    def make(self, rpm, tpm):
+        clock = FakeClock()
+        return RateScheduler(rpm, tpm, clock=clock, sleep=clock.sleep), clock
+
+    def test_rpm_is_enforced(self):
+        sched, clock = self.make(rpm=60, tpm=10**9)
+        for _ in range(30):
+            sched.acquire()
+        # Burst of 6 seconds' worth, then one request per second
+        self.assertAlmostEqual(clock.now, 24.0, delta=1.0)
+
+    def test_tpm_is_enforced(self):
+        sched, clock = self.make(rpm=10**6, tpm=6000)
+        for _ in range(5):
+            sched.acquire(tokens=600)
+        # 600 token burst, then 100 tokens/sec
+        self.assertAlmostEqual(clock.now, 24.0, delta=1.0)
+
+    def test_rate_shrinks_on_429_and_recovers(self):
+        sched, clock = self.make(rpm=100, tpm=10**9)
+        sched.on_rate_limited()
+        sched.on_rate_limited() # within cooldown: counted once
+        self.assertAlmostEqual(sched.effective_rpm, 50)
+        self.assertEqual(sched.rate_limited_count, 2)
+        for _ in range(20):
+            sched.on_success()
+        self.assertAlmostEqual(sched.effective_rpm, 100)
+
+    def test_acquire_can_be_stopped(self):
+        sched, clock = self.make(rpm=1, tpm=10**9)
+        self.assertTrue(sched.acquire())
+        self.assertFalse(sched.acquire(should_stop=lambda: True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import unittest
+from unittest.mock import patch
+import asyncio
+import random
+import sys
+import os
+import tempfile
+
+# Add src and benchmarks to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+from src import engine
+from src.engine import ProcessingEngine
+from src.processor import dict_to_ris
+from src.similarity import SimilarityIndex, minhash_signature, estimate_similarity, duplicate_record
+from src.writer import RisWriter
+from synthetic_corpus import make_corpus
+
+WORDS = "cell growth protein signal model energy network sample theory structure market policy".split()
+
+def paper(seed, words=600):
+    rng = random.Random(seed)
+    return " ".join(f"{rng.choice(WORDS)}{rng.randint(0, 99)}" for _ in range(words))
+
+def record(title):
+    return {
+        "TY": {"value": "JOUR", "confidence": "high"},
+        "TI": {"value": title, "confidence": "high"},
+        "AU": [{"value": "Doe, Jane", "confidence": "high"}],
+        "PY": {"value": "2020", "confidence": "high"}
+    }
+
+class TestSimilarity(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.tmpdir.name, "similarity.sqlite3")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_signatures_separate_copies_from_other_papers(self):
+        text = paper(1)
+        # Preprint vs. published: a different header and a few edited sentences
+        version = "Journal of Growth 12 (2021) " + text[:1500] + " revised wording here " + text[1600:]
+        self.assertGreater(estimate_similarity(minhash_signature(text), minhash_signature(version)), 0.8)
+        self.assertLess(estimate_similarity(minhash_signature(text), minhash_signature(paper(2))), 0.2)
+        self.assertIsNone(minhash_signature("too short to compare"))
+
+    def test_index_persists_across_runs(self):
+        text = paper(3)
+        index = SimilarityIndex(self.index_path)
+        index.add(minhash_signature(text), record("Cell Growth"), "original.pdf")
+        index.add(minhash_signature(paper(4)), record("Other"), "other.pdf")
+        index.close()
+
+        index = SimilarityIndex(self.index_path)
+        found = index.lookup(minhash_signature(text + " supplementary copy"))
+        self.assertIsNotNone(found)
+        data, similarity, filename = found
+        self.assertEqual(data["TI"]["value"], "Cell Growth")
+        self.assertEqual(filename, "original.pdf")
+        self.assertIsNone(index.lookup(minhash_signature(paper(5))))
+        self.assertEqual(len(index), 2)
+        index.close()
+
+    def test_document_never_matches_itself(self):
+        text = paper(7)
+        index = SimilarityIndex(self.index_path)
+        index.add(minhash_signature(text), record("First"), "a.pdf", "/docs/a.pdf", "hash-a")
+        self.assertIsNone(index.lookup(minhash_signature(text), "/docs/a.pdf", "hash-new"))
+        self.assertIsNone(index.lookup(minhash_signature(text), "/docs/copy.pdf", "hash-a"))
+        self.assertEqual(index.lookup(minhash_signature(text), "/docs/copy.pdf", "hash-b")[2], "a.pdf")
+
+        # Re-indexing a path replaces its entry
+        index.add(minhash_signature(text + " corrected"), record("Second"), "a.pdf", "/docs/a.pdf", "hash-a2")
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.lookup(minhash_signature(text), "/docs/b.pdf")[0]["TI"]["value"], "Second")
+        index.close()
+
+    def test_rerun_does_not_reuse_own_record(self):
+        files = make_corpus(self.tmpdir.name, files=2, pages=(2, 2), image_only=0.0, seed=8)
+        calls = []
+
+        async def fake_generate(text_context, filename, api_key, model_name, filename_mode):
+            calls.append(filename)
+            return record(f"Title of {filename}")
+
+        with patch.object(engine, 'generate_ris_data_async', fake_generate):
+            for _ in range(2):
+                summary = ProcessingEngine(files, "key", "test-model", use_cache=False, extract_workers=1, use_pdf_metadata=False,
+                                           rate_limits={"rpm": 10**6, "tpm": 10**9}, similarity_index_path=self.index_path).run()
+        self.assertEqual(summary["near_duplicates"], 0)
+        self.assertEqual(len(calls), 4)
+        with open(os.path.splitext(files[0])[0] + ".ris", encoding="utf-8") as f:
+            self.assertNotIn("DUPLICATE", f.read())
+
+    def test_renamed_file_does_not_reuse_own_record(self):
+        files = make_corpus(self.tmpdir.name, files=1, pages=(2, 2), image_only=0.0, seed=9)
+        calls = []
+
+        async def fake_generate(text_context, filename, api_key, model_name, filename_mode):
+            calls.append(filename)
+            return record(f"Title of {filename}")
+
+        def run(path):
+            # No result cache and no manifest: the content hash is still computed for the index
+            return ProcessingEngine([path], "key", "test-model", use_cache=False, use_manifest=False, extract_workers=1, use_pdf_metadata=False,
+                                    rate_limits={"rpm": 10**6, "tpm": 10**9}, similarity_index_path=self.index_path).run()
+
+        renamed = os.path.join(os.path.dirname(files[0]), "renamed.pdf")
+        with patch.object(engine, 'generate_ris_data_async', fake_generate):
+            run(files[0])
+            os.replace(files[0], renamed)
+            summary = run(renamed)
+        self.assertEqual(summary["near_duplicates"], 0)
+        self.assertEqual(calls, [os.path.basename(files[0]), "renamed.pdf"])
+
+    def test_duplicate_note(self):
+        ris = dict_to_ris(duplicate_record(record("Cell Growth"), "original.pdf", 0.93))
+        self.assertIn("N1  - DUPLICATE: metadata reused from original.pdf (similarity 0.93)", ris)
+
+    def test_engine_reuses_record_for_copy(self):
+        files = [os.path.join(self.tmpdir.name, name) for name in ("paper.pdf", "paper (1).pdf")]
+        calls = []
+
+        async def fake_generate(text_context, filename, api_key, model_name, filename_mode):
+            calls.append(filename)
+            return record("Cell Growth")
+
+        eng = ProcessingEngine(files, "key", "test-model", use_cache=False, extract_workers=1,
+                               rate_limits={"rpm": 10**6, "tpm": 10**9}, similarity_index_path=self.index_path)
+        text = paper(6)
+
+        async def run_both():
+            eng._writer = RisWriter()
+            eng._writer.start()
+            eng._similarity_index = SimilarityIndex(self.index_path)
+            try:
+                results = []
+                for i, path in enumerate(files):
+                    doc = {"text": text, "content_hash": None, "signature": minhash_signature(text)}
+                    results.append(await eng._process_single_file(path, doc, i, len(files)))
+                return results
+            finally:
+                eng._similarity_index.close()
+                eng._writer.close()
+
+        with patch.object(engine, 'generate_ris_data_async', fake_generate):
+            first, second = asyncio.run(run_both())
+
+        self.assertEqual(calls, ["paper.pdf"])
+        self.assertEqual(second["source"], "near_duplicate")
+        self.assertEqual(second["duplicate_of"], "paper.pdf")
+        with open(os.path.join(self.tmpdir.name, "paper (1).ris"), encoding="utf-8") as f:
+            ris = f.read()
+        self.assertIn("TI  - Cell Growth", ris)
+        self.assertIn("N1  - DUPLICATE: metadata reused from paper.pdf", ris)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+from unittest.mock import patch
+import json
+import sys
+import os
+import tempfile
+import urllib.request
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import engine
+from src.engine import ProcessingEngine
+from src.telemetry import Telemetry
+
+class TestTelemetry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_spans_and_prometheus_text(self):
+        trace = os.path.join(self.tmpdir.name, "trace.jsonl")
+        metrics = os.path.join(self.tmpdir.name, "metrics.prom")
+        telemetry = Telemetry(trace, metrics).start()
+        with telemetry.span("api", "a.pdf", prompt_tokens=100) as span:
+            span["attempts"] = 2
+        with self.assertRaises(ValueError):
+            with telemetry.span("write", "a.pdf"):
+                raise ValueError("disk full")
+        telemetry.inc("files_total", status="success")
+        telemetry.close()
+
+        with open(trace, encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([l["stage"] for l in lines], ["api", "write"])
+        self.assertEqual(lines[0]["attempts"], 2)
+        self.assertEqual(lines[0]["prompt_tokens"], 100)
+        self.assertEqual(lines[1]["error"], "disk full")
+
+        with open(metrics, encoding="utf-8") as f:
+            text = f.read()
+        self.assertIn('risgen_files_total{status="success"} 1', text)
+        self.assertIn('risgen_stage_seconds_count{stage="api"} 1', text)
+        self.assertIn('risgen_stage_seconds_bucket{le="+Inf",stage="write"} 1', text)
+
+    def test_metrics_endpoint(self):
+        telemetry = Telemetry(metrics_port=0).start()
+        try:
+            telemetry.inc("api_retries_total")
+            port = telemetry._server.server_address[1]
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+                self.assertIn("risgen_api_retries_total 1", response.read().decode("utf-8"))
+        finally:
+            telemetry.close()
+
+    def test_engine_traces_every_stage(self):
+        path = os.path.join(self.tmpdir.name, "doc.pdf")
+        with open(path, "w") as f:
+            f.write("not a real pdf") # no text layer -> filename mode
+        trace = os.path.join(self.tmpdir.name, "trace.jsonl")
+        attempts = []
+
+        async def flaky_generate(text_context, filename, api_key, model_name, filename_mode):
+            attempts.append(filename)
+            if len(attempts) == 1:
+                raise Exception("503 overloaded")
+            return {"TI": {"value": "Title", "confidence": "low"}, "AU": [{"value": "Doe, J", "confidence": "low"}]}
+
+        eng = ProcessingEngine([path], "key", "test-model", use_cache=False, extract_workers=1,
+                               rate_limits={"rpm": 10**6, "tpm": 10**9}, trace_path=trace)
+        with patch.object(engine, 'generate_ris_data_async', flaky_generate), \
+             patch.object(engine, 'backoff_delay', lambda *a, **k: 0):
+            summary = eng.run()
+
+        with open(trace, encoding="utf-8") as f:
+            spans = [json.loads(line) for line in f]
+        self.assertEqual({span["stage"] for span in spans}, {"scan", "extract", "queue", "api", "postprocess", "write"})
+        # The 503 frees the slot and is retried from the deferred queue: one span per attempt
+        api = [span for span in spans if span["stage"] == "api"]
+        self.assertEqual([span["attempts"] for span in api], [1, 2])
+        self.assertIn("deferred_seconds", api[0])
+        self.assertGreater(summary["stage_seconds"]["extract"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
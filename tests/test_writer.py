@@ -0,0 +1,78 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import asyncio
+import tempfile
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import engine
+from src.engine import ProcessingEngine
+from src.writer import RisWriter
+
+class TestRisWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_atomic_writes_and_library(self):
+        existing = os.path.join(self.dir, "old.ris")
+        with open(existing, "w", encoding="utf-8") as f:
+            f.write("TY  - BOOK\nER  - \n")
+        library = os.path.join(self.dir, "library.ris")
+        writer = RisWriter(library_path=library, batch_size=2)
+        writer.start()
+
+        async def write_all():
+            await asyncio.gather(*[writer.write(os.path.join(self.dir, f"doc{i}.ris"), f"TY  - JOUR\nTI  - Doc {i}\nER  - \n") for i in range(5)])
+        asyncio.run(write_all())
+        writer.add_to_library(existing)
+        writer.close()
+
+        self.assertEqual(writer.written, 5)
+        self.assertEqual(writer.library_records, 6)
+        self.assertFalse([name for name in os.listdir(self.dir) if name.endswith((".tmp", ".part"))])
+        with open(library, encoding="utf-8") as f:
+            content = f.read()
+        self.assertEqual(content.count("ER  - "), 6)
+        self.assertIn("TY  - BOOK", content)
+
+    def test_failed_write_raises(self):
+        writer = RisWriter()
+        writer.start()
+        missing = os.path.join(self.dir, "no_such_dir", "doc.ris")
+        with self.assertRaises(OSError):
+            asyncio.run(writer.write(missing, "TY  - JOUR\nER  - \n"))
+        writer.close()
+
+    def test_engine_writes_library(self):
+        files = []
+        for i in range(3):
+            path = os.path.join(self.dir, f"doc{i}.pdf")
+            with open(path, "w") as f:
+                f.write("not a real pdf")
+            files.append(path)
+
+        async def fake_generate(text_context, filename, api_key, model_name, filename_mode):
+            return {"TI": {"value": f"Title of {filename}", "confidence": "high"}, "AU": [{"value": "Doe, J", "confidence": "high"}]}
+
+        library = os.path.join(self.dir, "library.ris")
+        eng = ProcessingEngine(files, "key", "test-model", use_cache=False, extract_workers=1,
+                               rate_limits={"rpm": 10**6, "tpm": 10**9}, library_path=library)
+        with patch.object(engine, 'generate_ris_data_async', fake_generate):
+            summary = eng.run()
+
+        self.assertEqual(summary["failed"], 0)
+        for path in files:
+            self.assertTrue(os.path.exists(os.path.splitext(path)[0] + ".ris"))
+        with open(library, encoding="utf-8") as f:
+            self.assertEqual(f.read().count("TI  - Title of"), 3)
+
+if __name__ == '__main__':
+    unittest.main()